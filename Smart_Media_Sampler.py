@@ -1,19 +1,2507 @@
 import os
 import random
+import math
+import re
+import copy
+import fnmatch
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import heapq
 import shutil
 import json
-import pickle
+import mmap
+import array
 import hashlib
+import sqlite3
+import itertools
 from pathlib import Path
 from datetime import datetime, timedelta
 import argparse
 import sys
 import time
 from collections import defaultdict
+from collections.abc import Mapping
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+from contextlib import contextmanager
+import queue
+import subprocess
+import atexit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+class LocalFilesystem:
+    """Directory listing backend used by the scanners"""
+    
+    def scandir(self, path):
+        return os.scandir(path)
+    
+    def stat(self, path):
+        return os.stat(path)
+    
+    def read_head(self, path, size):
+        """First size bytes of a file"""
+        with open(path, 'rb') as f:
+            return f.read(size)
+
+
+class SimulatedLatencyFilesystem(LocalFilesystem):
+    """Local filesystem stand-in that adds a fixed delay to every metadata operation.
+    
+    Each directory listing, stat and header read sleeps for `latency` seconds before hitting
+    the real disk, mimicking an SMB/NFS mount so scan engines can be benchmarked
+    against a local tree.
+    """
+    
+    def __init__(self, latency):
+        self.latency = latency
+    
+    def stat(self, path):
+        time.sleep(self.latency)
+        return os.stat(path)
+    
+    def read_head(self, path, size):
+        time.sleep(self.latency)
+        return super().read_head(path, size)
+    
+    @contextmanager
+    def scandir(self, path):
+        time.sleep(self.latency)
+        with os.scandir(path) as entries:
+            yield (DelayedStatEntry(entry, self.latency) for entry in entries)
+
+
+class DelayedStatEntry:
+    """DirEntry wrapper whose stat() pays the simulated latency"""
+    
+    def __init__(self, entry, latency):
+        self._entry = entry
+        self._latency = latency
+    
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+    
+    def stat(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._entry.stat(*args, **kwargs)
+
+
+class FileRecord(dict):
+    """File record whose derived fields are computed the first time they're read.
+    
+    Scanners and caches store the raw stat times; the 'created'/'modified'
+    datetimes and the media 'type' are only built for records something asks
+    about, and the fields parsed from file contents (METADATA_FIELDS) are read
+    through the selector's metadata cache on first access. Once computed, a field
+    is an ordinary dict entry. get() goes through the same path, since dict.get
+    bypasses __missing__.
+    """
+    __slots__ = ('mtime', 'ctime', 'selector', 'parsed')
+    
+    def __init__(self, fields=(), mtime=None, ctime=None, selector=None):
+        super().__init__(fields)
+        self.mtime = mtime
+        self.ctime = ctime
+        self.selector = selector
+        self.parsed = False
+    
+    def __reduce__(self):
+        # Copies and other processes get a plain dict with the stat-derived fields filled in
+        for key in ('modified', 'created', 'type'):
+            self.get(key)
+        return dict, (dict(self),)
+    
+    def __missing__(self, key):
+        if key == 'modified' and self.mtime is not None:
+            value = datetime.fromtimestamp(self.mtime)
+        elif key == 'created' and self.ctime is not None:
+            value = datetime.fromtimestamp(self.ctime)
+        elif key == 'type' and self.selector is not None:
+            value = self.selector.get_media_type(self['extension'])
+        elif key in MediaFileSelector.METADATA_FIELDS and self.selector is not None and not self.parsed:
+            self.selector.load_media_metadata([self], (key,))
+            self.parsed = True
+            if key in self:
+                return dict.__getitem__(self, key)
+            raise KeyError(key)
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    @staticmethod
+    def timestamps(file_data):
+        """(mtime, ctime) of any record as epoch seconds, without building datetimes"""
+        if isinstance(file_data, FileRecord) and file_data.mtime is not None:
+            return file_data.mtime, file_data.ctime
+        return file_data['modified'].timestamp(), file_data['created'].timestamp()
+
+
+class DirectoryTree:
+    """Per-directory scan results with the directory mtime they were listed at.
+    
+    A rescan stats each directory and reuses the cached file records and
+    subdirectory list when its mtime is unchanged, so only directories where
+    entries were added, removed or renamed are listed again. Files modified in
+    place don't touch their directory's mtime and keep their cached record until
+    the directory changes.
+    
+    Fallbacks are caches of overlapping roots (a parent or nested source folder)
+    whose entries are reused when the folder's own cache is missing or stale.
+    """
+    
+    def __init__(self, filesystem, previous=None, fallbacks=()):
+        self.filesystem = filesystem
+        self.previous = previous or {}
+        self.fallbacks = fallbacks
+        self.dirs = {}  # dir path -> (mtime_ns, subdirs, file records)
+        self.reused = 0
+        self.relisted = 0
+        self.lock = threading.Lock()
+    
+    def lookup(self, dir_path):
+        """Return (files, subdirs, mtime_ns); files is None if the directory must be listed"""
+        try:
+            mtime_ns = self.filesystem.stat(dir_path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        cached = self.previous.get(dir_path)
+        if mtime_ns is not None and (cached is None or cached[0] != mtime_ns):
+            for fallback in self.fallbacks:
+                candidate = fallback.get(dir_path)
+                if candidate is not None and candidate[0] == mtime_ns:
+                    cached = candidate
+                    break
+        if mtime_ns is not None and cached is not None and cached[0] == mtime_ns:
+            with self.lock:
+                self.dirs[dir_path] = cached
+                self.reused += 1
+            return cached[2], cached[1], mtime_ns
+        return None, None, mtime_ns
+    
+    def record(self, dir_path, mtime_ns, files, subdirs):
+        with self.lock:
+            self.dirs[dir_path] = (mtime_ns, subdirs, files)
+            self.relisted += 1
+    
+    def previous_files(self):
+        """All file records of the cached tree, without checking it against the disk"""
+        return [file_data for _, _, files in self.previous.values() for file_data in files]
+    
+    def files(self):
+        """All file records of the current tree"""
+        return [file_data for _, _, files in self.dirs.values() for file_data in files]
+    
+    # In-place updates, used by LiveIndexWatcher to apply filesystem events
+    
+    def refresh_mtime(self, dir_path):
+        entry = self.dirs.get(dir_path)
+        if entry is not None:
+            try:
+                mtime_ns = self.filesystem.stat(dir_path).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            self.dirs[dir_path] = (mtime_ns, entry[1], entry[2])
+    
+    def put_file(self, dir_path, file_data):
+        entry = self.dirs.get(dir_path)
+        if entry is not None:
+            name = file_data['path'].name
+            files = [f for f in entry[2] if f['path'].name != name]
+            files.append(file_data)
+            self.dirs[dir_path] = (entry[0], entry[1], files)
+    
+    def remove_file(self, dir_path, name):
+        entry = self.dirs.get(dir_path)
+        if entry is not None:
+            self.dirs[dir_path] = (entry[0], entry[1], [f for f in entry[2] if f['path'].name != name])
+    
+    def add_subdir(self, dir_path, subdir):
+        entry = self.dirs.get(dir_path)
+        if entry is not None and subdir not in entry[1]:
+            self.dirs[dir_path] = (entry[0], entry[1] + [subdir], entry[2])
+    
+    def remove_subtree(self, dir_path):
+        """Forget a directory and everything below it, returning the removed paths"""
+        parent = os.path.dirname(dir_path)
+        entry = self.dirs.get(parent)
+        if entry is not None:
+            self.dirs[parent] = (entry[0], [d for d in entry[1] if d != dir_path], entry[2])
+        prefix = dir_path + os.sep
+        removed = [d for d in self.dirs if d == dir_path or d.startswith(prefix)]
+        for d in removed:
+            del self.dirs[d]
+        return removed
+
+
+class ColumnarTreeCache(Mapping):
+    """DirectoryTree mapping read from a memory-mapped columnar cache file.
+    
+    The file is a magic number, live_until (a float64 slot, the only part ever
+    rewritten in place), a JSON header (source root, scope, when the tree was last
+    verified against the disk, code tables and where each column is) and 8-byte aligned columns:
+        
+        dir_mtime      int64[D]    directory mtime_ns, -1 if unknown
+        dir_parent     int64[D]    index of the parent directory, -1 for the root
+        dir_files      int64[D+1]  first file of each directory (files are grouped by directory)
+        dir_names      int64[D+1]  offsets of the directory paths in dir_heap
+        size           int64[N]
+        mtime, ctime   int64[N]    microseconds since the epoch
+        device, inode  int64[N]    st_dev and st_ino, to recognise the same file under other paths
+        extension      uint8[N]    index into the header's extensions
+        type           uint8[N]    index into the header's types
+        name_offsets   int64[N+1]  offsets of the file names in name_heap
+        extra_offsets  int64[N+1]  offsets in extra_heap of JSON for any other record fields
+    
+    Opening maps the file without reading the columns. File records are only
+    built for the directories that are looked up, and filtered_totals works on
+    the columns directly.
+    """
+    MAGIC = b'SMSCOL04'
+    selector = None  # Set by the MediaFileSelector that loaded it, for lazy metadata in records
+    INT_COLUMNS = ('dir_mtime', 'dir_parent', 'dir_files', 'dir_names', 'size', 'mtime', 'ctime', 'device',
+                   'inode', 'name_offsets', 'extra_offsets')
+    CODE_COLUMNS = ('extension', 'type')
+    HEAPS = ('dir_heap', 'name_heap', 'extra_heap')
+    
+    def __init__(self, cache_file):
+        with open(cache_file, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError(f"{cache_file} is not a columnar scan cache")
+        header_length = struct.unpack_from('<Q', self.map, len(self.MAGIC) + 8)[0]
+        start = len(self.MAGIC) + 16
+        self.header = json.loads(self.map[start:start + header_length].decode('utf-8'))
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{cache_file} was written on a machine with a different byte order")
+        self.root = self.header.get('root')
+        self.scope = self.header['scope']
+        self.verified_at = self.header.get('verified_at', 0)
+        self.extensions = self.header['extensions']
+        self.types = self.header['types']
+        
+        view = memoryview(self.map)
+        self.columns = {}
+        for name, (offset, typecode, count) in self.header['columns'].items():
+            self.columns[name] = view[offset:offset + count * struct.calcsize(typecode)].cast(typecode)
+        for name, (offset, length) in self.header['heaps'].items():
+            self.columns[name] = view[offset:offset + length]
+        self.index = None
+        self.subdirs = None
+    
+    @property
+    def live_until(self):
+        """Read from the map each time, so heartbeats written after opening are seen"""
+        return struct.unpack_from('<d', self.map, len(self.MAGIC))[0]
+    
+    @classmethod
+    def write(cls, cache_file, dirs, scope=None, live_until=0, root=None, verified_at=0):
+        """Write a DirectoryTree mapping as a columnar cache file, replacing it atomically"""
+        columns = {name: array.array('q') for name in cls.INT_COLUMNS}
+        columns.update({name: array.array('B') for name in cls.CODE_COLUMNS})
+        heaps = {name: bytearray() for name in cls.HEAPS}
+        extensions = {}
+        types = {}
+        
+        dir_paths = list(dirs)
+        dir_index = {path: i for i, path in enumerate(dir_paths)}
+        parents = {}
+        for path, (_, subdirs, _) in dirs.items():
+            for subdir in subdirs:
+                parents[subdir] = dir_index[path]
+        for name in ('dir_files', 'dir_names', 'name_offsets', 'extra_offsets'):
+            columns[name].append(0)
+        
+        for path in dir_paths:
+            mtime_ns, _, files = dirs[path]
+            columns['dir_mtime'].append(-1 if mtime_ns is None else mtime_ns)
+            columns['dir_parent'].append(parents.get(path, -1))
+            heaps['dir_heap'] += os.fsencode(path)
+            columns['dir_names'].append(len(heaps['dir_heap']))
+            # Whole directories at a time, this is the hot loop for large caches
+            columns['size'].extend([f['size'] for f in files])
+            times = [FileRecord.timestamps(f) for f in files]
+            columns['mtime'].extend([round(mtime * 1e6) for mtime, _ in times])
+            columns['ctime'].extend([round(ctime * 1e6) for _, ctime in times])
+            columns['device'].extend([f['device'] for f in files])
+            columns['inode'].extend([f['inode'] for f in files])
+            columns['extension'].extend([extensions.setdefault(f['extension'], len(extensions)) for f in files])
+            columns['type'].extend([types.setdefault(f.get('type', 'unknown'), len(types)) for f in files])
+            names = [os.fsencode(f['path'].name) for f in files]
+            extras = [json.dumps({key: value for key, value in f.items() if key not in MediaIndex.RECORD_FIELDS},
+                                 default=str).encode('utf-8') if not f.keys() <= MediaIndex.RECORD_FIELDS else b''
+                      for f in files]
+            for heap, offsets, parts in (('name_heap', 'name_offsets', names), ('extra_heap', 'extra_offsets', extras)):
+                start = len(heaps[heap])
+                columns[offsets].extend([start + end for end in itertools.accumulate(map(len, parts))])
+                heaps[heap] += b''.join(parts)
+            columns['dir_files'].append(len(columns['size']))
+        
+        # Lay the columns out after the header, each on an 8-byte boundary
+        blobs = [(name, column.tobytes()) for name, column in columns.items()]
+        blobs += [(name, bytes(heap)) for name, heap in heaps.items()]
+        header = {'byteorder': sys.byteorder, 'root': root, 'scope': scope, 'verified_at': verified_at,
+                  'extensions': list(extensions), 'types': list(types), 'columns': {}, 'heaps': {}}
+        # Offsets depend on the header length, which depends on the offsets
+        encoded = b''
+        while True:
+            offset = len(cls.MAGIC) + 16 + len(encoded)
+            for name, blob in blobs:
+                offset += -offset % 8
+                if name in columns:
+                    header['columns'][name] = [offset, columns[name].typecode, len(columns[name])]
+                else:
+                    header['heaps'][name] = [offset, len(blob)]
+                offset += len(blob)
+            previous_length = len(encoded)
+            encoded = json.dumps(header).encode('utf-8')
+            if len(encoded) == previous_length:
+                break
+        
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, 'wb') as f:
+                f.write(cls.MAGIC + struct.pack('<dQ', live_until, len(encoded)) + encoded)
+                for name, blob in blobs:
+                    offset = header['columns'][name][0] if name in columns else header['heaps'][name][0]
+                    f.write(b'\0' * (offset - f.tell()))
+                    f.write(blob)
+            # Readers may have the old file mapped, so it must be replaced, never rewritten
+            os.replace(temp_file, cache_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.unlink(temp_file)
+    
+    @classmethod
+    def set_live_until(cls, cache_file, live_until):
+        """Update live_until in place: one aligned 8-byte write that mapped readers see whole"""
+        with open(cache_file, 'r+b') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"{cache_file} is not a columnar scan cache")
+            f.seek(len(cls.MAGIC))
+            f.write(struct.pack('<d', live_until))
+    
+    def load_index(self):
+        """Decode the directory paths (not the files) on first use"""
+        if self.index is not None:
+            return
+        offsets = self.columns['dir_names']
+        heap = self.columns['dir_heap']
+        paths = [os.fsdecode(bytes(heap[offsets[i]:offsets[i + 1]])) for i in range(len(offsets) - 1)]
+        subdirs = [[] for _ in paths]
+        for i, parent in enumerate(self.columns['dir_parent']):
+            if parent >= 0:
+                subdirs[parent].append(paths[i])
+        self.subdirs = subdirs
+        self.index = {path: i for i, path in enumerate(paths)}
+    
+    def __len__(self):
+        return len(self.columns['dir_mtime'])
+    
+    def __iter__(self):
+        self.load_index()
+        return iter(self.index)
+    
+    def __getitem__(self, dir_path):
+        self.load_index()
+        i = self.index[dir_path]
+        mtime_ns = self.columns['dir_mtime'][i]
+        files = [self.record(dir_path, j)
+                 for j in range(self.columns['dir_files'][i], self.columns['dir_files'][i + 1])]
+        return (None if mtime_ns < 0 else mtime_ns), self.subdirs[i], files
+    
+    def record(self, dir_path, j):
+        """Build the file record of file j"""
+        columns = self.columns
+        name = os.fsdecode(bytes(columns['name_heap'][columns['name_offsets'][j]:columns['name_offsets'][j + 1]]))
+        file_info = FileRecord({
+            'path': Path(dir_path, name),
+            'size': columns['size'][j],
+            'extension': self.extensions[columns['extension'][j]],
+            'device': columns['device'][j],
+            'inode': columns['inode'][j],
+            'type': self.types[columns['type'][j]]
+        }, columns['mtime'][j] / 1e6, columns['ctime'][j] / 1e6, self.selector)
+        extra_start, extra_end = columns['extra_offsets'][j], columns['extra_offsets'][j + 1]
+        if extra_end > extra_start:
+            file_info.update(json.loads(bytes(columns['extra_heap'][extra_start:extra_end]).decode('utf-8')))
+        return file_info
+    
+    def filtered_totals(self, selector, filters=None, under=None):
+        """(count, total bytes) of the files passing the content filters, without building records.
+        
+        With under, only files in that directory and below count.
+        """
+        scan_filter = ScanFilter(selector, filters)
+        allowed_types = set((filters or {}).get('media_types') or self.types)
+        extension_ok = [ext in scan_filter.extensions for ext in self.extensions]
+        type_ok = [media_type in allowed_types for media_type in self.types]
+        low_size = scan_filter.min_size if scan_filter.min_size is not None else -1
+        high_size = scan_filter.max_size if scan_filter.max_size is not None else float('inf')
+        low_mtime = scan_filter.min_mtime * 1e6 if scan_filter.min_mtime is not None else float('-inf')
+        high_mtime = scan_filter.max_mtime * 1e6 if scan_filter.max_mtime is not None else float('inf')
+        count = total = 0
+        columns = self.columns
+        if under is None:
+            ranges = [(0, len(columns['size']))]
+        else:
+            self.load_index()
+            starts = columns['dir_files']
+            ranges = [(starts[i], starts[i + 1]) for path, i in self.index.items()
+                      if path == under or path_is_inside(path, under)]
+        for start, end in ranges:
+            for size, mtime, extension, media_type in zip(columns['size'][start:end], columns['mtime'][start:end],
+                                                          columns['extension'][start:end], columns['type'][start:end]):
+                if (extension_ok[extension] and type_ok[media_type] and low_size <= size <= high_size
+                        and low_mtime <= mtime <= high_mtime):
+                    count += 1
+                    total += size
+        return count, total
+
+
+class ScanCacheStore:
+    """Scan caches of all source folders, kept in one directory outside the scanned trees.
+    
+    Each source folder's cache is named after a hash of its canonical path and
+    one of its scope rules, so read-only mounts work, archives stay clean, every
+    job on the host shares the same warm cache and jobs with different
+    include/exclude/depth rules keep a cache each. Writes go to a temp file that is renamed over the cache,
+    and an fcntl lock per cache serialises writers and keeps readers from opening
+    a cache while it is being replaced. Without fcntl (Windows) the rename alone
+    keeps readers safe.
+    
+    A JSON manifest records each cache's root and scope, when it was last used
+    and its hit counts. Uses are counted in memory and merged into the manifest
+    in one locked update when the run exits (see flush), so reading caches never
+    writes. After every write, caches of source folders that no longer exist are
+    deleted, then the least recently used ones until the store fits its budget.
+    """
+    MANIFEST = 'manifest.json'
+    LEGACY_CACHES = ('.media_cache.pkl', '.media_cache.col')  # Kept inside the source folders by older versions
+    
+    def __init__(self, cache_dir, budget=None):
+        self.cache_dir = Path(cache_dir)
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.usage = {}  # Cache file name -> uses not in the manifest yet
+        atexit.register(self.flush)
+    
+    @staticmethod
+    def canonical(folder):
+        return os.path.realpath(folder)
+    
+    def cache_file(self, folder, scope=None):
+        root = self.canonical(folder)
+        digest = hashlib.sha1(os.fsencode(root)).hexdigest()[:16]
+        scope_digest = hashlib.sha1(json.dumps(scope).encode('utf-8')).hexdigest()[:8]
+        return self.cache_dir / f"{os.path.basename(root) or 'root'}-{digest}-{scope_digest}.col"
+    
+    @contextmanager
+    def locked(self, lock_path, exclusive=False, blocking=True):
+        """Hold an fcntl lock (shared for readers, exclusive for writers).
+        
+        Yields True, or False without waiting if blocking is off and another process
+        holds it. Lock files are deleted with their cache (see remove), so a lock
+        taken on a file that was unlinked meanwhile is dropped and taken again on
+        the file now at lock_path.
+        """
+        if fcntl is None:
+            yield True
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        mode = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+        while True:
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, mode)
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    try:
+                        current = os.stat(lock_path).st_ino
+                    except FileNotFoundError:
+                        current = None
+                    if current != os.fstat(lock_file.fileno()).st_ino:
+                        continue
+                    yield True
+                    return
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def cache_lock(self, cache_file, exclusive=False):
+        return self.locked(Path(cache_file).with_suffix('.lock'), exclusive)
+    
+    def read_manifest(self):
+        """The manifest as last written; no lock needed, since it is only ever replaced whole"""
+        try:
+            with open(self.cache_dir / self.MANIFEST) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    @contextmanager
+    def manifest(self):
+        """Read-modify-write access to the manifest, under the store-wide lock"""
+        manifest_file = self.cache_dir / self.MANIFEST
+        with self.locked(manifest_file.with_suffix('.lock'), exclusive=True):
+            manifest = self.read_manifest()
+            yield manifest
+            temp_file = f"{manifest_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(manifest, f, indent=1)
+            os.replace(temp_file, manifest_file)
+    
+    def record_use(self, cache_file, root, scope, **counts):
+        """Mark a cache as just used and add to its counters (in memory until flush)"""
+        with self.lock:
+            use = self.usage.setdefault(Path(cache_file).name, {'counts': defaultdict(int)})
+            # Scopes as they read back from the manifest
+            use.update({'root': root, 'scope': json.loads(json.dumps(scope)), 'last_used': time.time()})
+            for key, count in counts.items():
+                use['counts'][key] += count
+    
+    @staticmethod
+    def apply_use(entry, use):
+        entry.update({key: use[key] for key in ('root', 'scope', 'last_used')})
+        for key, count in use['counts'].items():
+            entry[key] = entry.get(key, 0) + count
+    
+    def flush(self):
+        """Merge the uses recorded since the last flush into the manifest, in one update"""
+        with self.lock:
+            usage, self.usage = self.usage, {}
+        if not usage:
+            return
+        try:
+            with self.manifest() as manifest:
+                for name, use in usage.items():
+                    self.apply_use(manifest.setdefault(name, {}), use)
+        except OSError:
+            pass  # Usage stats only, not worth failing a run over
+    
+    def load(self, folder, scope=None):
+        """Map a folder's cache, or return None if there is none for these scope rules"""
+        cache_file = self.cache_file(folder, scope)
+        cache = None
+        if cache_file.exists():
+            with self.cache_lock(cache_file):
+                # Once mapped, the cache stays valid even if a writer replaces the file
+                cache = ColumnarTreeCache(cache_file)
+            # The header is JSON, so compare scopes the way they round-trip
+            if cache.scope != json.loads(json.dumps(scope)):
+                cache = None
+        self.record_use(cache_file, self.canonical(folder), scope, hits=int(cache is not None),
+                        misses=int(cache is None))
+        return cache
+    
+    def overlapping(self, folder, scope=None):
+        """Caches of other roots above or below folder, scanned with the same scope rules,
+        whose directory entries a scan of folder can reuse"""
+        if not ScanFilter.scope_is_portable(scope):
+            return []
+        root = self.canonical(folder)
+        caches = []
+        for entry in self.entries():
+            other = entry['root']
+            if other is None or not (path_is_inside(root, other) or path_is_inside(other, root)):
+                continue
+            if entry['scope'] != json.loads(json.dumps(scope)):
+                continue
+            try:
+                with self.cache_lock(entry['file']):
+                    cache = ColumnarTreeCache(entry['file'])
+            except (OSError, ValueError):
+                continue
+            if cache.scope == json.loads(json.dumps(scope)):
+                caches.append(cache)
+                self.record_use(entry['file'], other, scope, shared=1)
+        return caches
+    
+    @contextmanager
+    def refreshing(self, folder, scope=None):
+        """Claim the right to refresh a folder's cache; yields False if another process has it"""
+        with self.locked(self.cache_file(folder, scope).with_suffix('.refresh'), exclusive=True,
+                         blocking=False) as claimed:
+            yield claimed
+    
+    def save(self, folder, dirs, scope=None, live_until=0, reused=0, relisted=0, verified_at=None):
+        """Write a folder's cache; reused/relisted count directories served from the old one, and
+        verified_at is when the walk that produced dirs started (default: now)"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        cache_file = self.cache_file(folder, scope)
+        with self.cache_lock(cache_file, exclusive=True):
+            ColumnarTreeCache.write(cache_file, dirs, scope, live_until, self.canonical(folder),
+                                    time.time() if verified_at is None else verified_at)
+        self.record_use(cache_file, self.canonical(folder), scope, reused_dirs=reused, relisted_dirs=relisted)
+        self.collect(keep=cache_file.name)
+    
+    def heartbeat(self, folder, scope=None, live_until=0):
+        """Renew the live_until of a folder's cache without rewriting it; False if there
+        is no cache for these scope rules to renew"""
+        cache_file = self.cache_file(folder, scope)
+        try:
+            with self.cache_lock(cache_file, exclusive=True):
+                if ColumnarTreeCache(cache_file).scope != json.loads(json.dumps(scope)):
+                    return False
+                ColumnarTreeCache.set_live_until(cache_file, live_until)
+        except (OSError, ValueError):
+            return False
+        return True
+    
+    def entries(self):
+        """Every cache in the store with its manifest data (and uses not flushed yet) and size on disk"""
+        manifest = self.read_manifest()
+        with self.lock:
+            usage = copy.deepcopy(self.usage)
+        entries = []
+        for cache_file in self.cache_dir.glob('*.col'):
+            entry = dict(manifest.get(cache_file.name, {}))
+            if cache_file.name in usage:
+                self.apply_use(entry, usage[cache_file.name])
+            try:
+                stat = cache_file.stat()
+            except OSError:
+                continue  # Evicted by another process
+            if 'root' not in entry or 'scope' not in entry:
+                try:
+                    cache = ColumnarTreeCache(cache_file)
+                    entry.setdefault('root', cache.root)
+                    entry.setdefault('scope', cache.scope)
+                except (OSError, ValueError, KeyError):
+                    entry.setdefault('root', None)
+                    entry.setdefault('scope', None)
+            entry.setdefault('last_used', stat.st_mtime)
+            entry.update({'file': cache_file, 'size': stat.st_size})
+            entries.append(entry)
+        return entries
+    
+    def remove(self, cache_file):
+        """Delete a cache with its lock file, and its refresh claim unless a refresh holds it"""
+        cache_file = Path(cache_file)
+        refresh_file = cache_file.with_suffix('.refresh')
+        with self.cache_lock(cache_file, exclusive=True):
+            with self.locked(refresh_file, exclusive=True, blocking=False) as claimed:
+                paths = [cache_file, cache_file.with_suffix('.lock')] + ([refresh_file] if claimed else [])
+                for path in paths:
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+        with self.lock:
+            self.usage.pop(cache_file.name, None)
+        with self.manifest() as manifest:
+            manifest.pop(cache_file.name, None)
+    
+    def remove_legacy_caches(self):
+        """Delete caches older versions kept inside the cached source folders (cache gc).
+        Returns (path, size) of each one removed."""
+        removed = []
+        for root in {entry['root'] for entry in self.entries() if entry['root'] is not None}:
+            for name in self.LEGACY_CACHES:
+                path = Path(root, name)
+                try:
+                    size = path.stat().st_size
+                    path.unlink()
+                except OSError:
+                    continue
+                removed.append((path, size))
+        return removed
+    
+    def collect(self, keep=None):
+        """Delete caches of vanished source folders, then least recently used caches
+        over the budget. Returns (removed for missing roots, evicted).
+        
+        Caches not named the way cache_file names them now (written before the
+        scope was part of the name) are evicted too.
+        """
+        missing = []
+        evicted = []
+        entries = []
+        for entry in self.entries():
+            if entry['root'] is not None and not os.path.isdir(entry['root']):
+                self.remove(entry['file'])
+                missing.append(entry)
+            elif entry['root'] is not None and entry['file'] != self.cache_file(entry['root'], entry['scope']):
+                self.remove(entry['file'])
+                evicted.append(entry)
+            else:
+                entries.append(entry)
+        if self.budget is not None:
+            total = sum(entry['size'] for entry in entries)
+            for entry in sorted(entries, key=lambda e: e['last_used']):
+                if total <= self.budget:
+                    break
+                if entry['file'].name == keep:
+                    continue
+                self.remove(entry['file'])
+                total -= entry['size']
+                evicted.append(entry)
+        return missing, evicted
+
+
+class Inotify:
+    """Minimal ctypes binding to the Linux inotify API"""
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+    
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._init = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+        except (OSError, AttributeError, TypeError):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        # IN_NONBLOCK and IN_CLOEXEC share their values with the O_ flags
+        self.fd = self._init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+    
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+    
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+    
+    def read_events(self, timeout):
+        """Wait up to timeout seconds and return a list of (wd, mask, cookie, name)"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+    
+    def close(self):
+        os.close(self.fd)
+
+
+class LiveIndexWatcher:
+    """Keeps the scan caches of source folders current from inotify events.
+    
+    Each folder is scanned once (incrementally, from its cache), every directory
+    in its tree gets an inotify watch, and create/delete/move/modify events are
+    applied to the DirectoryTree in place. Changed trees are written to the
+    folder's cache after FLUSH_DELAY seconds, and at least every `interval` seconds
+    each cache's live_until heartbeat is renewed in place. While that heartbeat is
+    fresh, sampling runs use the cached records without scanning. When inotify is unavailable or the watch limit is exhausted, the
+    watcher falls back to an incremental rescan every interval.
+    """
+    WATCH_MASK = (Inotify.IN_CREATE | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO |
+                  Inotify.IN_CLOSE_WRITE | Inotify.IN_ATTRIB | Inotify.IN_DELETE_SELF | Inotify.IN_ONLYDIR)
+    FLUSH_DELAY = 5  # Seconds to collect events before rewriting the cache
+    
+    def __init__(self, selector, source_folders, filters=None, interval=30):
+        self.selector = selector
+        self.source_folders = [os.path.realpath(folder) for folder in source_folders]
+        self.filters = filters
+        self.scope = ScanFilter.scope_key(filters)
+        self.interval = interval
+        self.trees = {}
+        self.scan_filters = {}
+        self.dirty = set()
+        self.watches = {}  # wd -> (root, dir path)
+        self.watched_dirs = {}  # dir path -> wd
+        self.inotify = None
+        self.polling = False
+    
+    def rescan(self, root):
+        """Incremental rescan of one source folder against its current tree"""
+        previous = self.trees.get(root)
+        if previous is None:
+            cached = self.selector.load_scan_tree(root, self.scope)
+            previous_dirs = cached['dirs'] if cached else None
+        else:
+            previous_dirs = previous.dirs
+        tree = DirectoryTree(self.selector.filesystem, previous_dirs)
+        self.selector.scan_folder_scandir(root, on_batch=lambda files: None,
+                                          scan_filter=self.scan_filters[root], tree=tree)
+        self.trees[root] = tree
+        self.dirty.add(root)
+        return tree
+    
+    def watch_tree(self, root, dirs):
+        """Add watches for the given directories; switches to polling if that fails"""
+        if self.polling:
+            return
+        for dir_path in dirs:
+            if dir_path in self.watched_dirs:
+                continue
+            try:
+                wd = self.inotify.add_watch(dir_path, self.WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    print(f"⚠️  inotify watch limit reached ({len(self.watches)} watches), "
+                          f"falling back to rescans every {self.interval}s")
+                    self.start_polling()
+                    return
+                continue  # Directory vanished or is unreadable
+            self.watches[wd] = (root, dir_path)
+            self.watched_dirs[dir_path] = wd
+    
+    def start_polling(self):
+        self.polling = True
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        self.watches.clear()
+        self.watched_dirs.clear()
+    
+    def unwatch_subtree(self, removed_dirs):
+        for dir_path in removed_dirs:
+            wd = self.watched_dirs.pop(dir_path, None)
+            if wd is not None:
+                self.watches.pop(wd, None)
+                if self.inotify is not None:
+                    self.inotify.rm_watch(wd)
+    
+    def apply_event(self, wd, mask, name):
+        if mask & Inotify.IN_Q_OVERFLOW:
+            print("⚠️  inotify queue overflowed, rescanning")
+            for root in self.source_folders:
+                self.watch_tree(root, self.rescan(root).dirs)
+            return
+        if mask & Inotify.IN_IGNORED:
+            watch = self.watches.pop(wd, None)
+            if watch is not None:
+                self.watched_dirs.pop(watch[1], None)
+            return
+        watch = self.watches.get(wd)
+        if watch is None or not name:
+            return
+        root, dir_path = watch
+        tree = self.trees[root]
+        scan_filter = self.scan_filters[root]
+        path = os.path.join(dir_path, name)
+        
+        if mask & Inotify.IN_ISDIR:
+            if mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                self.unwatch_subtree(tree.remove_subtree(path))
+            elif mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                if scan_filter.accepts_dir(path, name):
+                    tree.add_subdir(dir_path, path)
+                    self.selector.scan_folder_scandir(path, on_batch=lambda files: None,
+                                                      scan_filter=scan_filter, tree=tree)
+                    self.watch_tree(root, [d for d in tree.dirs if d == path or d.startswith(path + os.sep)])
+        else:
+            extension = os.path.splitext(name)[1].lower()
+            if extension not in scan_filter.listed_extensions or not scan_filter.accepts_file(path, name):
+                return
+            if mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                tree.remove_file(dir_path, name)
+            else:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    tree.remove_file(dir_path, name)
+                else:
+                    if not os.path.isdir(path):
+                        extension = scan_filter.content_extension(path, extension)
+                        if extension is None:
+                            tree.remove_file(dir_path, name)
+                        else:
+                            tree.put_file(dir_path, self.selector.build_file_info(Path(path), stat, extension))
+        tree.refresh_mtime(dir_path)
+        self.dirty.add(root)
+    
+    def flush(self, live=True):
+        """Write the trees that changed since the last flush and renew the heartbeat of the others"""
+        live_until = time.time() + 2 * self.interval if live else 0
+        for root, tree in self.trees.items():
+            if root in self.dirty or not self.selector.cache_store.heartbeat(root, self.scope, live_until):
+                # Counted once per rescan, not once per heartbeat
+                self.selector.save_scan_tree(root, tree, self.scope, live_until, count_reuse=False)
+        self.dirty.clear()
+    
+    def run(self, duration=None):
+        """Watch until interrupted (or for duration seconds)"""
+        try:
+            self.inotify = Inotify()
+        except OSError as e:
+            print(f"⚠️  {e}; falling back to rescans every {self.interval}s")
+            self.polling = True
+        
+        for root in self.source_folders:
+            self.scan_filters[root] = ScanFilter(self.selector, self.filters, content=False).bind(root)
+            # Watch first, then rescan, so changes made during the initial scan aren't lost
+            tree = self.rescan(root)
+            self.watch_tree(root, tree.dirs)
+            self.watch_tree(root, self.rescan(root).dirs)
+            tree = self.trees[root]
+            print(f"📡 Watching {root}: {len(tree.dirs)} directories, {len(tree.files())} files")
+        self.flush()
+        
+        started = time.time()
+        last_flush = started
+        try:
+            while duration is None or time.time() - started < duration:
+                wait = min(self.interval, 1.0)
+                if self.polling:
+                    time.sleep(wait)
+                    if time.time() - last_flush >= self.interval:
+                        for root in self.source_folders:
+                            self.rescan(root)
+                else:
+                    for wd, mask, _, name in self.inotify.read_events(wait):
+                        self.apply_event(wd, mask, name)
+                # Batch bursts of events into one cache write, and refresh the heartbeat
+                since_flush = time.time() - last_flush
+                if (self.dirty and since_flush >= min(self.FLUSH_DELAY, self.interval)) or since_flush >= self.interval:
+                    self.flush()
+                    last_flush = time.time()
+        except KeyboardInterrupt:
+            print("\n⏹️  Watch stopped.")
+        finally:
+            # Readers go back to validating the cache against the disk
+            self.flush(live=False)
+            if self.inotify is not None:
+                self.inotify.close()
+
+
+class MetadataCache:
+    """Extracted media metadata keyed by file identity instead of path.
+    
+    Rows are keyed by (st_dev, st_ino, st_size, st_mtime_ns): renaming or moving a
+    file within a filesystem keeps its entry, while rewriting it changes the size or
+    mtime and misses. One database in the cache directory serves every source
+    folder; scan records carry the device and inode they were extracted under.
+    The connection is opened on first use and writes are batched, since records
+    are built from several scanner threads at once.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metadata (
+            device INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            fields TEXT NOT NULL,
+            used REAL NOT NULL,
+            PRIMARY KEY (device, inode, size, mtime_ns)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS metadata_used ON metadata (used);
+    """
+    FLUSH_EVERY = 500
+    PRUNE_AGE = 90 * 86400  # cache gc drops entries unused this long
+    
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.conn = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(stat):
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    
+    def connection(self):
+        if self.conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript(self.SCHEMA)
+        return self.conn
+    
+    def get(self, key):
+        """Cached fields for a file identity, or None"""
+        with self.lock:
+            fields = self.pending.get(key)
+            if fields is None:
+                row = self.connection().execute(
+                    'SELECT fields FROM metadata WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?',
+                    key).fetchone()
+                fields = json.loads(row[0]) if row else None
+                if fields is not None:
+                    self.used.add(key)
+            if fields is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return fields
+    
+    def put(self, key, fields):
+        with self.lock:
+            self.pending[key] = fields
+            if len(self.pending) >= self.FLUSH_EVERY:
+                self.write_pending()
+    
+    def flush(self):
+        with self.lock:
+            self.write_pending()
+    
+    def write_pending(self):
+        if not self.pending and not self.used:
+            return
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)',
+                             [key + (json.dumps(fields), now) for key, fields in self.pending.items()])
+            conn.executemany('UPDATE metadata SET used = ? WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?',
+                             [(now,) + key for key in self.used])
+        self.pending.clear()
+        self.used.clear()
+    
+    def close(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+    
+    def stats(self):
+        """(entries, bytes on disk), without creating the database"""
+        if self.conn is None and not self.db_path.exists():
+            return 0, 0
+        entries = self.connection().execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+        size = sum(os.path.getsize(path) for path in (str(self.db_path), str(self.db_path) + '-wal')
+                   if os.path.exists(path))
+        return entries, size
+    
+    def prune(self, max_age=PRUNE_AGE):
+        """Delete entries not used for max_age seconds (their files are likely gone), returning the count"""
+        if self.conn is None and not self.db_path.exists():
+            return 0
+        self.flush()
+        with self.connection() as conn:
+            return conn.execute('DELETE FROM metadata WHERE used < ?', (time.time() - max_age,)).rowcount
+
+
+class MediaIndex:
+    """Central SQLite index of the media files under any number of source folders.
+    
+    Every file is a row with B-tree indexes on size, mtime and extension, so the
+    filter dict becomes an indexed WHERE clause, and counting, random ordering and
+    limits run inside SQLite: a sampling run only builds records for the files it
+    selects. Directories keep the mtime they were listed at and an update only
+    re-lists those that changed, like the scan cache does. The database is in WAL
+    mode, so sampling runs can read while an update is writing.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS roots (
+            root TEXT PRIMARY KEY,
+            scope TEXT,
+            updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            root TEXT NOT NULL,
+            parent TEXT,
+            mtime_ns INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            ctime REAL NOT NULL,
+            extension TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            metadata TEXT
+        );
+        CREATE INDEX IF NOT EXISTS dirs_root ON dirs (root);
+        CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+        CREATE INDEX IF NOT EXISTS files_size ON files (size);
+        CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+        CREATE INDEX IF NOT EXISTS files_extension ON files (extension);
+    """
+    SCHEMA_VERSION = 1  # Stored as PRAGMA user_version once migrate has run
+    COLUMNS = 'path, size, mtime, ctime, extension, media_type, metadata'
+    RECORD_FIELDS = {'path', 'size', 'created', 'modified', 'extension', 'device', 'inode', 'type'}
+    
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+        self.migrate()
+        # Rows checked against the metadata filters of matched_filters (see match_metadata)
+        self.conn.execute('CREATE TEMP TABLE metadata_checked (path TEXT PRIMARY KEY, matches INTEGER NOT NULL)')
+        self.matched_filters = None
+        self.scope_functions = itertools.count()
+    
+    def migrate(self):
+        """Update rows written by older versions, once per database"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        with self.conn:
+            if version < 1:
+                # Rows indexed before HEIC/HEIF were classified as images
+                self.conn.execute("UPDATE files SET media_type = 'image' "
+                                  "WHERE extension IN ('.heic', '.heif') AND media_type != 'image'")
+            self.conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+    
+    def close(self):
+        self.conn.close()
+    
+    def roots(self):
+        """Indexed root folders, mapped to the scope rules they were indexed with"""
+        return {root: json.loads(scope) for root, scope in self.conn.execute('SELECT root, scope FROM roots')}
+    
+    def scope_filters(self, root):
+        """Filter dict with the scope rules root was indexed with, or None"""
+        scope = self.roots().get(root)
+        if not scope:
+            return None
+        include, exclude, max_depth = scope[:3]
+        filters = {'include': include, 'exclude': exclude, 'max_depth': max_depth}
+        if len(scope) > 3:
+            filters.update(dict(scope[3]))
+        return {key: value for key, value in filters.items() if value or key == 'max_depth' and value is not None}
+    
+    @staticmethod
+    def canonical(folder):
+        """Path rows and roots are stored under, with symlinks resolved like the scan cache's"""
+        return os.path.realpath(folder)
+    
+    def find_root(self, folder):
+        """The indexed root containing folder, or None"""
+        folder = self.canonical(folder)
+        for root in sorted(self.roots(), key=len, reverse=True):
+            if folder == root or path_is_inside(folder, root):
+                return root
+        return None
+    
+    def remove_root(self, root):
+        with self.conn:
+            self.conn.execute('DELETE FROM files WHERE dir IN (SELECT path FROM dirs WHERE root = ?)', (root,))
+            self.conn.execute('DELETE FROM dirs WHERE root = ?', (root,))
+            self.conn.execute('DELETE FROM roots WHERE root = ?', (root,))
+    
+    def update(self, selector, folder, filters=None, rebuild=False, scan_method='scandir', scan_workers=1,
+               scan_concurrency=64):
+        """Bring the rows under folder up to date with the disk, returning the DirectoryTree.
+        
+        Only the scope rules of filters apply; the index holds every media file in
+        scope. A folder inside an indexed root updates that root, and indexed roots
+        inside folder are merged into it.
+        """
+        root = self.find_root(folder) or self.canonical(folder)
+        if root != self.canonical(folder):
+            print(f"📇 {folder} is inside indexed folder {root}, updating that instead")
+        scope = json.dumps(ScanFilter.scope_key(filters))
+        indexed = self.conn.execute('SELECT scope FROM roots WHERE root = ?', (root,)).fetchone()
+        for nested in self.roots():
+            if path_is_inside(nested, root):
+                self.remove_root(nested)
+        
+        previous = {}
+        if indexed is not None and indexed[0] == scope and not rebuild:
+            # Cached directories only need their subdirectories to be walked, their
+            # file rows stay in the database untouched
+            rows = self.conn.execute('SELECT path, parent, mtime_ns FROM dirs WHERE root = ?', (root,)).fetchall()
+            subdirs = defaultdict(list)
+            for path, parent, _ in rows:
+                if parent is not None:
+                    subdirs[parent].append(path)
+            previous = {path: (mtime_ns, subdirs[path], []) for path, _, mtime_ns in rows}
+        elif indexed is not None:
+            self.remove_root(root)
+        
+        tree = DirectoryTree(selector.filesystem, previous)
+        scan_filter = ScanFilter(selector, filters, content=False) if filters else None
+        selector.scan_folder(root, scan_method, scan_workers, scan_concurrency, lambda files: None,
+                             scan_filter, tree)
+        
+        changed = [(path, entry) for path, entry in tree.dirs.items() if previous.get(path) is not entry]
+        removed = [path for path in previous if path not in tree.dirs]
+        with self.conn:
+            stale = [(path,) for path in removed] + [(path,) for path, _ in changed]
+            self.conn.executemany('DELETE FROM files WHERE dir = ?', stale)
+            self.conn.executemany('DELETE FROM dirs WHERE path = ?', stale)
+            self.conn.executemany('INSERT INTO dirs VALUES (?, ?, ?, ?)',
+                                  [(path, root, None if path == root else os.path.dirname(path), entry[0])
+                                   for path, entry in changed])
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                  [self.file_row(path, file_data) for path, entry in changed for file_data in entry[2]])
+            self.conn.execute('INSERT OR REPLACE INTO roots VALUES (?, ?, ?)', (root, scope, time.time()))
+        return tree
+    
+    def file_row(self, dir_path, file_data):
+        metadata = {key: value for key, value in file_data.items() if key not in self.RECORD_FIELDS}
+        mtime, ctime = FileRecord.timestamps(file_data)
+        return (str(file_data['path']), dir_path, file_data['size'], mtime, ctime, file_data['extension'],
+                file_data.get('type', 'unknown'),
+                json.dumps(metadata, default=str) if metadata else None)
+    
+    @staticmethod
+    def row_to_record(row):
+        """Build the usual file record from a row of COLUMNS"""
+        path, size, mtime, ctime, extension, media_type, metadata = row
+        record = {
+            'path': Path(path),
+            'size': size,
+            'created': datetime.fromtimestamp(ctime),
+            'modified': datetime.fromtimestamp(mtime),
+            'extension': extension,
+            'type': media_type
+        }
+        if metadata:
+            record.update(json.loads(metadata))
+        return record
+    
+    def where_clause(self, selector, folders, filters=None, exclude_folders=()):
+        """Translate source folders and a filter dict into (SQL condition, parameters).
+        
+        Rows below any of exclude_folders are left out. Metadata filters restrict
+        the rows to those match_metadata accepted, checking any it hasn't seen yet.
+        """
+        where, params = self.row_conditions(selector, folders, filters, exclude_folders)
+        if selector.metadata_matcher(filters) is not None:
+            self.match_metadata(selector, folders, filters)
+            where += ' AND path IN (SELECT path FROM temp.metadata_checked WHERE matches)'
+        return where, params
+    
+    def row_conditions(self, selector, folders, filters=None, exclude_folders=()):
+        """where_clause without the metadata filters, which need the files parsed"""
+        filters = filters or {}
+        scope = ScanFilter.scope_key(filters)
+        indexed = self.roots()
+        folder_clauses = []
+        params = []
+        for folder in folders:
+            folder = self.canonical(folder).rstrip(os.sep)
+            # Everything below folder, as a range on the primary key
+            clause = 'path > ? AND path < ?'
+            params += [folder + os.sep, folder + chr(ord(os.sep) + 1)]
+            root = self.find_root(folder)
+            if scope is not None and not (root == folder and indexed[root] == json.loads(json.dumps(scope))):
+                # Scope rules the index wasn't built with are checked per row in Python
+                scan_filter = ScanFilter(selector, filters, content=False).bind(folder)
+                name = f'in_scope_{next(self.scope_functions)}'
+                self.conn.create_function(
+                    name, 1, lambda path, scan_filter=scan_filter: selector.in_scan_scope(Path(path), scan_filter))
+                clause += f' AND {name}(path)'
+            folder_clauses.append(f'({clause})')
+        clauses = [' OR '.join(folder_clauses) or '0']
+        for folder in exclude_folders:
+            folder = self.canonical(folder).rstrip(os.sep)
+            clauses.append('NOT (path > ? AND path < ?)')
+            params += [folder + os.sep, folder + chr(ord(os.sep) + 1)]
+        
+        if filters.get('min_size'):
+            clauses.append('size >= ?')
+            params.append(selector.parse_size(filters['min_size']))
+        if filters.get('max_size'):
+            clauses.append('size <= ?')
+            params.append(selector.parse_size(filters['max_size']))
+        if filters.get('date_from') and filters.get('date_source') != 'exif':
+            clauses.append('mtime >= ?')
+            params.append(datetime.strptime(filters['date_from'], '%Y-%m-%d').timestamp())
+        if filters.get('date_to') and filters.get('date_source') != 'exif':
+            clauses.append('mtime <= ?')
+            params.append(datetime.strptime(filters['date_to'], '%Y-%m-%d').timestamp())
+        for column, key in (('extension', 'file_types'), ('media_type', 'media_types')):
+            if filters.get(key):
+                clauses.append(f"{column} IN ({', '.join('?' * len(filters[key]))})")
+                params += list(filters[key])
+        return '(' + ') AND ('.join(clauses) + ')', params
+    
+    def match_metadata(self, selector, folders, filters):
+        """Check the metadata filters against the rows below folders that pass the others.
+        
+        Parsed metadata isn't indexed, so the candidate rows are fetched with plain
+        SQL and parsed in one load_media_metadata batch (threads or metadata_workers
+        processes, through the metadata cache). Whether each row matched is kept in
+        a temporary table for where_clause, so counting, random ordering and limits
+        still run in SQLite and later queries only parse rows not seen yet.
+        """
+        fields, accepts = selector.metadata_matcher(filters)
+        if filters != self.matched_filters:
+            with self.conn:
+                self.conn.execute('DELETE FROM temp.metadata_checked')
+            self.matched_filters = copy.deepcopy(filters)
+        where, params = self.row_conditions(selector, folders, filters)
+        rows = self.conn.execute(f'SELECT path, extension, media_type, metadata, mtime FROM files WHERE {where} '
+                                 f'AND path NOT IN (SELECT path FROM temp.metadata_checked)', params).fetchall()
+        if not rows:
+            return
+        files_data = []
+        for path, extension, media_type, metadata, mtime in rows:
+            file_data = {'path': path, 'extension': extension, 'type': media_type,
+                         'modified': datetime.fromtimestamp(mtime)}
+            if metadata:
+                file_data.update(json.loads(metadata))
+            files_data.append(file_data)
+        selector.load_media_metadata(files_data, fields)
+        with self.conn:
+            self.conn.executemany('INSERT INTO temp.metadata_checked VALUES (?, ?)',
+                                  [(file_data['path'], int(bool(accepts(file_data)))) for file_data in files_data])
+    
+    def folder_stats(self, selector, folder, filters=None, exclude_folders=()):
+        """Count, total size and extension breakdown of the matching files below folder"""
+        where, params = self.where_clause(selector, [folder], filters, exclude_folders)
+        stats = {'types': {}, 'total_size': 0, 'count': 0}
+        for extension, count, size in self.conn.execute(
+                f'SELECT extension, COUNT(*), SUM(size) FROM files WHERE {where} GROUP BY extension', params):
+            stats['types'][extension] = count
+            stats['total_size'] += size
+            stats['count'] += count
+        return stats
+    
+    def query(self, selector, folders, filters=None, shuffle=False, limit=None, exclude_folders=()):
+        """Iterate over the matching rows below any of folders, in path or random order"""
+        where, params = self.where_clause(selector, folders, filters, exclude_folders)
+        sql = f"SELECT {self.COLUMNS} FROM files WHERE {where} ORDER BY {'random()' if shuffle else 'path'}"
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return self.conn.execute(sql, params)
+    
+    def stats(self):
+        """Per-root totals for the index stats subcommand"""
+        return self.conn.execute("""
+            SELECT roots.root, roots.scope, roots.updated,
+                   (SELECT COUNT(*) FROM dirs WHERE dirs.root = roots.root),
+                   COUNT(files.path), COALESCE(SUM(files.size), 0)
+            FROM roots
+            LEFT JOIN dirs ON dirs.root = roots.root
+            LEFT JOIN files ON files.dir = dirs.path
+            GROUP BY roots.root
+            ORDER BY roots.root
+        """).fetchall()
+
+
+class ContentSniffer:
+    """Media format recognised from a file's first 32 bytes rather than its name.
+    
+    Files with a trusted extension are classified by name without being opened.
+    The others are read in batches of BATCH files on a shared thread pool, so a
+    large directory's reads overlap on slow mounts while each task still covers
+    enough files to keep the hand-off cheap next to a warm local read. A
+    file keeps its extension when that is a name for the detected format (.jpeg
+    stays .jpeg) and otherwise takes the format's usual one. Unrecognised content
+    falls back to the name, except for extensionless files, which are only media
+    if their content says so.
+    """
+    HEAD_BYTES = 32
+    THREADS = 16
+    BATCH = 64
+    ISO_BRANDS = {
+        **dict.fromkeys((b'isom', b'iso2', b'iso3', b'iso4', b'iso5', b'iso6', b'iso8', b'mp41', b'mp42', b'mp71',
+                         b'avc1', b'dash', b'mmp4', b'MSNV', b'XAVC', b'f4v ', b'3gp4', b'3gp5', b'3gp6', b'3g2a'),
+                        ('.mp4', '.m4v', '.mov')),
+        b'heic': ('.heic', '.heif'), b'heix': ('.heic', '.heif'), b'hevc': ('.heic', '.heif'),
+        b'heim': ('.heic', '.heif'), b'heis': ('.heic', '.heif'), b'hevx': ('.heic', '.heif'),
+        b'mif1': ('.heif', '.heic'), b'msf1': ('.heif', '.heic'),
+        b'qt  ': ('.mov', '.mp4', '.m4v'),
+        b'M4V ': ('.m4v', '.mp4'), b'M4VH': ('.m4v', '.mp4'), b'M4VP': ('.m4v', '.mp4'),
+        b'M4A ': (), b'M4B ': (), b'M4P ': (),  # Audio-only MP4 variants
+    }
+    # AVIF is HEIF with AV1 images and often has major brand mif1, so compatible brands are checked too
+    UNSUPPORTED_BRANDS = (b'avif', b'avis')
+    QUICKTIME_ATOMS = (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')  # Old .mov files without ftyp
+    BMP_HEADER_SIZES = (12, 40, 52, 56, 108, 124)  # DIB header versions, to tell bitmaps from text starting "BM"
+    
+    _pool = None
+    _pool_lock = threading.Lock()
+    
+    def __init__(self, filesystem, trusted=(), extensionless=False):
+        self.filesystem = filesystem
+        self.trusted = frozenset(trusted)
+        self.extensionless = extensionless
+    
+    @classmethod
+    def from_filters(cls, selector, filters):
+        """Sniffer for the filter dict's classification options, or None to classify by name"""
+        filters = filters or {}
+        if filters.get('sniff_content'):
+            trusted = filters.get('trusted_extensions') or ()
+        elif filters.get('extensionless'):
+            trusted = selector.media_extensions  # Only extensionless files need reading
+        else:
+            return None
+        return cls(selector.filesystem, trusted, bool(filters.get('extensionless')))
+    
+    @classmethod
+    def pool(cls):
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ThreadPoolExecutor(max_workers=cls.THREADS)
+            return cls._pool
+    
+    @classmethod
+    def detect(cls, head):
+        """Extensions naming the format of a file starting with head, usual one first; () if unknown"""
+        if head.startswith(b'\xff\xd8\xff'):
+            return ('.jpg', '.jpeg')
+        if head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return ('.png',)
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return ('.gif',)
+        if head[:4] == b'RIFF':
+            return {b'WEBP': ('.webp',), b'AVI ': ('.avi',)}.get(head[8:12], ())
+        if head[:4] in (b'II*\x00', b'MM\x00*'):
+            return ('.tiff',)
+        if head[:2] == b'BM' and len(head) >= 18 and struct.unpack_from('<I', head, 14)[0] in cls.BMP_HEADER_SIZES:
+            return ('.bmp',)
+        if head[4:8] == b'ftyp':
+            # Major brand, then the compatible brands that fit in head (other brands, like crx, aren't media we read)
+            box_end = min(len(head), struct.unpack_from('>I', head)[0])
+            brands = [head[8:12]] + [head[i:i + 4] for i in range(16, box_end - 3, 4)]
+            if any(brand in cls.UNSUPPORTED_BRANDS for brand in brands):
+                return ()
+            return cls.ISO_BRANDS.get(brands[0], ())
+        if head[4:8] in cls.QUICKTIME_ATOMS:
+            return ('.mov', '.mp4', '.m4v')
+        if head[:4] == b'\x1a\x45\xdf\xa3':
+            # The DocType is usually within the first 32 bytes of the EBML header
+            if b'webm' in head:
+                return ('.webm', '.mkv')
+            return ('.mkv', '.webm')
+        if head[:4] == b'FLV\x01':
+            return ('.flv',)
+        return ()
+    
+    def read_heads(self, paths):
+        heads = []
+        for path in paths:
+            try:
+                heads.append(self.filesystem.read_head(path, self.HEAD_BYTES))
+            except OSError:
+                heads.append(b'')
+        return heads
+    
+    def classify(self, paths, extensions):
+        """Extension of each file taken from its content, or None if it isn't a media file"""
+        extensions = list(extensions)
+        untrusted = [i for i, extension in enumerate(extensions) if extension not in self.trusted]
+        if not untrusted:
+            return extensions
+        paths = [paths[i] for i in untrusted]
+        if len(paths) <= self.BATCH:
+            heads = self.read_heads(paths)
+        else:
+            batches = self.pool().map(self.read_heads, [paths[i:i + self.BATCH]
+                                                        for i in range(0, len(paths), self.BATCH)])
+            heads = [head for batch in batches for head in batch]
+        for i, head in zip(untrusted, heads):
+            names = self.detect(head)
+            if names:
+                extensions[i] = extensions[i] if extensions[i] in names else names[0]
+            elif not extensions[i]:
+                extensions[i] = None
+        return extensions
+
+
+class ScanFilter:
+    """Filter dict compiled into checks the scanner can run as early as possible.
+    
+    Scope rules (include/exclude patterns and max depth) decide which parts of the
+    tree are walked at all: excluded or too-deep directories are pruned before
+    they are listed. Patterns without a slash match entry names, patterns with one
+    match the path relative to the source folder.
+    
+    Content filters are optional (content=False when the scan will be cached and
+    must contain every file). Extension and media-type filters are folded into the
+    set of extensions the scanner accepts by name, and size/date filters become
+    plain comparisons on the stat result, so rejected files never get a record
+    built. With defer_stat and no size/date filters, the scanner skips stat
+    altogether and emits partial records for complete_file_records to finish.
+    
+    With a ContentSniffer (the sniff_content and extensionless options), every
+    name the sniffer might reclassify is listed, and the extension filters are
+    applied to the extension the file's content gives it.
+    """
+    CLASSIFY_OPTIONS = ('sniff_content', 'trusted_extensions', 'extensionless')
+    
+    def __init__(self, selector, filters=None, content=True, defer_stat=False):
+        filters = filters or {}
+        self.root = None
+        self.include = self.compile_patterns(filters.get('include'))
+        self.exclude = self.compile_patterns(filters.get('exclude'))
+        self.max_depth = filters.get('max_depth')
+        self.prunes = bool(self.include or self.exclude or self.max_depth is not None)
+        
+        extensions = set(selector.media_extensions)
+        self.min_size = self.max_size = self.min_mtime = self.max_mtime = None
+        if content:
+            if filters.get('file_types'):
+                extensions &= set(filters['file_types'])
+            if filters.get('media_types'):
+                allowed_media = set(filters['media_types'])
+                extensions = {ext for ext in extensions if selector.get_media_type(ext) in allowed_media}
+            if filters.get('min_size'):
+                self.min_size = selector.parse_size(filters['min_size'])
+            if filters.get('max_size'):
+                self.max_size = selector.parse_size(filters['max_size'])
+            if filters.get('date_from') and filters.get('date_source') != 'exif':
+                self.min_mtime = datetime.strptime(filters['date_from'], '%Y-%m-%d').timestamp()
+            if filters.get('date_to') and filters.get('date_source') != 'exif':
+                self.max_mtime = datetime.strptime(filters['date_to'], '%Y-%m-%d').timestamp()
+        self.extensions = extensions
+        self.sniffer = ContentSniffer.from_filters(selector, filters)
+        if self.sniffer is None:
+            self.listed_extensions = extensions
+        else:
+            # Names the sniffer may reclassify are listed whatever the extension filters say
+            self.listed_extensions = extensions | (set(selector.media_extensions) - self.sniffer.trusted)
+            if self.sniffer.extensionless:
+                self.listed_extensions.add('')
+        self.needs_stat = any(limit is not None for limit in
+                              (self.min_size, self.max_size, self.min_mtime, self.max_mtime))
+        self.defer_stat = defer_stat and not self.needs_stat
+    
+    @staticmethod
+    def compile_patterns(patterns):
+        """Compile glob patterns into (name regex, relative path regex), or None if empty"""
+        if not patterns:
+            return None
+        name_patterns = []
+        path_patterns = []
+        for pattern in patterns:
+            pattern = pattern.strip().rstrip('/')
+            if not pattern:
+                continue
+            if '/' in pattern:
+                path_patterns.append(fnmatch.translate(pattern.lstrip('/')))
+            else:
+                name_patterns.append(fnmatch.translate(pattern))
+        if not name_patterns and not path_patterns:
+            return None
+        return (re.compile('|'.join(name_patterns)) if name_patterns else None,
+                re.compile('|'.join(path_patterns)) if path_patterns else None)
+    
+    @classmethod
+    def scope_key(cls, filters):
+        """Hashable description of the scope rules, used to key scan caches.
+        
+        Classification options follow as a fourth element when set, since they
+        change which files a scan finds and the extensions it records.
+        """
+        filters = filters or {}
+        key = (tuple(filters.get('include') or ()), tuple(filters.get('exclude') or ()), filters.get('max_depth'))
+        classify = tuple((option, tuple(filters[option]) if isinstance(filters[option], list) else filters[option])
+                         for option in cls.CLASSIFY_OPTIONS if filters.get(option))
+        if classify:
+            key += (classify,)
+        return None if key == ((), (), None) else key
+    
+    @staticmethod
+    def scope_is_portable(scope):
+        """True if a scope_key means the same below any root (no path patterns or depth limit),
+        so trees scanned from different roots can share directory entries"""
+        if scope is None:
+            return True
+        include, exclude, max_depth = scope[:3]
+        return max_depth is None and not any('/' in pattern.strip().rstrip('/') for pattern in include + exclude)
+    
+    def bind(self, root):
+        """Copy of this filter resolving relative paths and depths against root"""
+        bound = copy.copy(self)
+        bound.root = str(root).rstrip(os.sep) or os.sep
+        return bound
+    
+    def relative(self, path):
+        return path[len(self.root):].lstrip(os.sep).replace(os.sep, '/')
+    
+    def matches(self, patterns, path, name):
+        name_re, path_re = patterns
+        if name_re is not None and name_re.match(name):
+            return True
+        return path_re is not None and path_re.match(self.relative(path)) is not None
+    
+    def accepts_dir(self, path, name):
+        """False if the directory should be pruned without being listed"""
+        if self.exclude and self.matches(self.exclude, path, name):
+            return False
+        if self.max_depth is not None and self.relative(path).count('/') + 1 > self.max_depth:
+            return False
+        return True
+    
+    def accepts_file(self, path, name):
+        if self.exclude and self.matches(self.exclude, path, name):
+            return False
+        return not self.include or self.matches(self.include, path, name)
+    
+    def classify(self, media_entries):
+        """Listed (entry, extension) pairs with the extensions their content gives them,
+        minus those that aren't media or fail the extension filters"""
+        if self.sniffer is None:
+            return media_entries
+        extensions = self.sniffer.classify([entry.path for entry, _ in media_entries],
+                                           [extension for _, extension in media_entries])
+        return [(entry, extension) for (entry, _), extension in zip(media_entries, extensions)
+                if extension in self.extensions]
+    
+    def content_extension(self, path, extension):
+        """Extension of a single file as classify gives it, or None if it's left out"""
+        if self.sniffer is not None:
+            extension = self.sniffer.classify([path], [extension])[0]
+        return extension if extension in self.extensions else None
+    
+    def accepts_stat(self, stat):
+        if self.min_size is not None and stat.st_size < self.min_size:
+            return False
+        if self.max_size is not None and stat.st_size > self.max_size:
+            return False
+        if self.min_mtime is not None and stat.st_mtime < self.min_mtime:
+            return False
+        if self.max_mtime is not None and stat.st_mtime > self.max_mtime:
+            return False
+        return True
+
+
+class ReservoirSampler:
+    """Uniform fixed-size random sample of a stream (Algorithm L).
+    
+    After the reservoir fills, the number of items to skip before the next
+    replacement is drawn directly, so most items cost one comparison.
+    """
+    
+    def __init__(self, k):
+        self.k = k
+        self.items = []
+        self.seen = 0
+        self.weight = 1.0
+        self.next_index = k
+        if k > 0:
+            self._advance()
+    
+    def _advance(self):
+        """Draw the stream position of the next replacement"""
+        self.weight *= math.exp(math.log(1.0 - random.random()) / self.k)
+        skip = math.floor(math.log(1.0 - random.random()) / math.log(1.0 - self.weight)) if self.weight < 1.0 else 0
+        self.next_index += skip + 1
+    
+    def wants_next(self):
+        """True if the next item offered will be kept"""
+        return self.seen < self.k or self.seen + 1 == self.next_index
+    
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+        elif self.seen == self.next_index:
+            self.items[random.randrange(self.k)] = item
+            self._advance()
+
+
+class BudgetSampler:
+    """One-pass random sample of a stream that fills a byte budget.
+    
+    Equivalent to shuffling every file and greedily taking those that still fit:
+    each file gets a random priority key and select() runs that greedy fill in
+    key order over the files kept. A file is dropped once lower-key files no
+    larger than it add up to the budget, because the fill can never take it,
+    whatever arrives later: if it took all of those the budget is full, and if
+    it rejected one the gap left was already smaller than this file. Removing
+    files the fill rejects doesn't change what it takes. The kept files stay
+    within about the budget per range of sizes, so memory is proportional to the
+    selection rather than the population.
+    """
+    COMPACT_MIN = 1024  # Files held before the first compaction
+    
+    def __init__(self, target_bytes):
+        self.target_bytes = target_bytes
+        self.entries = []  # (key, tiebreak, item)
+        self.compact_at = self.COMPACT_MIN
+        self.seen = 0
+    
+    def add(self, item):
+        self.seen += 1
+        if item['size'] > self.target_bytes:
+            return  # Could never be selected
+        self.entries.append((random.random(), self.seen, item))
+        if len(self.entries) >= self.compact_at:
+            self.compact()
+            self.compact_at = max(self.COMPACT_MIN, 2 * len(self.entries))
+    
+    def compact(self):
+        """Sort the entries by key and drop the files the greedy fill is sure to reject"""
+        self.entries.sort()
+        sizes = sorted({entry[2]['size'] for entry in self.entries})
+        rank = {size: i + 1 for i, size in enumerate(sizes)}
+        kept_bytes = [0] * (len(sizes) + 1)  # Fenwick tree of kept bytes by size rank
+        kept = []
+        for entry in self.entries:
+            size = entry[2]['size']
+            i = rank[size]
+            no_larger = 0
+            while i:
+                no_larger += kept_bytes[i]
+                i -= i & -i
+            if no_larger >= self.target_bytes and self.target_bytes:
+                continue
+            kept.append(entry)
+            i = rank[size]
+            while i <= len(sizes):
+                kept_bytes[i] += size
+                i += i & -i
+        self.entries = kept
+    
+    def select(self):
+        """Greedy fill of the budget in key order"""
+        self.entries.sort()
+        selected_files = []
+        total_size = 0
+        for _, _, item in self.entries:
+            if total_size + item['size'] <= self.target_bytes:
+                selected_files.append(item)
+                total_size += item['size']
+            if total_size >= self.target_bytes:
+                break
+        return selected_files
+
+
+class StreamingSelector:
+    """Online random selector that decides on each file as the scanner produces it.
+    
+    Count mode uses selection sampling (Knuth's Algorithm S) against an estimated
+    population size; size mode accepts each file with probability target/total while
+    it still fits the byte budget. Rejected files feed a reservoir used by finish() to
+    top up the selection when the estimate turns out too high.
+    """
+    
+    def __init__(self, expected_count, expected_bytes, num_files=None, target_bytes=None):
+        self.expected_count = expected_count
+        self.num_files = num_files
+        self.target_bytes = target_bytes
+        self.accept_probability = min(1.0, target_bytes / expected_bytes) if target_bytes and expected_bytes else 1.0
+        self.seen = 0
+        self.selected = 0
+        self.selected_bytes = 0
+        self.rejected = []
+        self.rejected_seen = 0
+        if target_bytes is not None:
+            self.reservoir_size = max(1, int(expected_count * self.accept_probability))
+        else:
+            self.reservoir_size = max(1, num_files or 0)
+    
+    def offer(self, file_data):
+        """Return True if the file is selected"""
+        self.seen += 1
+        if self.target_bytes is not None:
+            fits = self.selected_bytes + file_data['size'] <= self.target_bytes
+            take = fits and random.random() < self.accept_probability
+        else:
+            needed = self.num_files - self.selected
+            # Never let the remaining population drop below what is still needed
+            remaining = max(self.expected_count - self.seen + 1, needed)
+            take = needed > 0 and random.random() * remaining < needed
+        
+        if take:
+            self.selected += 1
+            self.selected_bytes += file_data['size']
+        else:
+            self.reject(file_data)
+        return take
+    
+    def reject(self, file_data):
+        """Keep a uniform sample of rejected files (Algorithm R)"""
+        self.rejected_seen += 1
+        if len(self.rejected) < self.reservoir_size:
+            self.rejected.append(file_data)
+        else:
+            slot = random.randrange(self.rejected_seen)
+            if slot < self.reservoir_size:
+                self.rejected[slot] = file_data
+    
+    def finish(self):
+        """Return extra files needed to reach the target once the scan is over"""
+        extra = []
+        random.shuffle(self.rejected)
+        if self.target_bytes is not None:
+            for file_data in self.rejected:
+                if self.selected_bytes + file_data['size'] <= self.target_bytes:
+                    extra.append(file_data)
+                    self.selected_bytes += file_data['size']
+        else:
+            extra = self.rejected[:max(0, self.num_files - self.selected)]
+        self.selected += len(extra)
+        taken = set(id(f) for f in extra)
+        self.rejected = [f for f in self.rejected if id(f) not in taken]
+        return extra
+
+
+class ImageHeader:
+    """Pixel dimensions read from the first bytes of an image, without decoding it.
+    
+    The format is recognised by its signature, not by the file extension. JPEG
+    walks the marker segments up to the first start-of-frame with seeks, so an
+    EXIF thumbnail in APP1 is skipped rather than read; TIFF follows the offset
+    to its first IFD. The other formats have their size in the first 32 bytes.
+    """
+    HEAD_BYTES = 32
+    JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}  # Minus DHT, JPG and DAC
+    JPEG_STANDALONE = frozenset(range(0xD0, 0xD9)) | {0x01}  # RSTn, SOI and TEM have no length
+    JPEG_RESYNC_LIMIT = 64 * 1024  # Stray bytes skipped looking for the next marker before giving up
+    
+    @classmethod
+    def dimensions(cls, f):
+        """(width, height) of the image in binary file f, or None if unrecognised"""
+        head = f.read(cls.HEAD_BYTES)
+        if head.startswith(b'\xff\xd8'):
+            return cls.jpeg_dimensions(f)
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            return struct.unpack_from('>II', head, 16)
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack_from('<HH', head, 6)
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            return cls.webp_dimensions(head)
+        if (head[:2] == b'BM' and len(head) >= 26
+                and struct.unpack_from('<I', head, 14)[0] in ContentSniffer.BMP_HEADER_SIZES):
+            if struct.unpack_from('<I', head, 14)[0] == 12:
+                return struct.unpack_from('<HH', head, 18)  # OS/2 BITMAPCOREHEADER
+            width, height = struct.unpack_from('<ii', head, 18)
+            return width, abs(height)  # Negative height means rows are stored top-down
+        if head[:4] in (b'II*\x00', b'MM\x00*'):
+            return cls.tiff_dimensions(f, head)
+        return None
+    
+    @classmethod
+    def jpeg_segments(cls, f):
+        """Yield (marker, payload offset, payload length) of the JPEG segments before the scan data"""
+        offset = 2
+        while True:
+            f.seek(offset)
+            byte = f.read(1)
+            if not byte:
+                return
+            if byte != b'\xff':
+                # Markers should follow each other directly; resync over a bounded run of stray bytes
+                skip = f.read(cls.JPEG_RESYNC_LIMIT).find(b'\xff')
+                if skip < 0:
+                    return
+                offset += 1 + skip
+                continue
+            marker = f.read(1)
+            while marker == b'\xff':  # Fill bytes
+                marker = f.read(1)
+            if not marker:
+                return
+            marker = marker[0]
+            if marker in cls.JPEG_STANDALONE:
+                offset = f.tell()
+                continue
+            if marker in (0xD9, 0xDA):  # End of image or start of scan data
+                return
+            length = f.read(2)
+            if len(length) < 2:
+                return
+            length = struct.unpack('>H', length)[0]
+            if length < 2:  # The length counts its own two bytes
+                return
+            yield marker, f.tell(), length - 2
+            offset = f.tell() + length - 2
+    
+    @classmethod
+    def jpeg_dimensions(cls, f):
+        for marker, payload, length in cls.jpeg_segments(f):
+            if marker in cls.JPEG_SOF:
+                f.seek(payload)
+                frame = f.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack_from('>HH', frame, 1)
+                return width, height
+        return None
+    
+    @classmethod
+    def exif_offset(cls, f):
+        """File offset of the TIFF header holding the EXIF data of a JPEG or TIFF file, or None"""
+        f.seek(0)
+        head = f.read(4)
+        if head[:4] in (b'II*\x00', b'MM\x00*'):
+            return 0
+        if head[:2] != b'\xff\xd8':
+            return None
+        for marker, payload, length in cls.jpeg_segments(f):
+            if marker == 0xE1:  # APP1
+                f.seek(payload)
+                if f.read(6) == b'Exif\x00\x00':
+                    return payload + 6
+            elif marker in cls.JPEG_SOF:
+                return None  # EXIF must come before the frame
+        return None
+    
+    @staticmethod
+    def webp_dimensions(head):
+        chunk = head[12:16]
+        if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack_from('<HH', head, 26)
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L' and head[20:21] == b'\x2f':
+            bits = struct.unpack_from('<I', head, 21)[0]
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return (int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1)
+        return None
+    
+    @staticmethod
+    def tiff_dimensions(f, head):
+        endian = '<' if head[:2] == b'II' else '>'
+        f.seek(struct.unpack_from(endian + 'I', head, 4)[0])
+        count = f.read(2)
+        if len(count) < 2:
+            return None
+        count = struct.unpack(endian + 'H', count)[0]
+        entries = f.read(12 * count)
+        size = {}
+        for offset in range(0, len(entries) - 11, 12):
+            tag, value_type = struct.unpack_from(endian + 'HH', entries, offset)
+            if tag in (256, 257):  # ImageWidth, ImageLength
+                size[tag] = struct.unpack_from(endian + ('H' if value_type == 3 else 'I'), entries, offset + 8)[0]
+        return (size[256], size[257]) if len(size) == 2 else None
+
+
+class ExifReader:
+    """Capture date, camera, orientation and GPS position from EXIF (TIFF IFD) data.
+    
+    IFD0, the Exif IFD and the GPS IFD are read by seeking to their offsets and
+    only the tags below are decoded, so maker notes and thumbnails are never read.
+    """
+    TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+    MAKE, MODEL, ORIENTATION, DATE_TIME = 0x010F, 0x0110, 0x0112, 0x0132
+    EXIF_IFD, GPS_IFD = 0x8769, 0x8825
+    DATE_TIME_ORIGINAL, DATE_TIME_DIGITIZED = 0x9003, 0x9004
+    GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE = 1, 2, 3, 4
+    TAGS = {MAKE, MODEL, ORIENTATION, DATE_TIME, EXIF_IFD, GPS_IFD, DATE_TIME_ORIGINAL, DATE_TIME_DIGITIZED,
+            GPS_LATITUDE_REF, GPS_LATITUDE, GPS_LONGITUDE_REF, GPS_LONGITUDE}
+    MAX_ENTRIES = 512
+    
+    @classmethod
+    def read(cls, f, base):
+        """Dict of date_taken ('YYYY-MM-DD HH:MM:SS'), camera_make, camera_model,
+        exif_orientation (1-8) and gps ([latitude, longitude]) found at the TIFF header at base"""
+        f.seek(base)
+        header = f.read(8)
+        if header[:4] not in (b'II*\x00', b'MM\x00*'):
+            return {}
+        endian = '<' if header[:2] == b'II' else '>'
+        ifd0 = cls.read_ifd(f, base, endian, struct.unpack_from(endian + 'I', header, 4)[0])
+        exif = cls.read_ifd(f, base, endian, ifd0[cls.EXIF_IFD]) if isinstance(ifd0.get(cls.EXIF_IFD), int) else {}
+        gps = cls.read_ifd(f, base, endian, ifd0[cls.GPS_IFD]) if isinstance(ifd0.get(cls.GPS_IFD), int) else {}
+        
+        fields = {}
+        for taken in (exif.get(cls.DATE_TIME_ORIGINAL), exif.get(cls.DATE_TIME_DIGITIZED), ifd0.get(cls.DATE_TIME)):
+            try:
+                fields['date_taken'] = datetime.strptime(taken.strip(), '%Y:%m:%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+                break
+            except (AttributeError, ValueError):
+                continue
+        for tag, name in ((cls.MAKE, 'camera_make'), (cls.MODEL, 'camera_model')):
+            if isinstance(ifd0.get(tag), str) and ifd0[tag].strip():
+                fields[name] = ifd0[tag].strip()
+        if ifd0.get(cls.ORIENTATION) in range(1, 9):
+            fields['exif_orientation'] = ifd0[cls.ORIENTATION]
+        latitude = cls.degrees(gps.get(cls.GPS_LATITUDE), gps.get(cls.GPS_LATITUDE_REF), 'S')
+        longitude = cls.degrees(gps.get(cls.GPS_LONGITUDE), gps.get(cls.GPS_LONGITUDE_REF), 'W')
+        if latitude is not None and longitude is not None:
+            fields['gps'] = [round(latitude, 7), round(longitude, 7)]
+        return fields
+    
+    @classmethod
+    def read_ifd(cls, f, base, endian, offset):
+        """Map tag -> value for the wanted tags of the IFD at base + offset"""
+        f.seek(base + offset)
+        count = f.read(2)
+        if len(count) < 2:
+            return {}
+        count = min(struct.unpack(endian + 'H', count)[0], cls.MAX_ENTRIES)
+        entries = f.read(12 * count)
+        values = {}
+        for position in range(0, len(entries) - 11, 12):
+            tag, value_type, value_count, raw = struct.unpack_from(endian + 'HHI4s', entries, position)
+            if tag not in cls.TAGS or value_type not in cls.TYPE_SIZES:
+                continue
+            total = cls.TYPE_SIZES[value_type] * value_count
+            if total <= 4:
+                data = raw[:total]
+            elif total <= 4096:
+                f.seek(base + struct.unpack(endian + 'I', raw)[0])
+                data = f.read(total)
+            else:
+                continue
+            values[tag] = cls.decode(data, value_type, value_count, endian)
+        return values
+    
+    @staticmethod
+    def decode(data, value_type, count, endian):
+        if value_type in (1, 7):
+            return data
+        if value_type == 2:
+            return data.split(b'\x00', 1)[0].decode('latin-1')
+        code = {3: 'H', 4: 'I', 9: 'i'}.get(value_type)
+        if code is not None:
+            values = struct.unpack(f'{endian}{len(data) // struct.calcsize(code)}{code}', data)
+        else:
+            pairs = struct.unpack(f"{endian}{len(data) // 4}{'I' if value_type == 5 else 'i'}", data)
+            values = tuple(pairs[i] / pairs[i + 1] if pairs[i + 1] else 0.0 for i in range(0, len(pairs) - 1, 2))
+        return values[0] if count == 1 and values else values
+    
+    @staticmethod
+    def degrees(value, ref, negative):
+        """Decimal degrees from a (degrees, minutes, seconds) GPS rational triple"""
+        if not isinstance(value, tuple) or len(value) != 3:
+            return None
+        degrees = value[0] + value[1] / 60 + value[2] / 3600
+        return -degrees if isinstance(ref, str) and ref.strip().upper() == negative else degrees
+
+
+class IsoBoxReader:
+    """Metadata of MP4/MOV and HEIC/HEIF (ISO base media) files from their boxes.
+    
+    Boxes are walked by seeking from one header to the next, so the media data
+    (mdat) is never read whether the movie header (moov) comes before it or at the
+    end of the file. Inside moov only mvhd, and per track tkhd, hdlr and the first
+    stsd entry are read: a few hundred bytes even for multi-GB files. For HEIF
+    images only the meta box is read: item types, locations and the properties
+    (ispe size, irot rotation) associated with the primary item.
+    """
+    CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+    
+    @staticmethod
+    def boxes(f, start, end):
+        """Yield (type, payload offset, end offset) of the boxes between start and end"""
+        offset = start
+        while end is None or offset + 8 <= end:
+            f.seek(offset)
+            header = f.read(8)
+            if len(header) < 8:
+                return
+            size, box_type = struct.unpack('>I4s', header)
+            payload = offset + 8
+            if size == 1:
+                large = f.read(8)
+                if len(large) < 8:
+                    return
+                size = struct.unpack('>Q', large)[0]
+                payload += 8
+            elif size == 0:  # Extends to the end of the enclosing box or file
+                size = (end if end is not None else f.seek(0, os.SEEK_END)) - offset
+            if size < payload - offset:
+                return  # Corrupt size, stop rather than loop
+            yield box_type, payload, offset + size
+            offset += size
+    
+    @classmethod
+    def find(cls, f, start, end, box_type):
+        for found, payload, box_end in cls.boxes(f, start, end):
+            if found == box_type:
+                return payload, box_end
+        return None
+    
+    @classmethod
+    def movie_info(cls, f):
+        """Dict with duration (seconds), width, height and codec (fourcc) of the first video track"""
+        moov = cls.find(f, 0, None, b'moov')
+        if moov is None:
+            return {}
+        info = {}
+        for box_type, payload, box_end in cls.boxes(f, *moov):
+            if box_type == b'mvhd':
+                f.seek(payload)
+                data = f.read(32)
+                if data[:1] == b'\x01':
+                    timescale, duration = struct.unpack_from('>IQ', data, 20)
+                else:
+                    timescale, duration = struct.unpack_from('>II', data, 12)
+                if timescale:
+                    info['duration'] = duration / timescale
+            elif box_type == b'trak' and 'width' not in info:
+                info.update(cls.video_track(f, payload, box_end))
+        return info
+    
+    @classmethod
+    def heif_items(cls, f):
+        """(meta payload range, item ID -> item type, item ID -> first extent offset) of a HEIF file"""
+        meta = cls.find(f, 0, None, b'meta')
+        if meta is None:
+            return None, {}, {}
+        meta = (meta[0] + 4, meta[1])  # meta is a full box: skip version and flags
+        types = {}
+        iinf = cls.find(f, meta[0], meta[1], b'iinf')
+        if iinf is not None:
+            f.seek(iinf[0])
+            start = iinf[0] + (6 if f.read(1) == b'\x00' else 8)  # Version, flags, entry count
+            for box_type, payload, box_end in cls.boxes(f, start, iinf[1]):
+                if box_type != b'infe':
+                    continue
+                f.seek(payload)
+                data = f.read(14)
+                if len(data) < 12 or data[0] < 2:
+                    continue  # Versions 0 and 1 predate item types
+                if data[0] == 2:
+                    types[struct.unpack_from('>H', data, 4)[0]] = data[8:12]
+                elif len(data) == 14:
+                    types[struct.unpack_from('>I', data, 4)[0]] = data[10:14]
+        return meta, types, cls.item_locations(f, meta)
+    
+    @classmethod
+    def item_locations(cls, f, meta):
+        """Item ID -> file offset of its first extent, from the iloc box"""
+        iloc = cls.find(f, meta[0], meta[1], b'iloc')
+        if iloc is None:
+            return {}
+        f.seek(iloc[0])
+        data = f.read(min(iloc[1] - iloc[0], 1 << 16))
+        version = data[0]
+        offset_size, length_size = data[4] >> 4, data[4] & 0x0F
+        base_offset_size, index_size = data[5] >> 4, (data[5] & 0x0F) if version in (1, 2) else 0
+        position = 6
+        
+        def read(size):
+            nonlocal position
+            value = int.from_bytes(data[position:position + size], 'big')
+            position += size
+            return value
+        
+        locations = {}
+        for _ in range(read(4 if version == 2 else 2)):
+            item_id = read(4 if version == 2 else 2)
+            construction = read(2) & 0x0F if version in (1, 2) else 0
+            read(2)  # Data reference index
+            base_offset = read(base_offset_size)
+            extents = [(read(index_size), read(offset_size), read(length_size)) for _ in range(read(2))]
+            if position > len(data):
+                break
+            if construction == 0 and extents:  # Offsets into the file itself
+                locations[item_id] = base_offset + extents[0][1]
+        return locations
+    
+    @classmethod
+    def heif_info(cls, f):
+        """Dict with the display width and height of a HEIF file's primary image"""
+        meta = cls.find(f, 0, None, b'meta')
+        if meta is None:
+            return {}
+        meta = (meta[0] + 4, meta[1])
+        pitm = cls.find(f, meta[0], meta[1], b'pitm')
+        iprp = cls.find(f, meta[0], meta[1], b'iprp')
+        if pitm is None or iprp is None:
+            return {}
+        f.seek(pitm[0])
+        data = f.read(8)
+        primary = struct.unpack_from('>H' if data[0] == 0 else '>I', data, 4)[0]
+        
+        ipco = cls.find(f, iprp[0], iprp[1], b'ipco')
+        ipma = cls.find(f, iprp[0], iprp[1], b'ipma')
+        if ipco is None or ipma is None:
+            return {}
+        properties = [(box_type, payload) for box_type, payload, _ in cls.boxes(f, *ipco)]
+        size = None
+        rotation = 0
+        for index in cls.item_properties(f, ipma, primary):
+            if not 0 < index <= len(properties):
+                continue
+            box_type, payload = properties[index - 1]  # Property indices are 1-based
+            f.seek(payload)
+            if box_type == b'ispe':
+                data = f.read(12)
+                if len(data) == 12:
+                    size = struct.unpack_from('>II', data, 4)
+            elif box_type == b'irot':
+                angle = f.read(1)
+                rotation = angle[0] & 0x03 if angle else 0
+        if size is None:
+            return {}
+        width, height = size
+        if rotation % 2:
+            width, height = height, width  # Rotated by 90 or 270 degrees for display
+        return {'width': width, 'height': height}
+    
+    @staticmethod
+    def item_properties(f, ipma, item_id):
+        """1-based ipco property indices associated with item_id in an ipma box"""
+        f.seek(ipma[0])
+        data = f.read(min(ipma[1] - ipma[0], 1 << 16))
+        if len(data) < 8:
+            return []
+        version, wide = data[0], data[3] & 1
+        position = 8
+        for _ in range(struct.unpack_from('>I', data, 4)[0]):
+            id_size = 2 if version < 1 else 4
+            if position + id_size + 1 > len(data):
+                break
+            entry_id = int.from_bytes(data[position:position + id_size], 'big')
+            count = data[position + id_size]
+            position += id_size + 1
+            size = 2 if wide else 1
+            indices = [int.from_bytes(data[position + i * size:position + (i + 1) * size], 'big')
+                       & (0x7FFF if wide else 0x7F) for i in range(count)]
+            position += count * size
+            if entry_id == item_id:
+                return indices
+        return []
+    
+    @classmethod
+    def heif_exif_offset(cls, f):
+        """File offset of the TIFF header of a HEIF file's Exif item, or None"""
+        meta, types, locations = cls.heif_items(f)
+        for item_id, item_type in types.items():
+            if item_type == b'Exif' and item_id in locations:
+                f.seek(locations[item_id])
+                header_offset = f.read(4)
+                if len(header_offset) == 4:
+                    return locations[item_id] + 4 + struct.unpack('>I', header_offset)[0]
+        return None
+    
+    @classmethod
+    def video_track(cls, f, start, end):
+        """Display width/height and codec of a trak box, or {} if it isn't a video track"""
+        tkhd = cls.find(f, start, end, b'tkhd')
+        mdia = cls.find(f, start, end, b'mdia')
+        if tkhd is None or mdia is None:
+            return {}
+        hdlr = cls.find(f, mdia[0], mdia[1], b'hdlr')
+        if hdlr is None:
+            return {}
+        f.seek(hdlr[0] + 8)
+        if f.read(4) != b'vide':
+            return {}
+        
+        f.seek(tkhd[0])
+        data = f.read(96)
+        matrix_offset = 52 if data[:1] == b'\x01' else 40
+        if len(data) < matrix_offset + 44:
+            return {}
+        a, b = struct.unpack_from('>ii', data, matrix_offset)
+        width, height = struct.unpack_from('>II', data, matrix_offset + 36)
+        width, height = width >> 16, height >> 16  # 16.16 fixed point
+        if a == 0 and b != 0:
+            width, height = height, width  # Rotated by 90 or 270 degrees for display
+        track = {'width': width, 'height': height}
+        
+        stsd = None
+        minf = cls.find(f, mdia[0], mdia[1], b'minf')
+        stbl = minf and cls.find(f, minf[0], minf[1], b'stbl')
+        stsd = stbl and cls.find(f, stbl[0], stbl[1], b'stsd')
+        if stsd:
+            f.seek(stsd[0] + 12)  # Version/flags, entry count, first entry size
+            codec = f.read(4)
+            if len(codec) == 4:
+                track['codec'] = codec.decode('latin-1').strip()
+        return track
+
+
+class EbmlReader:
+    """Duration, resolution and codec of Matroska/WebM files from their EBML elements.
+    
+    The top-level elements of the Segment are visited by seeking over their
+    payloads. When the first Cluster is reached, an Info or Tracks element that
+    hasn't been seen yet is located through the SeekHead instead of by walking
+    the clusters. Only the SeekHead, Info and Tracks payloads are read, usually
+    a few KB.
+    """
+    EBML = 0x1A45DFA3
+    SEGMENT = 0x18538067
+    SEEK_HEAD = 0x114D9B74
+    SEEK = 0x4DBB
+    SEEK_ID = 0x53AB
+    SEEK_POSITION = 0x53AC
+    INFO = 0x1549A966
+    TIMECODE_SCALE = 0x2AD7B1
+    DURATION = 0x4489
+    TRACKS = 0x1654AE6B
+    TRACK_ENTRY = 0xAE
+    TRACK_TYPE = 0x83
+    CODEC_ID = 0x86
+    VIDEO = 0xE0
+    PIXEL_WIDTH = 0xB0
+    PIXEL_HEIGHT = 0xBA
+    CLUSTER = 0x1F43B675
+    MAX_ELEMENT = 1 << 20  # Larger SeekHead/Info/Tracks payloads are ignored
+    
+    @staticmethod
+    def vint(data, offset, keep_marker=False):
+        """(value, next offset) of the variable-length integer at offset.
+        
+        Element IDs keep their length marker bits; sizes drop them, and an all-ones
+        size (unknown, as in live streams) is returned as None.
+        """
+        if offset >= len(data):
+            raise ValueError('truncated EBML element')
+        first = data[offset]
+        length = 1
+        mask = 0x80
+        while length <= 8 and not first & mask:
+            mask >>= 1
+            length += 1
+        if length > 8 or offset + length > len(data):
+            raise ValueError('invalid EBML variable-length integer')
+        value = first if keep_marker else first & (mask - 1)
+        for byte in data[offset + 1:offset + length]:
+            value = (value << 8) | byte
+        if not keep_marker and value == (1 << (7 * length)) - 1:
+            return None, offset + length
+        return value, offset + length
+    
+    @classmethod
+    def element_header(cls, f, offset):
+        """(id, payload offset, payload size) of the element starting at file offset"""
+        f.seek(offset)
+        data = f.read(12)
+        element_id, position = cls.vint(data, 0, keep_marker=True)
+        size, position = cls.vint(data, position)
+        return element_id, offset + position, size
+    
+    @classmethod
+    def children(cls, data):
+        """Yield (id, payload) of the elements in a buffer"""
+        offset = 0
+        while offset < len(data):
+            element_id, offset = cls.vint(data, offset, keep_marker=True)
+            size, offset = cls.vint(data, offset)
+            if size is None:
+                return
+            yield element_id, data[offset:offset + size]
+            offset += size
+    
+    @classmethod
+    def movie_info(cls, f):
+        """Dict with duration (seconds), width, height and codec of the first video track"""
+        element_id, payload, size = cls.element_header(f, 0)
+        if element_id != cls.EBML or size is None:
+            return {}
+        element_id, segment, segment_size = cls.element_header(f, payload + size)
+        if element_id != cls.SEGMENT:
+            return {}
+        segment_end = None if segment_size is None else segment + segment_size
+        
+        found = {}
+        seeks = {}
+        offset = segment
+        while (segment_end is None or offset < segment_end) and not (cls.INFO in found and cls.TRACKS in found):
+            try:
+                element_id, payload, size = cls.element_header(f, offset)
+            except ValueError:
+                break
+            if element_id == cls.CLUSTER or size is None:
+                break
+            if element_id in (cls.SEEK_HEAD, cls.INFO, cls.TRACKS) and size <= cls.MAX_ELEMENT:
+                f.seek(payload)
+                data = f.read(size)
+                if element_id == cls.SEEK_HEAD:
+                    seeks.update(cls.seek_positions(data, segment))
+                else:
+                    found[element_id] = data
+            offset = payload + size
+        for wanted in (cls.INFO, cls.TRACKS):
+            if wanted not in found and wanted in seeks:
+                element_id, payload, size = cls.element_header(f, seeks[wanted])
+                if element_id == wanted and size is not None and size <= cls.MAX_ELEMENT:
+                    f.seek(payload)
+                    found[wanted] = f.read(size)
+        
+        info = {}
+        if cls.INFO in found:
+            info.update(cls.segment_info(found[cls.INFO]))
+        if cls.TRACKS in found:
+            info.update(cls.video_track(found[cls.TRACKS]))
+        return info
+    
+    @classmethod
+    def seek_positions(cls, data, segment):
+        """Map element ID -> absolute file offset from a SeekHead payload"""
+        positions = {}
+        for element_id, seek in cls.children(data):
+            if element_id != cls.SEEK:
+                continue
+            fields = dict(cls.children(seek))
+            if cls.SEEK_ID in fields and cls.SEEK_POSITION in fields:
+                positions[int.from_bytes(fields[cls.SEEK_ID], 'big')] = (
+                    segment + int.from_bytes(fields[cls.SEEK_POSITION], 'big'))
+        return positions
+    
+    @classmethod
+    def segment_info(cls, data):
+        fields = dict(cls.children(data))
+        scale = int.from_bytes(fields[cls.TIMECODE_SCALE], 'big') if cls.TIMECODE_SCALE in fields else 1000000
+        duration = fields.get(cls.DURATION)
+        if duration is None or len(duration) not in (4, 8):
+            return {}
+        return {'duration': struct.unpack('>f' if len(duration) == 4 else '>d', duration)[0] * scale / 1e9}
+    
+    @classmethod
+    def video_track(cls, data):
+        for element_id, entry in cls.children(data):
+            if element_id != cls.TRACK_ENTRY:
+                continue
+            fields = dict(cls.children(entry))
+            if int.from_bytes(fields.get(cls.TRACK_TYPE, b''), 'big') != 1:  # 1 = video
+                continue
+            track = {}
+            video = dict(cls.children(fields.get(cls.VIDEO, b'')))
+            if cls.PIXEL_WIDTH in video and cls.PIXEL_HEIGHT in video:
+                track['width'] = int.from_bytes(video[cls.PIXEL_WIDTH], 'big')
+                track['height'] = int.from_bytes(video[cls.PIXEL_HEIGHT], 'big')
+            if cls.CODEC_ID in fields:
+                track['codec'] = fields[cls.CODEC_ID].rstrip(b'\x00').decode('ascii', 'replace')
+            return track
+        return {}
+
 
 class MediaFileSelector:
+    ASYNC_STAT_BATCH = 16  # Media entries stat'ed per executor call in async scans
+    PIPELINE_QUEUE_SIZE = 64  # Directory batches buffered between scanner and selector
+    PIPELINE_ESTIMATE_SLACK = 1.25  # Headroom for growth since the cached scan
+    METADATA_THREADS = 8  # Files parsed at once when filters need their metadata
+    # Record fields that come from METADATA_READERS rather than from stat, in the
+    # order metadata worker processes return them
+    METADATA_FIELDS = ('width', 'height', 'duration', 'codec', 'date_taken', 'camera_make', 'camera_model',
+                       'exif_orientation', 'gps')
+    METADATA_BATCH = 256  # Files per task sent to a metadata worker process
+    METADATA_VERSION = 3  # Bump when readers return new fields, so cached entries are parsed again
+    # Extension -> method returning extra metadata fields parsed from the file
+    # itself; results go through the metadata cache
+    METADATA_READERS = {
+        '.jpg': 'read_image_metadata', '.jpeg': 'read_image_metadata', '.png': 'read_image_metadata',
+        '.gif': 'read_image_metadata', '.bmp': 'read_image_metadata', '.tiff': 'read_image_metadata',
+        '.webp': 'read_image_metadata',
+        '.mp4': 'read_mp4_metadata', '.mov': 'read_mp4_metadata', '.m4v': 'read_mp4_metadata',
+        '.mkv': 'read_matroska_metadata', '.webm': 'read_matroska_metadata',
+        '.heic': 'read_heif_metadata', '.heif': 'read_heif_metadata',
+    }
+    
     def undo_last_operation(self, destination_folder):
         """Undo the last copy operation by deleting copied files listed in the log file."""
         log_file = Path(destination_folder) / 'selection_log.json'
@@ -51,83 +2539,706 @@ class MediaFileSelector:
         }
         self.operation_state = {}
         self.resume_file = None
+        self.filesystem = LocalFilesystem()
+        self.cache_store = ScanCacheStore(default_cache_dir() / 'scans')
+        self.max_staleness = None  # Seconds a cache may go unverified before runs check it
+        self.metadata_workers = 1  # Processes parsing file headers; 1 parses in threads
+        self.metadata_pools = None  # Executors kept open by sharing_metadata_pools
+        self.metadata_pools_lock = threading.Lock()
+        self.metadata_cache = MetadataCache(default_cache_dir() / 'metadata.db')
+        self.stale_policy = 'background'
+        
+    def collect_media_files_optimized(self, folder_path, filters=None, use_cache=True, scan_method='scandir',
+                                      scan_workers=1, scan_concurrency=64):
+        """Optimized file collection with caching and filtering.
         
-    def collect_media_files_optimized(self, folder_path, filters=None, use_cache=True):
-        """Optimized file collection with caching and filtering"""
-        cache_file = Path(folder_path) / '.media_cache.pkl'
+        The cache is a per-directory tree: every directory is stat'ed, but only
+        those whose mtime changed since the last run are listed again. The cache
+        must hold every media file, so filters are only pushed down into the
+        scanner when the results aren't cached.
+        """
         folder = Path(folder_path)
         
         if not folder.exists() or not folder.is_dir():
             print(f"⚠️  Warning: Folder '{folder_path}' doesn't exist or is not accessible")
             return []
+        # Canonical paths, so directory entries line up with caches of overlapping roots
+        folder = Path(os.path.realpath(folder))
         
-        # Check cache validity
-        if use_cache and cache_file.exists():
-            try:
-                cache_stat = cache_file.stat()
-                folder_stat = folder.stat()
-                if cache_stat.st_mtime > folder_stat.st_mtime:
-                    with open(cache_file, 'rb') as f:
-                        cached_files = pickle.load(f)
-                        print(f"📦 Using cached data for {folder_path}")
-                        return self.apply_filters(cached_files, filters)
-            except:
-                pass  # Cache read failed, continue with fresh scan
-        
-        files_data = []
-        print(f"📁 Scanning {folder_path}...")
+        scope = ScanFilter.scope_key(filters)
+        tree = None
+        if use_cache and scan_method != 'rglob':
+            cached = self.load_scan_tree(folder, scope)
+            if cached and cached.get('live_until', 0) >= time.time():
+                # A watcher is keeping this index current, no need to touch the disk
+                print(f"📡 Using live index for {folder_path}")
+                return self.apply_filters(DirectoryTree(self.filesystem, cached['dirs']).previous_files(), filters)
+            if cached and self.max_staleness is not None:
+                age = time.time() - cached['verified_at']
+                if age <= self.max_staleness:
+                    print(f"🕒 Using cached data for {folder_path} (verified {self.format_age(age)} ago)")
+                    return self.apply_filters(DirectoryTree(self.filesystem, cached['dirs']).previous_files(), filters)
+                if self.stale_policy == 'background':
+                    print(f"🕒 Using cached data for {folder_path} ({self.format_age(age)} old), "
+                          f"refreshing it in the background")
+                    self.start_background_refresh(folder, filters, scan_method, scan_workers, scan_concurrency)
+                    return self.apply_filters(DirectoryTree(self.filesystem, cached['dirs']).previous_files(), filters)
+            tree = self.cached_tree(folder, cached, scope)
+            if tree.previous:
+                print(f"📦 Checking cached data for {folder_path}...")
+            elif tree.fallbacks:
+                print(f"📦 Checking cached data of overlapping folders for {folder_path}...")
+            else:
+                print(f"📁 Scanning {folder_path}...")
+        else:
+            print(f"📁 Scanning {folder_path}...")
+        scan_filter = ScanFilter(self, filters, content=not use_cache) if filters else None
         
+        started = time.time()
         try:
-            for file_path in folder.rglob('*'):
-                if file_path.is_file() and file_path.suffix.lower() in self.media_extensions:
-                    try:
-                        stat = file_path.stat()
-                        file_info = {
-                            'path': file_path,
-                            'size': stat.st_size,
-                            'created': datetime.fromtimestamp(stat.st_ctime),
-                            'modified': datetime.fromtimestamp(stat.st_mtime),
-                            'extension': file_path.suffix.lower()
-                        }
-                        
-                        # Add metadata for images and videos
-                        file_info.update(self.get_media_metadata(file_path))
-                        files_data.append(file_info)
-                        
-                    except (OSError, PermissionError) as e:
-                        print(f"⚠️  Couldn't access {file_path}: {e}")
-                        continue
+            files_data = self.scan_folder(folder, scan_method, scan_workers, scan_concurrency,
+                                          scan_filter=scan_filter, tree=tree)
         except Exception as e:
             print(f"❌ Error scanning folder {folder_path}: {e}")
             return []
         
         # Cache the results
-        if use_cache:
-            try:
-                with open(cache_file, 'wb') as f:
-                    pickle.dump(files_data, f)
-            except:
-                pass  # Cache write failed, not critical
+        if tree is not None:
+            if tree.previous or tree.fallbacks:
+                print(f"📦 {folder_path}: reused {tree.reused} cached directories, "
+                      f"re-listed {tree.relisted}")
+            self.save_scan_tree(folder, tree, scope, verified_at=started)
         
         return self.apply_filters(files_data, filters)
     
-    def get_media_metadata(self, file_path):
-        """Extract basic metadata from media files"""
-        metadata = {}
+    def refresh_scan_cache(self, folder, filters=None, scan_method='scandir', scan_workers=1, scan_concurrency=64):
+        """Incrementally rescan a folder into its cache without collecting the records.
+        
+        Returns the DirectoryTree, or None if another process is already refreshing it.
+        """
+        folder = os.path.realpath(folder)
+        scope = ScanFilter.scope_key(filters)
+        with self.cache_store.refreshing(folder, scope) as claimed:
+            if not claimed:
+                return None
+            tree = self.cached_tree(folder, self.load_scan_tree(folder, scope), scope)
+            scan_filter = ScanFilter(self, filters, content=False) if filters else None
+            started = time.time()
+            self.scan_folder(folder, scan_method, scan_workers, scan_concurrency, lambda files: None,
+                             scan_filter, tree)
+            self.save_scan_tree(folder, tree, scope, verified_at=started)
+            return tree
+    
+    def start_background_refresh(self, folder, filters=None, scan_method='scandir', scan_workers=1,
+                                 scan_concurrency=64):
+        """Refresh a folder's cache in a detached process, so it finishes even after this run exits"""
+        command = [sys.executable, os.path.abspath(__file__), 'cache',
+                   '--cache-dir', str(self.cache_store.cache_dir.parent)]
+        if self.cache_store.budget is not None:
+            command += ['--cache-budget', str(self.cache_store.budget)]
+        command += ['refresh', '-s', str(folder), '--scan-method', 'async' if scan_method == 'async' else 'scandir',
+                    '--scan-workers', str(scan_workers), '--scan-concurrency', str(scan_concurrency)]
+        filters = filters or {}
+        for key in ('include', 'exclude'):
+            if filters.get(key):
+                command += [f'--{key}', ','.join(filters[key])]
+        if filters.get('max_depth') is not None:
+            command += ['--max-depth', str(filters['max_depth'])]
+        if filters.get('sniff_content'):
+            command.append('--sniff-content')
+        if filters.get('trusted_extensions'):
+            command += ['--trust-extensions', ','.join(filters['trusted_extensions'])]
+        if filters.get('extensionless'):
+            command.append('--include-extensionless')
+        try:
+            subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL, start_new_session=True)
+        except OSError as e:
+            print(f"⚠️  Couldn't start background refresh: {e}")
+    
+    def format_age(self, seconds):
+        """Convert seconds to a short human readable duration"""
+        for unit, length in (('d', 86400), ('h', 3600), ('m', 60)):
+            if seconds >= length:
+                return f"{seconds / length:.1f}{unit}"
+        return f"{seconds:.0f}s"
+    
+    def cached_tree(self, folder, cached, scope=None):
+        """DirectoryTree for rescanning folder from its cache payload (or None), with
+        the caches of overlapping roots as fallbacks"""
+        try:
+            fallbacks = self.cache_store.overlapping(folder, scope)
+        except:
+            fallbacks = []  # Store unreadable, the folder's own cache still works
+        return DirectoryTree(self.filesystem, cached['dirs'] if cached else None, fallbacks)
+    
+    def load_scan_tree(self, folder, scope=None):
+        """Load the cached scan payload for a folder, or None if missing or scanned
+        with different include/exclude/depth rules.
+        
+        The payload holds 'dirs' (the DirectoryTree mapping, a memory-mapped
+        ColumnarTreeCache), 'verified_at', when the scan that wrote it started, and
+        'live_until', the time up to which a running watcher vouches for it.
+        """
+        try:
+            cache = self.cache_store.load(folder, scope)
+            if cache is None:
+                return None
+            cache.selector = self
+            return {'scope': scope, 'dirs': cache, 'verified_at': cache.verified_at, 'live_until': cache.live_until}
+        except:
+            return None  # Cache read failed, continue with fresh scan
+    
+    def save_scan_tree(self, folder, tree, scope=None, live_until=0, count_reuse=True, verified_at=None):
+        """Write a folder's directory tree to the cache store"""
+        try:
+            self.cache_store.save(folder, tree.dirs, scope, live_until,
+                                  tree.reused if count_reuse else 0, tree.relisted if count_reuse else 0,
+                                  verified_at)
+        except:
+            pass  # Cache write failed, not critical
+        self.metadata_cache.flush()
+    
+    def build_file_info(self, file_path, stat, extension):
+        """Build the file record used throughout selection and copying.
+        
+        Dates, media type and parsed metadata are filled in when first read (see
+        FileRecord), so records that are filtered out or never shown don't pay for them.
+        """
+        return FileRecord({
+            'path': file_path,
+            'size': stat.st_size,
+            'extension': extension,
+            'device': stat.st_dev,
+            'inode': stat.st_ino
+        }, stat.st_mtime, stat.st_ctime, self)
+    
+    def scan_folder_rglob(self, folder, scan_filter=None):
+        """Collect media file records using Path.rglob (one Path and stat per entry)"""
+        files_data = []
+        extensions = scan_filter.listed_extensions if scan_filter else self.media_extensions
+        for file_path in folder.rglob('*'):
+            extension = file_path.suffix.lower()
+            if extension in extensions and file_path.is_file():
+                if scan_filter is not None and scan_filter.prunes and not self.in_scan_scope(file_path, scan_filter):
+                    continue
+                if scan_filter is not None:
+                    extension = scan_filter.content_extension(str(file_path), extension)
+                    if extension is None:
+                        continue
+                try:
+                    stat = file_path.stat()
+                    files_data.append(self.build_file_info(file_path, stat, extension))
+                except (OSError, PermissionError) as e:
+                    print(f"⚠️  Couldn't access {file_path}: {e}")
+                    continue
+        return files_data
+    
+    def scan_folder(self, folder, scan_method='scandir', scan_workers=1, scan_concurrency=64, on_batch=None,
+                    scan_filter=None, tree=None):
+        """Walk a folder with the chosen scan engine.
+        
+        Without on_batch the records are returned as one list. With on_batch, each
+        directory's records are handed to it as they are listed (possibly from several
+        threads at once) and nothing is accumulated. A ScanFilter prunes directories
+        and discards entries during the walk; rglob can't prune, so it only applies
+        the scope rules to the files it finds and leaves the rest to apply_filters.
+        With a DirectoryTree, unchanged directories are served from it instead of
+        being listed (rglob always does a full walk).
+        """
+        if scan_filter is not None:
+            scan_filter = scan_filter.bind(folder)
+        try:
+            if scan_method == 'rglob':
+                files_data = self.scan_folder_rglob(folder, scan_filter)
+                if on_batch is None:
+                    return files_data
+                on_batch(files_data)
+                return []
+            if scan_method == 'async':
+                return self.scan_folder_async(folder, scan_concurrency, on_batch, scan_filter, tree)
+            if scan_workers > 1:
+                return self.scan_folder_parallel(folder, scan_workers, on_batch, scan_filter, tree)
+            return self.scan_folder_scandir(folder, on_batch, scan_filter, tree)
+        finally:
+            self.metadata_cache.flush()
+    
+    def in_scan_scope(self, file_path, scan_filter):
+        """Check a file found by rglob against the scope rules of every path component"""
+        path = str(file_path)
+        parent = os.path.dirname(path)
+        while len(parent) > len(scan_filter.root):
+            if not scan_filter.accepts_dir(parent, os.path.basename(parent)):
+                return False
+            parent = os.path.dirname(parent)
+        return scan_filter.accepts_file(path, file_path.name)
+    
+    def scan_folder_scandir(self, folder, on_batch=None, scan_filter=None, tree=None):
+        """Collect media file records with an iterative os.scandir walk"""
+        files_data = []
+        on_batch = on_batch or files_data.extend
+        pending = [str(folder)]
+        while pending:
+            files, subdirs = self.scan_directory(pending.pop(), scan_filter, tree)
+            if files:
+                on_batch(files)
+            pending.extend(subdirs)
+        return files_data
+    
+    def scan_folder_parallel(self, folder, scan_workers=8, on_batch=None, scan_filter=None, tree=None):
+        """Walk a single folder with several threads sharing one directory queue.
+        
+        Each worker pulls a directory, lists it and pushes the subdirectories it finds
+        back onto the queue, so idle workers pick up whatever branch is still pending.
+        This keeps several readdir/stat requests in flight, which is what hides
+        per-directory latency on network filesystems.
+        """
+        pending = queue.LifoQueue()  # Depth-first keeps the frontier small
+        pending.put(str(folder))
+        worker_results = [[] for _ in range(scan_workers)]
+        
+        def worker(results):
+            while True:
+                dir_path = pending.get()
+                if dir_path is None:
+                    pending.task_done()
+                    return
+                try:
+                    files, subdirs = self.scan_directory(dir_path, scan_filter, tree)
+                    if files:
+                        (on_batch or results.extend)(files)
+                    for subdir in subdirs:
+                        pending.put(subdir)
+                finally:
+                    pending.task_done()
+        
+        threads = [threading.Thread(target=worker, args=(results,), daemon=True)
+                   for results in worker_results]
+        for thread in threads:
+            thread.start()
+        
+        # Subdirectories are queued before their parent is marked done, so join()
+        # only returns once the whole tree has been listed
+        pending.join()
+        for _ in threads:
+            pending.put(None)
+        for thread in threads:
+            thread.join()
+        
+        files_data = []
+        for results in worker_results:
+            files_data.extend(results)
+        return files_data
+    
+    def scan_directory(self, dir_path, scan_filter=None, tree=None):
+        """List a single directory, returning (file records, subdirectory paths).
+        
+        The extension is checked on the entry name first (then on the content of
+        names a ContentSniffer doesn't trust), so non-media files cost
+        nothing beyond the readdir itself. File type comes from the DirEntry's cached
+        d_type and only surviving media files are stat'ed. Like rglob, symlinked
+        directories are not followed. With a DirectoryTree, a directory whose mtime
+        is unchanged costs a single stat and its cached results are reused.
+        """
+        if tree is not None:
+            files, subdirs, mtime_ns = tree.lookup(dir_path)
+            if files is not None:
+                return files, subdirs
+        media_entries, subdirs = self.list_directory(dir_path, scan_filter)
+        files = self.stat_entries(media_entries, scan_filter)
+        if tree is not None:
+            tree.record(dir_path, mtime_ns, files, subdirs)
+        return files, subdirs
+    
+    def list_directory(self, dir_path, scan_filter=None):
+        """List a single directory without stat'ing, returning (media entries, subdirectory paths)"""
+        extensions = scan_filter.listed_extensions if scan_filter else self.media_extensions
+        prunes = scan_filter is not None and scan_filter.prunes
+        media_entries = []
+        subdirs = []
+        try:
+            with self.filesystem.scandir(dir_path) as entries:
+                for entry in entries:
+                    extension = os.path.splitext(entry.name)[1].lower()
+                    try:
+                        if extension in extensions and entry.is_file():
+                            if prunes and not scan_filter.accepts_file(entry.path, entry.name):
+                                continue
+                            media_entries.append((entry, extension))
+                        elif entry.is_dir(follow_symlinks=False):
+                            if prunes and not scan_filter.accepts_dir(entry.path, entry.name):
+                                continue
+                            subdirs.append(entry.path)
+                    except (OSError, PermissionError) as e:
+                        print(f"⚠️  Couldn't access {entry.path}: {e}")
+                        continue
+        except (OSError, PermissionError) as e:
+            print(f"⚠️  Couldn't list {dir_path}: {e}")
+        return media_entries, subdirs
+    
+    def stat_entry(self, entry, extension, scan_filter=None):
+        """Stat a listed media entry and build its file record.
+        
+        Returns None if the entry vanished or fails the filter's size/date checks.
+        When the filter defers stats, a partial record with just the path and
+        extension is returned without any syscall (see complete_file_records).
+        """
+        if scan_filter and scan_filter.defer_stat:
+            return {'path': entry.path, 'extension': extension}
+        try:
+            stat = entry.stat()
+            if scan_filter and not scan_filter.accepts_stat(stat):
+                return None
+            return self.build_file_info(Path(entry.path), stat, extension)
+        except (OSError, PermissionError) as e:
+            print(f"⚠️  Couldn't access {entry.path}: {e}")
+            return None
+    
+    def stat_entries(self, media_entries, scan_filter=None):
+        """Stat a batch of listed media entries, skipping any that fail.
+        
+        Entries are classified by content first when the filter has a sniffer.
+        """
+        if scan_filter is not None:
+            media_entries = scan_filter.classify(media_entries)
+        files = []
+        for entry, extension in media_entries:
+            file_info = self.stat_entry(entry, extension, scan_filter)
+            if file_info is not None:
+                files.append(file_info)
+        return files
+    
+    def scan_folder_async(self, folder, concurrency=64, on_batch=None, scan_filter=None, tree=None):
+        """Walk a single folder with asyncio, keeping many listings and stats in flight.
+        
+        Directory listings and batches of stat calls are offloaded to a thread pool
+        sized to the concurrency limit, and a per-root semaphore caps how many are
+        outstanding at once. Like the threads of scan_folder_parallel, `concurrency`
+        worker coroutines share one directory queue, so the coroutines pending stay
+        bounded however wide the tree is. On high-latency mounts the scan time then
+        scales with tree depth rather than with the number of metadata operations.
+        """
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            return loop.run_until_complete(
+                self._walk_async(str(folder), executor, concurrency, on_batch, scan_filter, tree)
+            )
+        finally:
+            executor.shutdown(wait=True)
+            loop.close()
+    
+    async def _walk_async(self, root, executor, concurrency, on_batch=None, scan_filter=None, tree=None):
+        """Coroutine behind scan_folder_async"""
+        # get_running_loop is new in 3.7; on 3.6 get_event_loop returns the running loop here
+        loop = asyncio.get_running_loop() if hasattr(asyncio, 'get_running_loop') else asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+        files_data = []
+        on_batch = on_batch or files_data.extend
+        
+        async def run(func, *args):
+            async with semaphore:
+                return await loop.run_in_executor(executor, func, *args)
+        
+        async def stat_batch(media_entries):
+            files = await run(self.stat_entries, media_entries, scan_filter)
+            if files:
+                on_batch(files)
+            return files
+        
+        async def scan_directory(dir_path):
+            """List one directory and stat its media files; returns the subdirectories"""
+            if tree is not None:
+                files, subdirs, mtime_ns = await run(tree.lookup, dir_path)
+                if files is not None:
+                    if files:
+                        on_batch(files)
+                    return subdirs
+            media_entries, subdirs = await run(self.list_directory, dir_path, scan_filter)
+            batches = await asyncio.gather(*[stat_batch(media_entries[i:i + self.ASYNC_STAT_BATCH])
+                                             for i in range(0, len(media_entries), self.ASYNC_STAT_BATCH)])
+            if tree is not None:
+                tree.record(dir_path, mtime_ns, [f for files in batches for f in files], subdirs)
+            return subdirs
+        
+        pending = asyncio.LifoQueue()  # Depth-first keeps the frontier small
+        pending.put_nowait(root)
+        errors = []
+        
+        async def worker():
+            while True:
+                dir_path = await pending.get()
+                try:
+                    for subdir in await scan_directory(dir_path):
+                        pending.put_nowait(subdir)
+                except Exception as e:
+                    errors.append(e)  # Raised once the queue drains; a dead worker would stall join()
+                finally:
+                    pending.task_done()
+        
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            # Subdirectories are queued before their parent is marked done, as in scan_folder_parallel
+            await pending.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        if errors:
+            raise errors[0]
+        return files_data
+    
+    def benchmark_scan(self, source_folders, repeats=3, scan_workers=1, scan_concurrency=64):
+        """Time each scan method over the source folders without using the cache"""
+        scanners = {}
+        # rglob bypasses self.filesystem, so it can't be compared under simulated latency
+        if isinstance(self.filesystem, SimulatedLatencyFilesystem):
+            print(f"🐢 Simulating {self.filesystem.latency * 1000:.1f} ms per listing/stat (rglob skipped)")
+        else:
+            scanners['rglob'] = self.scan_folder_rglob
+        scanners['scandir'] = self.scan_folder_scandir
+        if scan_workers > 1:
+            scanners[f'parallel:{scan_workers}'] = lambda folder: self.scan_folder_parallel(folder, scan_workers)
+        scanners[f'async:{scan_concurrency}'] = lambda folder: self.scan_folder_async(folder, scan_concurrency)
+        baseline = next(iter(scanners))
+        results = {}
+        
+        print(f"⏱️  Benchmarking scan methods ({repeats} runs each, cache disabled)")
+        for folder in source_folders:
+            print(f"\n📁 {folder}")
+            counts = {}
+            for method, scanner in scanners.items():
+                best = None
+                for _ in range(repeats):
+                    start_time = time.perf_counter()
+                    files = scanner(Path(folder))
+                    elapsed = time.perf_counter() - start_time
+                    best = elapsed if best is None else min(best, elapsed)
+                counts[method] = len(files)
+                rate = len(files) / best if best > 0 else 0
+                results.setdefault(method, 0.0)
+                results[method] += best
+                print(f"  {method:<12} {best:8.3f}s  {len(files)} files  ({rate:,.0f} files/s)")
+            
+            if len(set(counts.values())) > 1:
+                print(f"  ⚠️  Methods disagree on file count: {counts}")
+        
+        print()
+        for method, total in results.items():
+            if method != baseline and total > 0:
+                print(f"📊 {method} speedup over {baseline}: {results[baseline] / total:.2f}x")
+        return results
+    
+    def get_media_metadata(self, file_path, stat=None, parse=False, extension=None):
+        """Extract basic metadata from media files.
+        
+        With parse, fields from the METADATA_READERS parser for the extension are
+        added. They are looked up in the metadata cache by file identity first, so a
+        renamed or moved file isn't parsed again.
+        """
+        metadata = {}
+        extension = extension or file_path.suffix.lower()
+        try:
+            metadata['type'] = self.get_media_type(extension)
+        except:
+            metadata['type'] = 'unknown'
+        
+        reader = self.METADATA_READERS.get(extension) if parse else None
+        if reader is not None:
+            try:
+                metadata.update(self.read_cached_metadata(file_path, stat or file_path.stat(), getattr(self, reader)))
+            except OSError:
+                pass
+        return metadata
+    
+    def read_cached_metadata(self, file_path, stat, reader):
+        """Fields reader extracts from file_path, computed once per (device, inode, size, mtime)"""
+        key = MetadataCache.key(stat)
+        fields = self.cached_metadata(key)
+        if fields is None:
+            try:
+                fields = reader(file_path)
+            except (OSError, ValueError, IndexError, struct.error):
+                fields = {}  # Unreadable or malformed, remembered so it isn't retried
+            self.store_metadata(key, fields)
+        return fields
+    
+    def cached_metadata(self, key):
+        """Cached reader fields for a file identity, or None if absent or from an older reader version"""
+        fields = self.metadata_cache.get(key)
+        if fields is None or fields.get('_version') != self.METADATA_VERSION:
+            return None
+        return {name: value for name, value in fields.items() if name != '_version'}
+    
+    def store_metadata(self, key, fields):
+        self.metadata_cache.put(key, dict(fields, _version=self.METADATA_VERSION))
+    
+    def read_image_metadata(self, file_path):
+        with open(file_path, 'rb') as f:
+            size = ImageHeader.dimensions(f)
+            exif_offset = ImageHeader.exif_offset(f)
+            fields = ExifReader.read(f, exif_offset) if exif_offset is not None else {}
+        if size:
+            width, height = size
+            if fields.get('exif_orientation', 1) >= 5:
+                width, height = height, width  # Rotated by 90 or 270 degrees for display
+            fields.update(width=width, height=height)
+        return fields
+    
+    def read_heif_metadata(self, file_path):
+        with open(file_path, 'rb') as f:
+            exif_offset = IsoBoxReader.heif_exif_offset(f)
+            fields = ExifReader.read(f, exif_offset) if exif_offset is not None else {}
+            # HEIF rotates with irot, the EXIF orientation is informational only
+            fields.update(IsoBoxReader.heif_info(f))
+        return fields
+    
+    def read_mp4_metadata(self, file_path):
+        with open(file_path, 'rb') as f:
+            return IsoBoxReader.movie_info(f)
+    
+    def read_matroska_metadata(self, file_path):
+        with open(file_path, 'rb') as f:
+            return EbmlReader.movie_info(f)
+    
+    def load_media_metadata(self, files_data, fields):
+        """Parse the metadata of records that lack any of fields, METADATA_THREADS files at a time"""
+        missing = [f for f in files_data
+                   if f['extension'] in self.METADATA_READERS and not getattr(f, 'parsed', False)
+                   and any(field not in f for field in fields)]
+        if not missing:
+            return
+        if self.metadata_workers > 1 and len(missing) > self.METADATA_BATCH:
+            self.parse_metadata_in_processes(missing)
+        elif len(missing) == 1:
+            missing[0].update(self.get_media_metadata(Path(missing[0]['path']), parse=True,
+                                                      extension=missing[0]['extension']))
+        else:
+            with self.metadata_pool(ThreadPoolExecutor, min(self.METADATA_THREADS, len(missing))) as executor:
+                for file_data, metadata in zip(missing, executor.map(
+                        lambda f: self.get_media_metadata(Path(f['path']), parse=True, extension=f['extension']),
+                        missing)):
+                    file_data.update(metadata)
+        for file_data in missing:
+            if isinstance(file_data, FileRecord):
+                file_data.parsed = True
+        self.metadata_cache.flush()
+    
+    @contextmanager
+    def sharing_metadata_pools(self):
+        """Keep one metadata thread pool and one worker process pool for every
+        load_media_metadata call in the block, for runs that parse a directory at a time"""
+        self.metadata_pools = {}
         try:
-            # For now, just basic info - can be extended with PIL/ffprobe
-            if file_path.suffix.lower() in {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'}:
-                metadata['type'] = 'image'
-                # Could add PIL here for dimensions: width, height
-            elif file_path.suffix.lower() in {'.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v', '.flv'}:
-                metadata['type'] = 'video'
-                # Could add ffprobe here for duration, resolution
+            yield
+        finally:
+            with self.metadata_pools_lock:
+                pools, self.metadata_pools = self.metadata_pools, None
+            for pool in pools.values():
+                pool.shutdown()
+    
+    @contextmanager
+    def metadata_pool(self, pool_class, max_workers):
+        """A pool_class executor for one parsing batch: the shared one inside
+        sharing_metadata_pools (at full size), otherwise one started for the batch"""
+        with self.metadata_pools_lock:
+            pools = self.metadata_pools
+            if pools is not None and pool_class not in pools:
+                pools[pool_class] = pool_class(max_workers=self.metadata_workers if pool_class is ProcessPoolExecutor
+                                               else self.METADATA_THREADS)
+        if pools is None:
+            with pool_class(max_workers=max_workers) as executor:
+                yield executor
+        else:
+            yield pools[pool_class]
+    
+    def parse_metadata_in_processes(self, files_data):
+        """Parse the metadata of many records with metadata_workers processes.
+        
+        Cache lookups stay in this process; the misses go out as batches of
+        METADATA_BATCH (path, reader) pairs, so pickling and IPC are paid per batch
+        rather than per file, and come back as tuples in METADATA_FIELDS order.
+        """
+        pending = []
+        for file_data in files_data:
+            try:
+                key = MetadataCache.key(os.stat(file_data['path']))
+            except OSError:
+                continue
+            fields = self.cached_metadata(key)
+            if fields is None:
+                pending.append((file_data, key))
             else:
-                metadata['type'] = 'other'
-        except:
-            metadata['type'] = 'unknown'
+                file_data.update(fields)
+        if not pending:
+            return
         
-        return metadata
+        batches = [pending[i:i + self.METADATA_BATCH] for i in range(0, len(pending), self.METADATA_BATCH)]
+        workers = min(self.metadata_workers, len(batches))
+        print(f"🔬 Reading metadata of {len(pending)} files in {workers} processes...")
+        with self.metadata_pool(ProcessPoolExecutor, workers) as executor:
+            futures = {executor.submit(read_metadata_batch, [(str(f['path']), self.METADATA_READERS[f['extension']])
+                                                             for f, _ in batch]): batch
+                       for batch in batches}
+            for future in as_completed(futures):
+                for (file_data, key), values in zip(futures[future], future.result()):
+                    fields = {name: value for name, value in zip(self.METADATA_FIELDS, values) if value is not None}
+                    self.store_metadata(key, fields)
+                    file_data.update(fields)
+    
+    def metadata_matcher(self, filters):
+        """(fields, predicate on a record) for filters on parsed metadata, or None without any"""
+        filters = filters or {}
+        checks = []
+        fields = set()
+        if filters.get('min_width'):
+            checks.append(lambda f: f.get('width', 0) >= filters['min_width'])
+        if filters.get('min_height'):
+            checks.append(lambda f: f.get('height', 0) >= filters['min_height'])
+        if filters.get('orientation'):
+            checks.append(lambda f: self.get_orientation(f) == filters['orientation'])
+        if checks:
+            fields.update(('width', 'height'))
+        if filters.get('min_duration') is not None:
+            checks.append(lambda f: f.get('duration', -1) >= filters['min_duration'])
+            fields.add('duration')
+        if filters.get('max_duration') is not None:
+            checks.append(lambda f: 0 <= f.get('duration', -1) <= filters['max_duration'])
+            fields.add('duration')
+        if filters.get('date_source') == 'exif':
+            if filters.get('date_from'):
+                date_from = datetime.strptime(filters['date_from'], '%Y-%m-%d')
+                checks.append(lambda f: self.get_capture_date(f) >= date_from)
+                fields.add('date_taken')
+            if filters.get('date_to'):
+                date_to = datetime.strptime(filters['date_to'], '%Y-%m-%d')
+                checks.append(lambda f: self.get_capture_date(f) <= date_to)
+                fields.add('date_taken')
+        if not checks:
+            return None
+        return tuple(sorted(fields)), lambda f: all(check(f) for check in checks)
+    
+    def get_capture_date(self, file_data):
+        """EXIF capture time of a record, or its modification time if it has none"""
+        taken = file_data.get('date_taken')
+        if taken:
+            return datetime.strptime(taken, '%Y-%m-%d %H:%M:%S')
+        return file_data['modified']
+    
+    def get_orientation(self, file_data):
+        """'landscape', 'portrait' or 'square' from a record's dimensions, None if unknown"""
+        width, height = file_data.get('width'), file_data.get('height')
+        if not width or not height:
+            return None
+        return 'landscape' if width > height else 'portrait' if height > width else 'square'
+    
+    def get_media_type(self, extension):
+        """Media category implied by a (lowercase) file extension"""
+        if extension in {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp', '.heic', '.heif'}:
+            return 'image'
+        elif extension in {'.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v', '.flv'}:
+            return 'video'
+        return 'other'
     
     def apply_filters(self, files_data, filters):
         """Apply various filters to file list"""
@@ -145,12 +3256,12 @@ class MediaFileSelector:
             max_bytes = self.parse_size(filters['max_size'])
             filtered_files = [f for f in filtered_files if f['size'] <= max_bytes]
         
-        # Date filters
-        if 'date_from' in filters and filters['date_from']:
+        # Date filters (EXIF capture dates are checked with the other parsed metadata)
+        if 'date_from' in filters and filters['date_from'] and filters.get('date_source') != 'exif':
             from_date = datetime.strptime(filters['date_from'], '%Y-%m-%d')
             filtered_files = [f for f in filtered_files if f['modified'] >= from_date]
         
-        if 'date_to' in filters and filters['date_to']:
+        if 'date_to' in filters and filters['date_to'] and filters.get('date_source') != 'exif':
             to_date = datetime.strptime(filters['date_to'], '%Y-%m-%d')
             filtered_files = [f for f in filtered_files if f['modified'] <= to_date]
         
@@ -164,6 +3275,13 @@ class MediaFileSelector:
             allowed_media = set(filters['media_types'])
             filtered_files = [f for f in filtered_files if f.get('type') in allowed_media]
         
+        # Filters on parsed metadata go last, so only files that passed the rest are read
+        matcher = self.metadata_matcher(filters)
+        if matcher is not None:
+            fields, accepts = matcher
+            self.load_media_metadata(filtered_files, fields)
+            filtered_files = [f for f in filtered_files if accepts(f)]
+        
         return filtered_files
     
     def parse_size(self, size_str):
@@ -177,7 +3295,8 @@ class MediaFileSelector:
             'TB': 1024**4
         }
         
-        for suffix, multiplier in multipliers.items():
+        # Longest suffix first, or 'B' would match every 'KB', 'MB', ...
+        for suffix, multiplier in sorted(multipliers.items(), key=lambda item: -len(item[0])):
             if size_str.endswith(suffix):
                 try:
                     number = float(size_str[:-len(suffix)])
@@ -325,32 +3444,10 @@ class MediaFileSelector:
         copied_count = len(copied_files)
         errors = []
         
-        def copy_single_file(file_data):
-            try:
-                file_path = file_data['path'] if isinstance(file_data, dict) else file_data
-                dest_file = self.get_destination_path(file_path, dest_path, preserve_structure, selected_files)
-                
-                # Create parent directory if needed
-                dest_file.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Handle filename conflicts
-                counter = 1
-                original_dest = dest_file
-                while dest_file.exists():
-                    stem = original_dest.stem
-                    suffix = original_dest.suffix
-                    dest_file = original_dest.parent / f"{stem}_{counter}{suffix}"
-                    counter += 1
-                
-                shutil.copy2(file_path, dest_file)
-                return dest_file, None
-                
-            except Exception as e:
-                return None, f"Error copying {file_path}: {e}"
-        
         # Use ThreadPoolExecutor for parallel copying
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_file = {executor.submit(copy_single_file, file_data): file_data 
+            future_to_file = {executor.submit(self.copy_single_file, file_data, dest_path,
+                                              preserve_structure, selected_files): file_data 
                              for file_data in remaining_files}
             
             for i, future in enumerate(as_completed(future_to_file), 1):
@@ -379,6 +3476,39 @@ class MediaFileSelector:
         
         return copied_count, errors
     
+    def copy_single_file(self, file_data, dest_path, preserve_structure, selected_files):
+        """Copy one selected file, returning (destination file, error message)"""
+        try:
+            file_path = file_data['path'] if isinstance(file_data, dict) else file_data
+            dest_file = self.get_destination_path(file_path, dest_path, preserve_structure, selected_files)
+            
+            # Create parent directory if needed
+            dest_file.parent.mkdir(parents=True, exist_ok=True)
+            
+            # Handle filename conflicts; the name is claimed by creating the file, so
+            # parallel copies of same-named files can't pick the same free name
+            counter = 1
+            original_dest = dest_file
+            while True:
+                try:
+                    open(dest_file, 'xb').close()
+                    break
+                except FileExistsError:
+                    stem = original_dest.stem
+                    suffix = original_dest.suffix
+                    dest_file = original_dest.parent / f"{stem}_{counter}{suffix}"
+                    counter += 1
+            
+            try:
+                shutil.copy2(file_path, dest_file)
+            except BaseException:
+                dest_file.unlink()
+                raise
+            return dest_file, None
+            
+        except Exception as e:
+            return None, f"Error copying {file_path}: {e}"
+    
     def get_destination_path(self, file_path, dest_path, preserve_structure, all_selected_files):
         """Get destination path for a file"""
         if preserve_structure:
@@ -459,6 +3589,11 @@ class MediaFileSelector:
             except ValueError:
                 print("Invalid date format, skipping date filter")
         
+        if 'date_from' in filters or 'date_to' in filters:
+            date_source = self.get_user_input("Compare dates by (mtime, exif)", "mtime").strip().lower()
+            if date_source == 'exif':
+                filters['date_source'] = 'exif'
+        
         # File type filters
         file_types = self.get_user_input("File extensions (comma-separated, e.g., .jpg,.png,.mp4)").strip()
         if file_types:
@@ -469,6 +3604,42 @@ class MediaFileSelector:
         if media_types:
             filters['media_types'] = [mtype.strip() for mtype in media_types.split(',')]
         
+        # Dimension filters (read from file headers)
+        for key, prompt in (('min_width', "Minimum width in pixels"), ('min_height', "Minimum height in pixels")):
+            value = self.get_user_input(prompt).strip()
+            if value:
+                try:
+                    filters[key] = int(value)
+                except ValueError:
+                    print("Invalid number, skipping dimension filter")
+        
+        orientation = self.get_user_input("Orientation (landscape, portrait, square)").strip().lower()
+        if orientation in ('landscape', 'portrait', 'square'):
+            filters['orientation'] = orientation
+        elif orientation:
+            print("Invalid orientation, skipping orientation filter")
+        
+        for key, prompt in (('min_duration', "Minimum video duration (e.g., 30s, 5m)"),
+                            ('max_duration', "Maximum video duration (e.g., 30s, 5m)")):
+            value = self.get_user_input(prompt).strip()
+            if value:
+                try:
+                    filters[key] = parse_duration(value)
+                except argparse.ArgumentTypeError:
+                    print("Invalid duration, skipping duration filter")
+        
+        # Scope filters (excluded directories are never scanned)
+        exclude = self.get_user_input("Exclude patterns (comma-separated, e.g., @eaDir,.thumbnails)").strip()
+        if exclude:
+            filters['exclude'] = [pattern.strip() for pattern in exclude.split(',')]
+        
+        max_depth = self.get_user_input("Maximum folder depth (0 = top level only)").strip()
+        if max_depth:
+            try:
+                filters['max_depth'] = int(max_depth)
+            except ValueError:
+                print("Invalid depth, skipping depth filter")
+        
         return filters if filters else None
     
     def select_folders_interactive(self):
@@ -527,10 +3698,519 @@ class MediaFileSelector:
         
         return source_folders, str(dest_path)
     
+    def resolve_source_folders(self, source_folders):
+        """Canonicalize source folders and drop repeats.
+        
+        A folder nested in another stays a source of its own, but it is walked as
+        part of the outermost folder containing it, and every file belongs to the
+        deepest source folder it is in (see owning_folder).
+        """
+        resolved = []
+        for folder in source_folders:
+            canonical = os.path.realpath(folder)
+            if canonical in resolved:
+                print(f"⚠️  {folder} is listed more than once, using it once")
+                continue
+            resolved.append(canonical)
+        for folder in resolved:
+            parents = [other for other in resolved if path_is_inside(folder, other)]
+            if parents:
+                print(f"📂 {folder} is inside {max(parents, key=len)}: scanned once, its files count only "
+                      f"toward {folder}")
+        return resolved
+    
+    def outermost_folders(self, source_folders, filters=None):
+        """The source folders to walk: those that aren't inside another one.
+        
+        Depth limits and path patterns are relative to each source folder, so with
+        those every folder is walked on its own and the results are deduplicated.
+        """
+        if not ScanFilter.scope_is_portable(ScanFilter.scope_key(filters)):
+            return list(source_folders)
+        return [folder for folder in source_folders
+                if not any(path_is_inside(folder, other) for other in source_folders)]
+    
+    def owning_folder(self, file_path, source_folders):
+        """The deepest of source_folders (a set of canonical paths) containing file_path"""
+        parent = os.path.dirname(str(file_path))
+        while parent not in source_folders:
+            grandparent = os.path.dirname(parent)
+            if grandparent == parent:
+                return None
+            parent = grandparent
+        return parent
+    
+    def folder_router(self, source_folders, scan_roots):
+        """Function mapping (walked root, file record) to the source folder the file counts
+        toward, or None when another walk reports it"""
+        if not any(path_is_inside(a, b) for a in source_folders for b in source_folders):
+            return lambda root, file_data: root
+        folder_set = set(source_folders)
+        root_set = set(scan_roots)
+        
+        def route(root, file_data):
+            owner = self.owning_folder(file_data['path'], folder_set)
+            return owner if owner == root or owner not in root_set else None
+        return route
+    
+    def file_key(self, file_data):
+        """Identity of the file behind a record: (st_dev, st_ino), or the path for partial records"""
+        if 'inode' in file_data:
+            return file_data['device'], file_data['inode']
+        return str(file_data['path'])
+    
+    def dedupe_files(self, files_data):
+        """Drop records of files already seen under another path (hard links, bind mounts, overlapping roots)"""
+        seen = set()
+        unique = []
+        for file_data in files_data:
+            key = self.file_key(file_data)
+            if key not in seen:
+                seen.add(key)
+                unique.append(file_data)
+        if len(unique) < len(files_data):
+            print(f"🔗 Skipped {len(files_data) - len(unique)} files already found under another path")
+        return unique
+    
+    def select_by_reservoir(self, source_folders, num_files=100, target_size=None, balanced=False, filters=None,
+                            scan_method='scandir', scan_workers=1, scan_concurrency=64):
+        """Select files at random in a single scan, holding only the sample.
+        
+        Records flow from the scanner straight into samplers, so memory is
+        proportional to the selection instead of the files found (plus the
+        (st_dev, st_ino) of each stat'ed file, to offer hard links and bind mounts
+        once): a ReservoirSampler for num_files, or a BudgetSampler for
+        target_size. Balanced mode keeps one
+        sampler per source folder (for sizes, each gets an equal share of the
+        budget). The scan cache is neither read nor written, since both would need
+        the full record list.
+        
+        Filters are pushed down into the scanner, and for count-based selection
+        without size/date filters files aren't even stat'ed until they are sampled.
+        """
+        samplers = {}
+        folder_stats = {}
+        seen_keys = set()
+        lock = threading.Lock()
+        if target_size:
+            target_bytes = self.parse_size(target_size)
+            share = target_bytes // len(source_folders) if balanced else target_bytes
+            make_sampler = lambda: BudgetSampler(share)
+        else:
+            make_sampler = lambda: ReservoirSampler(num_files)
+        shared = None if balanced else make_sampler()
+        metadata_filtered = self.metadata_matcher(filters) is not None
+        scan_filter = ScanFilter(self, filters, defer_stat=not target_size and not metadata_filtered)
+        for folder in source_folders:
+            samplers[folder] = shared or make_sampler()
+            folder_stats[folder] = {'types': defaultdict(int), 'total_size': None if scan_filter.defer_stat else 0,
+                                    'count': 0}
+        scan_roots = self.outermost_folders(source_folders, filters)
+        route = self.folder_router(source_folders, scan_roots)
+        
+        print("📁 Scanning folders with reservoir sampling...")
+        start_time = time.time()
+        
+        def scan(folder):
+            def on_batch(files):
+                if scan_method == 'rglob' or metadata_filtered:
+                    files = self.apply_filters(files, filters)
+                with lock:
+                    for file_data in files:
+                        owner = route(folder, file_data)
+                        if owner is None:
+                            continue
+                        # Deferred-stat records only have a path, which route already makes unique
+                        if 'inode' in file_data:
+                            key = self.file_key(file_data)
+                            if key in seen_keys:
+                                continue
+                            seen_keys.add(key)
+                        stats = folder_stats[owner]
+                        sampler = samplers[owner]
+                        stats['count'] += 1
+                        if stats['total_size'] is not None:
+                            stats['total_size'] += file_data['size']
+                        stats['types'][file_data['extension']] += 1
+                        sampler.add(file_data)
+            
+            if not Path(folder).is_dir():
+                print(f"⚠️  Warning: Folder '{folder}' doesn't exist or is not accessible")
+                return
+            print(f"📁 Scanning {folder}...")
+            self.scan_folder(folder, scan_method, scan_workers, scan_concurrency, on_batch, scan_filter)
+        
+        # Metadata filters parse each directory's batch; the pools outlive the batches
+        with self.sharing_metadata_pools(), ThreadPoolExecutor(max_workers=min(len(scan_roots), 4)) as executor:
+            for future in as_completed([executor.submit(scan, folder) for folder in scan_roots]):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"❌ Error scanning folder: {e}")
+        
+        print(f"⏱️  Scanning completed in {time.time() - start_time:.2f} seconds")
+        if not self.print_scan_summary(source_folders, folder_stats):
+            return []
+        
+        if target_size:
+            print(f"🎯 Selecting files to reach approximately {target_size}")
+            if not balanced:
+                return self.dedupe_files(shared.select())
+            print("⚖️  Using balanced selection")
+            selected_files = []
+            for folder in source_folders:
+                selected_files.extend(samplers[folder].select())
+            return self.dedupe_files(selected_files)
+        
+        if not balanced:
+            print("🎲 Using completely random selection (reservoir)")
+            if shared.seen < num_files:
+                print(f"⚠️  Only {shared.seen} files available, but {num_files} requested.")
+            return self.dedupe_files(self.complete_file_records(shared.items))
+        
+        num_files = min(num_files, sum(stats['count'] for stats in folder_stats.values()))
+        print(f"⚖️  Using balanced selection (approximately {num_files // len(source_folders)} per folder)")
+        selected_files = []
+        leftovers = {}
+        files_per_folder = num_files // len(source_folders)
+        remaining = num_files % len(source_folders)
+        for folder in source_folders:
+            # Each reservoir is a uniform sample of its folder, so any slice of a shuffle is too
+            items = samplers[folder].items
+            random.shuffle(items)
+            take = min(files_per_folder + (1 if remaining > 0 else 0), len(items))
+            if remaining > 0:
+                remaining -= 1
+            selected_files.extend(items[:take])
+            leftovers[folder] = items[take:]
+        
+        # Top up from the other folders, weighting each by its unselected population
+        unselected = {folder: samplers[folder].seen - (len(samplers[folder].items) - len(leftovers[folder]))
+                      for folder in source_folders}
+        while len(selected_files) < num_files:
+            candidates = [folder for folder in source_folders if leftovers[folder]]
+            if not candidates:
+                break
+            folder = random.choices(candidates, weights=[unselected[f] for f in candidates])[0]
+            selected_files.append(leftovers[folder].pop())
+            unselected[folder] -= 1
+        return self.dedupe_files(self.complete_file_records(selected_files))
+    
+    def select_from_index(self, index, source_folders, num_files=100, target_size=None, balanced=False, filters=None):
+        """Select files with filtering, counting and random ordering done by a MediaIndex query.
+        
+        Nothing is scanned and only the selected rows become file records. Folders
+        that aren't covered by an indexed root are skipped.
+        """
+        folders = []
+        for folder in source_folders:
+            if index.find_root(folder) is None:
+                print(f"⚠️  {folder} isn't indexed, skipping it (run: index build -s {folder})")
+            else:
+                folders.append(folder)
+        if not folders:
+            return []
+        
+        print(f"📇 Querying index {index.db_path}...")
+        start_time = time.time()
+        if self.metadata_matcher(filters) is not None:
+            index.match_metadata(self, folders, filters)  # One parsing batch for all folders
+        # Files of a nested source folder count toward it, not toward its parents
+        nested = {folder: [other for other in folders if path_is_inside(other, folder)] for folder in folders}
+        folder_stats = {folder: index.folder_stats(self, folder, filters, nested[folder]) for folder in folders}
+        print(f"⏱️  Index query completed in {time.time() - start_time:.2f} seconds")
+        if not self.print_scan_summary(folders, folder_stats):
+            return []
+        
+        if target_size:
+            print(f"🎯 Selecting files to reach approximately {target_size}")
+            groups = [[folder] for folder in folders] if balanced else [folders]
+            if balanced:
+                print("⚖️  Using balanced selection")
+            share = self.parse_size(target_size) // len(groups)
+            selected_rows = []
+            for group in groups:
+                group_size = 0
+                for row in index.query(self, group, filters, shuffle=True,
+                                       exclude_folders=nested[group[0]] if balanced else ()):
+                    if group_size + row[1] <= share:
+                        selected_rows.append(row)
+                        group_size += row[1]
+                    if group_size >= share:
+                        break
+            return [index.row_to_record(row) for row in selected_rows]
+        
+        total_count = sum(stats['count'] for stats in folder_stats.values())
+        if not balanced:
+            print("🎲 Using completely random selection (index)")
+            if total_count < num_files:
+                print(f"⚠️  Only {total_count} files available, but {num_files} requested.")
+            return [index.row_to_record(row) for row in index.query(self, folders, filters, shuffle=True,
+                                                                     limit=num_files)]
+        
+        num_files = min(num_files, total_count)
+        print(f"⚖️  Using balanced selection (approximately {num_files // len(folders)} per folder)")
+        selected_rows = []
+        files_per_folder = num_files // len(folders)
+        remaining = num_files % len(folders)
+        for folder in folders:
+            take = files_per_folder + (1 if remaining > 0 else 0)
+            if remaining > 0:
+                remaining -= 1
+            selected_rows.extend(index.query(self, [folder], filters, shuffle=True, limit=take,
+                                             exclude_folders=nested[folder]))
+        
+        # Top up from all folders; at most len(selected_rows) of these are duplicates
+        chosen = {row[0] for row in selected_rows}
+        if len(selected_rows) < num_files:
+            for row in index.query(self, folders, filters, shuffle=True, limit=num_files):
+                if len(selected_rows) >= num_files:
+                    break
+                if row[0] not in chosen:
+                    selected_rows.append(row)
+        return [index.row_to_record(row) for row in selected_rows]
+    
+    def complete_file_records(self, files_data):
+        """Stat partial records left by a deferred-stat scan and build full records"""
+        completed = []
+        for file_data in files_data:
+            if 'size' in file_data:
+                completed.append(file_data)
+                continue
+            file_path = Path(file_data['path'])
+            try:
+                completed.append(self.build_file_info(file_path, file_path.stat(), file_data['extension']))
+            except (OSError, PermissionError) as e:
+                print(f"⚠️  Couldn't access {file_path}: {e}")
+        return completed
+    
+    def estimate_population(self, source_folders, filters=None):
+        """Estimate per-folder (count, total bytes) after filters from previous scan caches.
+        
+        Returns None when any folder has never been scanned.
+        """
+        estimates = {}
+        scope = ScanFilter.scope_key(filters)
+        for folder in source_folders:
+            cached = self.load_scan_tree(folder, scope)
+            if cached is not None:
+                count, total_size = cached['dirs'].filtered_totals(self, filters)
+            else:
+                # A cache of an enclosing folder covers this one too
+                try:
+                    enclosing = [cache for cache in self.cache_store.overlapping(folder, scope)
+                                 if path_is_inside(os.path.realpath(folder), cache.root)]
+                except:
+                    enclosing = []
+                if not enclosing:
+                    return None
+                count, total_size = enclosing[0].filtered_totals(self, filters, under=os.path.realpath(folder))
+            # Overestimating only means topping up from the rejected reservoir at the
+            # end, while underestimating would starve files found late in the scan
+            slack = self.PIPELINE_ESTIMATE_SLACK
+            estimates[folder] = (int(count * slack) + 1, int(total_size * slack) + 1)
+        return estimates
+    
+    def scan_folder_batches(self, folder, on_batch, filters=None, use_cache=True, scan_method='scandir',
+                            scan_workers=1, scan_concurrency=64):
+        """Walk a folder with the chosen scan engine, handing the filtered media records
+        of each directory to on_batch as it is listed (from several threads with
+        scan_workers or async; rglob hands over everything at the end)"""
+        scope = ScanFilter.scope_key(filters)
+        folder = os.path.realpath(folder)
+        tree = None
+        if use_cache and scan_method != 'rglob':
+            tree = self.cached_tree(folder, self.load_scan_tree(folder, scope), scope)
+        scan_filter = ScanFilter(self, filters, content=tree is None) if filters else None
+        
+        def filtered(files):
+            files = self.apply_filters(files, filters)
+            if files:
+                on_batch(files)
+        
+        started = time.time()
+        self.scan_folder(Path(folder), scan_method, scan_workers, scan_concurrency, filtered, scan_filter, tree)
+        if tree is not None:
+            self.save_scan_tree(folder, tree, scope, verified_at=started)
+    
+    def run_streaming_pipeline(self, source_folders, destination_folder, num_files=100, target_size=None,
+                               balanced=False, dry_run=False, preserve_structure=False, filters=None,
+                               resume_file=None, max_workers=4, use_cache=True, scan_method='scandir', scan_workers=1,
+                               scan_concurrency=64):
+        """Scan, select and copy concurrently so copying starts before scanning finishes.
+        
+        One scanner thread per source folder pushes directory batches into a bounded
+        queue, a streaming selector decides on each record as it arrives and copy
+        workers pick up selections immediately. Selection needs the population size,
+        which comes from the previous scan cache; returns None (caller falls back to
+        the phased scan → select → copy path) when no estimate is available.
+        """
+        estimates = self.estimate_population(source_folders, filters) if use_cache else None
+        if estimates is None:
+            print("⚠️  Pipeline needs a previous scan to size the population; using phased selection")
+            return None
+        
+        target_bytes = self.parse_size(target_size) if target_size else None
+        if balanced:
+            # One selector per source folder, each with an equal share of the target
+            selectors = {}
+            for i, folder in enumerate(source_folders):
+                count, total_bytes = estimates[folder]
+                if target_bytes is not None:
+                    share = target_bytes // len(source_folders)
+                    selectors[folder] = StreamingSelector(count, total_bytes, target_bytes=share)
+                else:
+                    share = num_files // len(source_folders) + (1 if i < num_files % len(source_folders) else 0)
+                    selectors[folder] = StreamingSelector(count, total_bytes, num_files=share)
+        else:
+            count = sum(c for c, _ in estimates.values())
+            total_bytes = sum(b for _, b in estimates.values())
+            shared = StreamingSelector(count, total_bytes, num_files=num_files, target_bytes=target_bytes)
+            selectors = {folder: shared for folder in source_folders}
+        
+        print("🚰 Streaming scan → select → copy pipeline")
+        scan_roots = self.outermost_folders(source_folders, filters)
+        route = self.folder_router(source_folders, scan_roots)
+        offered_keys = set()
+        selected_keys = set()
+        dest_path = Path(destination_folder)
+        records = queue.Queue(maxsize=self.PIPELINE_QUEUE_SIZE)
+        selections = queue.Queue()
+        selected_files = []
+        copied_files = set()
+        errors = []
+        lock = threading.Lock()
+        start_time = time.time()
+        first_copy = []
+        
+        # Resume state holds destination paths of files copied by an earlier run
+        if resume_file and Path(resume_file).exists():
+            state = self.load_operation_state(resume_file)
+            if state:
+                copied_files = set(state.get('copied_files', []))
+                print(f"📁 Resuming operation... {len(copied_files)} files already copied")
+        resumed_files = frozenset(copied_files)
+        copied_count = [len(copied_files)]
+        skipped = []
+        
+        def scanner(folder):
+            try:
+                self.scan_folder_batches(folder, lambda files: records.put((folder, files)), filters, use_cache,
+                                         scan_method, scan_workers, scan_concurrency)
+            except Exception as e:
+                print(f"❌ Error scanning {folder}: {e}")
+            finally:
+                records.put((folder, None))
+        
+        def copier():
+            while True:
+                file_data = selections.get()
+                if file_data is None:
+                    return
+                dest_file = self.get_destination_path(file_data['path'], dest_path, preserve_structure, [file_data])
+                if dest_file in resumed_files:
+                    # Copied by the run being resumed; other name conflicts get a suffix
+                    with lock:
+                        skipped.append(file_data)
+                    continue
+                dest_file, error = self.copy_single_file(file_data, dest_path, preserve_structure, [file_data])
+                with lock:
+                    if error:
+                        errors.append(error)
+                        print(f"❌ {error}")
+                        continue
+                    if not first_copy:
+                        first_copy.append(time.time() - start_time)
+                        print(f"⏱️  First file copied after {first_copy[0]:.2f} seconds")
+                    copied_files.add(dest_file)
+                    copied_count[0] += 1
+                    if copied_count[0] % 10 == 0:
+                        print(f"  Progress: {copied_count[0]} files copied...")
+                        if resume_file:
+                            self.save_operation_state({
+                                'operation': 'copy_files',
+                                'total_files': len(selected_files),
+                                'copied_files': list(copied_files),
+                                'timestamp': datetime.now().isoformat()
+                            }, resume_file)
+        
+        def accept(file_data):
+            # The same file may be reachable from several roots; select it once
+            if self.file_key(file_data) in selected_keys:
+                return
+            selected_keys.add(self.file_key(file_data))
+            selected_files.append(file_data)
+            if not dry_run:
+                selections.put(file_data)
+        
+        if not dry_run:
+            dest_path.mkdir(parents=True, exist_ok=True)
+        scanners = [threading.Thread(target=scanner, args=(folder,), daemon=True) for folder in scan_roots]
+        copiers = [] if dry_run else [threading.Thread(target=copier, daemon=True) for _ in range(max_workers)]
+        # Metadata filters parse each directory's batch; the pools outlive the batches
+        with self.sharing_metadata_pools():
+            for thread in scanners + copiers:
+                thread.start()
+            
+            # Streaming selection runs on this thread while scanners and copiers work
+            scanning = len(scanners)
+            while scanning:
+                folder, batch = records.get()
+                if batch is None:
+                    scanning -= 1
+                    continue
+                for file_data in batch:
+                    owner = route(folder, file_data)
+                    if owner is None:
+                        continue
+                    # Offer each file once, or a duplicate would take a selection slot
+                    key = self.file_key(file_data)
+                    if key in offered_keys:
+                        continue
+                    offered_keys.add(key)
+                    if selectors[owner].offer(file_data):
+                        accept(file_data)
+        print(f"⏱️  Scanning completed in {time.time() - start_time:.2f} seconds")
+        
+        # Population estimates can be off; top up from the reservoirs of rejected files
+        for selector in {id(sel): sel for sel in selectors.values()}.values():
+            for file_data in selector.finish():
+                accept(file_data)
+        if balanced and target_bytes is None and len(selected_files) < num_files:
+            leftovers = []
+            for selector in selectors.values():
+                leftovers.extend(selector.rejected)
+            random.shuffle(leftovers)
+            for file_data in leftovers[:num_files - len(selected_files)]:
+                accept(file_data)
+        
+        for _ in copiers:
+            selections.put(None)
+        for thread in copiers:
+            thread.join()
+        
+        print(f"\n🎯 Selected {len(selected_files)} files")
+        if not selected_files:
+            print("❌ No media files found matching your criteria!")
+            return 0
+        selection_stats = self.get_file_stats(selected_files)
+        
+        if dry_run:
+            self.print_dry_run_summary(selected_files, selection_stats)
+            return len(selected_files)
+        
+        print(f"⏱️  Pipeline completed in {time.time() - start_time:.2f} seconds")
+        if skipped:
+            print(f"⏭️  Skipped {len(skipped)} selected files already copied by the resumed run")
+        self.finish_copy_operation(selected_files, destination_folder, selection_stats,
+                                   copied_count[0], errors, filters, resume_file)
+        return copied_count[0]
+    
     def randomly_select_and_copy_files(self, source_folders, destination_folder, num_files=100, 
                                      target_size=None, balanced=False, dry_run=False, 
                                      preserve_structure=False, filters=None, resume_file=None,
-                                     max_workers=4, use_cache=True):
+                                     max_workers=4, use_cache=True, scan_method='scandir', scan_workers=1,
+                                     scan_concurrency=64, pipeline=False, reservoir=False, index=None):
         """
         Enhanced file selection and copying with all new features
         """
@@ -548,55 +4228,86 @@ class MediaFileSelector:
         if resume_file is None:
             resume_file = dest_path / 'operation_resume.json'
         
+        source_folders = self.resolve_source_folders(source_folders)
+        
+        if index is not None:
+            selected_files = self.select_from_index(index, source_folders, num_files, target_size, balanced, filters)
+            if not selected_files:
+                return 0
+            return self.copy_selected_files(selected_files, destination_folder, dry_run, preserve_structure,
+                                            filters, resume_file, max_workers)
+        
+        if pipeline:
+            copied = self.run_streaming_pipeline(
+                source_folders, destination_folder, num_files, target_size, balanced, dry_run,
+                preserve_structure, filters, resume_file, max_workers, use_cache, scan_method, scan_workers,
+                scan_concurrency
+            )
+            if copied is not None:
+                return copied
+        
+        if reservoir:
+            selected_files = self.select_by_reservoir(
+                source_folders, num_files, target_size, balanced, filters, scan_method, scan_workers,
+                scan_concurrency
+            )
+            if not selected_files:
+                return 0
+            return self.copy_selected_files(selected_files, destination_folder, dry_run, preserve_structure,
+                                            filters, resume_file, max_workers)
+        
         # Collect all files from all source folders with optimizations
         all_files_data = []
-        folder_files = {}
+        folder_files = {folder: [] for folder in source_folders}
+        scan_roots = self.outermost_folders(source_folders, filters)
+        route = self.folder_router(source_folders, scan_roots)
+        
+        def add_files(root, files):
+            for file_data in files:
+                owner = route(root, file_data)
+                if owner is not None:
+                    folder_files[owner].append(file_data)
         
         print("📁 Scanning folders with optimizations...")
         start_time = time.time()
         
         # Use parallel scanning for multiple folders
-        if len(source_folders) > 1:
-            with ThreadPoolExecutor(max_workers=min(len(source_folders), 4)) as executor:
+        if len(scan_roots) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(scan_roots), 4)) as executor:
                 future_to_folder = {
-                    executor.submit(self.collect_media_files_optimized, folder, filters, use_cache): folder 
-                    for folder in source_folders
+                    executor.submit(self.collect_media_files_optimized, folder, filters, use_cache,
+                                    scan_method, scan_workers, scan_concurrency): folder 
+                    for folder in scan_roots
                 }
                 
                 for future in as_completed(future_to_folder):
                     folder = future_to_folder[future]
                     try:
-                        files = future.result()
-                        folder_files[folder] = files
-                        all_files_data.extend(files)
+                        add_files(folder, future.result())
                     except Exception as e:
                         print(f"❌ Error scanning {folder}: {e}")
         else:
-            for folder in source_folders:
-                files = self.collect_media_files_optimized(folder, filters, use_cache)
-                folder_files[folder] = files
-                all_files_data.extend(files)
+            for folder in scan_roots:
+                add_files(folder, self.collect_media_files_optimized(folder, filters, use_cache, scan_method,
+                                                                     scan_workers, scan_concurrency))
+        
+        # The same file can turn up under several roots (hard links, bind mounts)
+        for folder in source_folders:
+            all_files_data.extend(folder_files[folder])
+        unique_files = self.dedupe_files(all_files_data)
+        if len(unique_files) < len(all_files_data):
+            unique_ids = {id(file_data) for file_data in unique_files}
+            folder_files = {folder: [f for f in files if id(f) in unique_ids] for folder, files in folder_files.items()}
+            all_files_data = unique_files
         
         scan_time = time.time() - start_time
         print(f"⏱️  Scanning completed in {scan_time:.2f} seconds")
         
         # Display folder statistics
-        for i, folder in enumerate(source_folders, 1):
-            files = folder_files[folder]
-            stats = self.get_file_stats(files)
-            print(f"  Folder {i}: {len(files)} files ({self.format_size(stats['total_size'])})")
-            if stats['types']:
-                type_summary = ', '.join([f"{ext}: {count}" for ext, count in sorted(stats['types'].items())])
-                print(f"    Types: {type_summary}")
-        
-        print(f"\n📊 Total files found: {len(all_files_data)}")
-        if len(all_files_data) == 0:
-            print("❌ No media files found matching your criteria!")
+        if not self.print_scan_summary(source_folders,
+                                       {folder: self.get_file_stats(files) for folder, files in folder_files.items()}):
             return 0
         
-        total_stats = self.get_file_stats(all_files_data)
-        print(f"📊 Total size: {self.format_size(total_stats['total_size'])}")
-        
         # Selection logic
         if target_size:
             print(f"🎯 Selecting files to reach approximately {target_size}")
@@ -630,25 +4341,19 @@ class MediaFileSelector:
                 print("🎲 Using completely random selection")
                 selected_files = random.sample(all_files_data, num_files)
         
+        return self.copy_selected_files(selected_files, destination_folder, dry_run, preserve_structure,
+                                        filters, resume_file, max_workers)
+    
+    def copy_selected_files(self, selected_files, destination_folder, dry_run=False, preserve_structure=False,
+                            filters=None, resume_file=None, max_workers=4):
+        """Report the selection, then copy it (or show the dry-run preview)"""
         print(f"\n🎯 Selected {len(selected_files)} files")
         
         # Calculate selection statistics
         selection_stats = self.get_file_stats(selected_files)
         
         if dry_run:
-            print("\n🔍 DRY RUN - No files will be copied")
-            print(f"Would copy {self.format_size(selection_stats['total_size'])} of data")
-            print(f"File type breakdown:")
-            for ext, count in sorted(selection_stats['types'].items()):
-                print(f"  {ext}: {count} files")
-            
-            print("\nSample of selected files:")
-            for i, file_data in enumerate(selected_files[:10]):
-                file_path = file_data['path'] if isinstance(file_data, dict) else file_data
-                size = self.format_size(file_data['size']) if isinstance(file_data, dict) else "unknown size"
-                print(f"  {i+1}. {file_path} ({size})")
-            if len(selected_files) > 10:
-                print(f"  ... and {len(selected_files) - 10} more files")
+            self.print_dry_run_summary(selected_files, selection_stats)
             return len(selected_files)
         
         # Copy selected files with parallel processing and resume capability
@@ -663,6 +4368,58 @@ class MediaFileSelector:
         copy_time = time.time() - start_time
         print(f"⏱️  Copying completed in {copy_time:.2f} seconds")
         
+        self.finish_copy_operation(selected_files, destination_folder, selection_stats,
+                                   copied_count, errors, filters, resume_file)
+        return copied_count
+    
+    def print_scan_summary(self, source_folders, folder_stats):
+        """Print per-folder and total scan statistics; returns False if nothing was found"""
+        total_count = 0
+        total_size = 0
+        for i, folder in enumerate(source_folders, 1):
+            stats = folder_stats[folder]
+            if stats['total_size'] is None:
+                # Deferred-stat scans only know sizes of the files they sample
+                print(f"  Folder {i}: {stats['count']} files")
+            else:
+                print(f"  Folder {i}: {stats['count']} files ({self.format_size(stats['total_size'])})")
+            if stats['types']:
+                type_summary = ', '.join([f"{ext}: {count}" for ext, count in sorted(stats['types'].items())])
+                print(f"    Types: {type_summary}")
+            total_count += stats['count']
+            if total_size is not None and stats['total_size'] is not None:
+                total_size += stats['total_size']
+            else:
+                total_size = None
+        
+        print(f"\n📊 Total files found: {total_count}")
+        if total_count == 0:
+            print("❌ No media files found matching your criteria!")
+            return False
+        
+        if total_size is not None:
+            print(f"📊 Total size: {self.format_size(total_size)}")
+        return True
+    
+    def print_dry_run_summary(self, selected_files, selection_stats):
+        """Show what a dry run would have copied"""
+        print("\n🔍 DRY RUN - No files will be copied")
+        print(f"Would copy {self.format_size(selection_stats['total_size'])} of data")
+        print(f"File type breakdown:")
+        for ext, count in sorted(selection_stats['types'].items()):
+            print(f"  {ext}: {count} files")
+        
+        print("\nSample of selected files:")
+        for i, file_data in enumerate(selected_files[:10]):
+            file_path = file_data['path'] if isinstance(file_data, dict) else file_data
+            size = self.format_size(file_data['size']) if isinstance(file_data, dict) else "unknown size"
+            print(f"  {i+1}. {file_path} ({size})")
+        if len(selected_files) > 10:
+            print(f"  ... and {len(selected_files) - 10} more files")
+    
+    def finish_copy_operation(self, selected_files, destination_folder, selection_stats,
+                              copied_count, errors, filters, resume_file):
+        """Write the selection log, report results and clean up the resume file"""
         # Save selection log
         self.save_selection_log(selected_files, destination_folder, selection_stats, filters)
         
@@ -683,8 +4440,10 @@ class MediaFileSelector:
                 print("🧹 Cleaned up resume file")
             except:
                 pass
-        
-        return copied_count
+
+def path_is_inside(path, root):
+    """True if path is strictly below root (both canonical)"""
+    return path.startswith(root.rstrip(os.sep) + os.sep)
 
 def parse_folder_list(folder_string):
     """Parse comma-separated folder list"""
@@ -699,8 +4458,293 @@ def parse_folder_list(folder_string):
                 print(f"⚠️  Warning: Skipping invalid folder: {folder}")
     return folders
 
+def build_filters(args):
+    """Build the filters dict from command line arguments (options a parser lacks are skipped)"""
+    options = vars(args)
+    filters = {}
+    for key in ('min_size', 'max_size', 'date_from', 'date_to'):
+        if options.get(key):
+            filters[key] = options[key]
+    for key in ('file_types', 'media_types', 'include', 'exclude'):
+        if options.get(key):
+            filters[key] = [value.strip() for value in options[key].split(',')]
+    if options.get('max_depth') is not None:
+        filters['max_depth'] = options['max_depth']
+    for key in ('min_width', 'min_height', 'orientation'):
+        if options.get(key):
+            filters[key] = options[key]
+    for key in ('min_duration', 'max_duration'):
+        if options.get(key) is not None:
+            filters[key] = options[key]
+    if options.get('date_source') == 'exif' and (options.get('date_from') or options.get('date_to')):
+        filters['date_source'] = 'exif'
+    if options.get('sniff_content'):
+        filters['sniff_content'] = True
+        if options.get('trust_extensions'):
+            filters['trusted_extensions'] = sorted({value.strip().lower()
+                                                    for value in options['trust_extensions'].split(',')})
+    if options.get('include_extensionless'):
+        filters['extensionless'] = True
+    return filters if filters else None
+
+def read_metadata_batch(batch):
+    """Run METADATA_READERS over (path, reader name) pairs in a worker process.
+    
+    Returns one tuple per file with its fields in METADATA_FIELDS order (None
+    where absent); a file that can't be parsed gets all None, like in-process parsing.
+    """
+    selector = MediaFileSelector()
+    results = []
+    for path, reader in batch:
+        try:
+            fields = getattr(selector, reader)(Path(path))
+        except (OSError, ValueError, IndexError, struct.error):
+            fields = {}
+        results.append(tuple(fields.get(name) for name in MediaFileSelector.METADATA_FIELDS))
+    return results
+
+def default_cache_dir():
+    """Per-user cache directory ($XDG_CACHE_HOME/smart-media-sampler)"""
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'smart-media-sampler'
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', type=str, default=str(default_cache_dir()),
+                       help='Directory for scan caches and the index (default: %(default)s)')
+    parser.add_argument('--index-db', type=str,
+                       help='Index database path (default: media_index.db in the cache directory)')
+    parser.add_argument('--cache-budget', type=str, default='1GB',
+                       help='Total size of scan caches; least recently used ones are evicted (default: 1GB)')
+
+def parse_duration(text):
+    """Parse a duration like '90', '15m', '2h' or '1d' to seconds (argparse type)"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    text = text.strip().lower()
+    try:
+        if text and text[-1] in units:
+            return float(text[:-1]) * units[text[-1]]
+        return float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {text!r} (use e.g. 30s, 15m, 2h, 1d)")
+
+def scan_cache_store(selector, args):
+    return ScanCacheStore(Path(args.cache_dir) / 'scans', selector.parse_size(args.cache_budget))
+
+def metadata_cache(args):
+    return MetadataCache(Path(args.cache_dir) / 'metadata.db')
+
+def index_db_path(args):
+    return args.index_db or str(Path(args.cache_dir) / 'media_index.db')
+
+def add_scope_arguments(parser):
+    parser.add_argument('--include', type=str,
+                       help='Only files matching these glob patterns (comma-separated, e.g. "*.jpg,2024/*")')
+    parser.add_argument('--exclude', type=str,
+                       help='Skip files and whole directories matching these patterns (e.g. "@eaDir,.git")')
+    parser.add_argument('--max-depth', type=int,
+                       help='Maximum directory depth below each source folder (0 = top level only)')
+    parser.add_argument('--sniff-content', action='store_true',
+                       help='Classify files by their first bytes instead of their extension (e.g. PNGs named .jpg)')
+    parser.add_argument('--trust-extensions', type=str,
+                       help='With --sniff-content, classify these extensions by name without reading them '
+                            '(comma-separated, e.g. ".mp4,.mkv")')
+    parser.add_argument('--include-extensionless', action='store_true',
+                       help='Also include files without an extension whose content is a recognised media format')
+
+def add_metadata_arguments(parser):
+    parser.add_argument('--min-width', type=int, help='Minimum width in pixels (read from file headers)')
+    parser.add_argument('--min-height', type=int, help='Minimum height in pixels (read from file headers)')
+    parser.add_argument('--orientation', choices=['landscape', 'portrait', 'square'],
+                       help='Only files with this orientation')
+    parser.add_argument('--min-duration', type=parse_duration, metavar='DURATION',
+                       help='Only videos at least this long (e.g. 90, 30s, 5m)')
+    parser.add_argument('--max-duration', type=parse_duration, metavar='DURATION',
+                       help='Only videos at most this long (e.g. 10m)')
+    parser.add_argument('--date-source', choices=['mtime', 'exif'], default='mtime',
+                       help='Compare --date-from/--date-to with the modification time or the EXIF capture '
+                            'time, falling back to the modification time (default: mtime)')
+
+def index_main(argv):
+    """The index build|update|query|stats subcommands"""
+    parser = argparse.ArgumentParser(prog='Smart_Media_Sampler.py index',
+                                     description='Manage the central SQLite media index')
+    add_cache_arguments(parser)
+    commands = parser.add_subparsers(dest='command')
+    
+    build = commands.add_parser('build', help='Index source folders from scratch')
+    update = commands.add_parser('update', help='Re-list only directories that changed since the last run')
+    for command in (build, update):
+        command.add_argument('--source-folders', '-s', type=str,
+                            help='Comma-separated folders to index (update defaults to every indexed folder)')
+        add_scope_arguments(command)
+        command.add_argument('--scan-method', choices=['scandir', 'async'], default='scandir',
+                            help='Directory scanning implementation (default: scandir)')
+        command.add_argument('--scan-workers', type=int, default=1,
+                            help='Threads walking each source folder with the scandir scanner (default: 1)')
+        command.add_argument('--scan-concurrency', type=int, default=64,
+                            help='In-flight listings/stats per source folder with --scan-method async (default: 64)')
+    
+    query = commands.add_parser('query', help='Print indexed files matching filters')
+    query.add_argument('--source-folders', '-s', type=str,
+                       help='Comma-separated folders to query (default: every indexed folder)')
+    query.add_argument('--min-size', type=str, help='Minimum file size (e.g., 1MB)')
+    query.add_argument('--max-size', type=str, help='Maximum file size (e.g., 100MB)')
+    query.add_argument('--date-from', type=str, help='Files modified from date (YYYY-MM-DD)')
+    query.add_argument('--date-to', type=str, help='Files modified to date (YYYY-MM-DD)')
+    query.add_argument('--file-types', type=str, help='File extensions (comma-separated)')
+    query.add_argument('--media-types', type=str, help='Media types (image,video,other)')
+    add_metadata_arguments(query)
+    add_scope_arguments(query)
+    query.add_argument('--limit', type=int, help='Print at most this many files')
+    query.add_argument('--random', action='store_true', help='Random order instead of by path')
+    
+    commands.add_parser('stats', help='Show indexed folders and totals')
+    
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+    
+    selector = MediaFileSelector()
+    selector.metadata_cache = metadata_cache(args)
+    index = MediaIndex(index_db_path(args))
+    try:
+        if args.command in ('build', 'update'):
+            if args.source_folders:
+                folders = parse_folder_list(args.source_folders)
+            elif args.command == 'update':
+                folders = list(index.roots())
+            else:
+                folders = []
+            if not folders:
+                print(f"❌ Error: no folders to {args.command} (use --source-folders)")
+                sys.exit(1)
+            for folder in folders:
+                print(f"📇 Indexing {folder}...")
+                start_time = time.time()
+                filters = build_filters(args)
+                if filters is None and args.command == 'update':
+                    # Keep the scope rules the folder was indexed with
+                    filters = index.scope_filters(index.find_root(folder))
+                tree = index.update(selector, folder, filters, args.command == 'build', args.scan_method,
+                                    args.scan_workers, args.scan_concurrency)
+                print(f"✅ {folder}: {len(tree.dirs)} directories ({tree.reused} unchanged, "
+                      f"{tree.relisted} listed) in {time.time() - start_time:.2f} seconds")
+        
+        elif args.command == 'query':
+            folders = parse_folder_list(args.source_folders) if args.source_folders else list(index.roots())
+            count = 0
+            for row in index.query(selector, folders, build_filters(args), args.random, args.limit):
+                path, size, mtime = row[:3]
+                print(f"{selector.format_size(size):>10}  {datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M}  {path}")
+                count += 1
+            print(f"📊 {count} files", file=sys.stderr)
+        
+        elif args.command == 'stats':
+            total_files = total_size = 0
+            for root, scope, updated, dir_count, file_count, size in index.stats():
+                print(f"📂 {root}")
+                print(f"    {file_count} files ({selector.format_size(size)}) in {dir_count} directories, "
+                      f"updated {datetime.fromtimestamp(updated):%Y-%m-%d %H:%M}")
+                if json.loads(scope):
+                    scope = json.loads(scope)
+                    include, exclude, max_depth = scope[:3]
+                    print(f"    Scope: include {include or '-'}, exclude {exclude or '-'}, max depth {max_depth}")
+                    if len(scope) > 3:
+                        print(f"    Classified by content: {', '.join(option for option, _ in scope[3])}")
+                total_files += file_count
+                total_size += size
+            print(f"\n📊 {total_files} files ({selector.format_size(total_size)}) in {index.db_path} "
+                  f"({selector.format_size(index.db_path.stat().st_size)})")
+    finally:
+        index.close()
+
+def cache_main(argv):
+    """The cache stats|gc|refresh subcommands"""
+    parser = argparse.ArgumentParser(prog='Smart_Media_Sampler.py cache',
+                                     description='Inspect and clean up the scan cache store')
+    add_cache_arguments(parser)
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('stats', help='Show cached source folders, sizes and hit rates')
+    commands.add_parser('gc', help='Delete caches of missing folders, evict down to the budget, drop metadata '
+                                   'unused for 90 days and remove caches older versions left in source folders')
+    refresh = commands.add_parser('refresh', help='Re-list changed directories of cached source folders')
+    refresh.add_argument('--source-folders', '-s', type=str, required=True,
+                         help='Comma-separated folders to refresh')
+    add_scope_arguments(refresh)
+    refresh.add_argument('--scan-method', choices=['scandir', 'async'], default='scandir',
+                         help='Directory scanning implementation (default: scandir)')
+    refresh.add_argument('--scan-workers', type=int, default=1,
+                         help='Threads walking each source folder with the scandir scanner (default: 1)')
+    refresh.add_argument('--scan-concurrency', type=int, default=64,
+                         help='In-flight listings/stats per source folder with --scan-method async (default: 64)')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+    
+    selector = MediaFileSelector()
+    store = selector.cache_store = scan_cache_store(selector, args)
+    selector.metadata_cache = metadata_cache(args)
+    if args.command == 'gc':
+        missing, evicted = store.collect()
+        for entry in missing:
+            print(f"🧹 Removed cache of missing folder {entry['root']} ({selector.format_size(entry['size'])})")
+        for entry in evicted:
+            print(f"🧹 Evicted cache of {entry['root']} ({selector.format_size(entry['size'])})")
+        legacy = store.remove_legacy_caches()
+        for path, size in legacy:
+            print(f"🧹 Removed old in-folder cache {path} ({selector.format_size(size)})")
+        pruned = selector.metadata_cache.prune()
+        if pruned:
+            print(f"🧹 Dropped metadata of {pruned} files unused for {MetadataCache.PRUNE_AGE // 86400} days")
+        freed = sum(entry['size'] for entry in missing + evicted) + sum(size for _, size in legacy)
+        print(f"✅ Freed {selector.format_size(freed)}")
+        return
+    if args.command == 'refresh':
+        filters = build_filters(args)
+        for folder in parse_folder_list(args.source_folders):
+            tree = selector.refresh_scan_cache(folder, filters, args.scan_method, args.scan_workers,
+                                               args.scan_concurrency)
+            if tree is None:
+                print(f"⏳ {folder} is already being refreshed")
+            else:
+                print(f"✅ Refreshed {folder}: reused {tree.reused} cached directories, re-listed {tree.relisted}")
+        return
+    
+    entries = sorted(store.entries(), key=lambda e: e['last_used'], reverse=True)
+    totals = defaultdict(int)
+    for entry in entries:
+        lookups = entry.get('hits', 0) + entry.get('misses', 0)
+        dirs = entry.get('reused_dirs', 0) + entry.get('relisted_dirs', 0)
+        print(f"📂 {entry['root']}{'' if entry['root'] and os.path.isdir(entry['root']) else ' (missing)'}")
+        print(f"    {selector.format_size(entry['size'])}, last used "
+              f"{datetime.fromtimestamp(entry['last_used']):%Y-%m-%d %H:%M}")
+        if lookups:
+            print(f"    Hits: {entry.get('hits', 0)}/{lookups} ({entry.get('hits', 0) / lookups:.0%})"
+                  + (f", directories reused: {entry.get('reused_dirs', 0) / dirs:.0%}" if dirs else ""))
+        for key in ('size', 'hits', 'misses', 'reused_dirs', 'relisted_dirs'):
+            totals[key] += entry.get(key, 0)
+    
+    lookups = totals['hits'] + totals['misses']
+    dirs = totals['reused_dirs'] + totals['relisted_dirs']
+    print(f"\n📊 {len(entries)} caches, {selector.format_size(totals['size'])} of "
+          f"{selector.format_size(store.budget)} budget in {store.cache_dir}")
+    if lookups:
+        print(f"📊 Hit rate: {totals['hits'] / lookups:.0%} of {lookups} lookups"
+              + (f", {totals['reused_dirs'] / dirs:.0%} of directories served from cache" if dirs else ""))
+    entries, size = selector.metadata_cache.stats()
+    if entries:
+        print(f"📊 Metadata of {entries} files, {selector.format_size(size)} in {selector.metadata_cache.db_path}")
+
 def main():
     """Main function with enhanced command line arguments and interactive mode"""
+    if len(sys.argv) > 1 and sys.argv[1] == 'index':
+        index_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'cache':
+        cache_main(sys.argv[2:])
+        return
+    
     parser = argparse.ArgumentParser(description='Enhanced Random Media File Selector with advanced filtering and performance optimizations')
 
     # Basic arguments
@@ -730,14 +4774,49 @@ def main():
     parser.add_argument('--date-to', type=str, help='Files modified to date (YYYY-MM-DD)')
     parser.add_argument('--file-types', type=str, help='File extensions (comma-separated)')
     parser.add_argument('--media-types', type=str, help='Media types (image,video,other)')
+    add_metadata_arguments(parser)
+    add_scope_arguments(parser)
 
     # Performance options
     parser.add_argument('--max-workers', type=int, default=4,
                        help='Maximum parallel workers for copying (default: 4)')
+    parser.add_argument('--metadata-workers', type=int, default=1,
+                       help='Processes reading file headers for dimension/duration/EXIF filters '
+                            '(default: 1, parse in threads)')
     parser.add_argument('--no-cache', action='store_true',
                        help='Disable file scanning cache')
+    parser.add_argument('--max-staleness', type=parse_duration, metavar='DURATION',
+                       help='Use a scan cache verified within this long (e.g. 15m) without touching the disk')
+    parser.add_argument('--stale-policy', choices=['background', 'block'], default='background',
+                       help='With --max-staleness, what to do with an older cache: use it and refresh it '
+                            'in the background, or rescan before selecting (default: background)')
     parser.add_argument('--resume-file', type=str,
                        help='Resume file path for interrupted operations')
+    parser.add_argument('--scan-method', choices=['scandir', 'rglob', 'async'], default='scandir',
+                       help='Directory scanning implementation (default: scandir)')
+    parser.add_argument('--scan-workers', type=int, default=1,
+                       help='Threads walking each source folder with the scandir scanner (default: 1)')
+    parser.add_argument('--scan-concurrency', type=int, default=64,
+                       help='In-flight listings/stats per source folder with --scan-method async (default: 64)')
+    parser.add_argument('--simulate-latency', type=float, metavar='MS',
+                       help='Add MS milliseconds to every directory listing and stat (for benchmarking)')
+    parser.add_argument('--reservoir', action='store_true',
+                       help='Select in one pass keeping only the sample in memory (bypasses the cache)')
+    parser.add_argument('--pipeline', action='store_true',
+                       help='Start copying while scanning (uses the previous scan to size the population)')
+    parser.add_argument('--benchmark-scan', action='store_true',
+                       help='Benchmark scan methods on the source folders and exit')
+
+    # Central index (see the index subcommands)
+    parser.add_argument('--use-index', action='store_true',
+                       help='Select from the central index instead of scanning (run "index build" first)')
+    add_cache_arguments(parser)
+    
+    # Live index
+    parser.add_argument('--watch', action='store_true',
+                       help='Keep the scan cache of the source folders current with inotify until interrupted')
+    parser.add_argument('--watch-interval', type=int, default=30,
+                       help='Seconds between cache heartbeats, or between rescans without inotify (default: 30)')
 
     # Undo option (must be here, before parse_args)
     parser.add_argument('--undo', action='store_true', help='Undo the last copy operation (delete copied files)')
@@ -746,6 +4825,13 @@ def main():
     
     # Create selector instance
     selector = MediaFileSelector()
+    selector.cache_store = scan_cache_store(selector, args)
+    selector.metadata_cache = metadata_cache(args)
+    selector.max_staleness = args.max_staleness
+    selector.metadata_workers = args.metadata_workers
+    selector.stale_policy = args.stale_policy
+    if args.simulate_latency:
+        selector.filesystem = SimulatedLatencyFilesystem(args.simulate_latency / 1000.0)
     
     print("🎲 Enhanced Random Media File Selector")
     print("=" * 50)
@@ -761,6 +4847,25 @@ def main():
         selector.undo_last_operation(dest)
         return
 
+    # Scan benchmark only needs source folders
+    if args.benchmark_scan:
+        source_folders = parse_folder_list(args.source_folders or '')
+        if not source_folders:
+            print("❌ Error: --source-folders is required for --benchmark-scan")
+            sys.exit(1)
+        selector.benchmark_scan(source_folders, scan_workers=args.scan_workers,
+                                scan_concurrency=args.scan_concurrency)
+        return
+
+    # Watch mode only needs source folders (and scope filters)
+    if args.watch:
+        source_folders = parse_folder_list(args.source_folders or '')
+        if not source_folders:
+            print("❌ Error: --source-folders is required for --watch")
+            sys.exit(1)
+        LiveIndexWatcher(selector, source_folders, build_filters(args), args.watch_interval).run()
+        return
+
     # Determine mode: command line args vs interactive
     if args.interactive or (not args.source_folders and not args.destination):
         print("🔧 Running in interactive mode...")
@@ -836,21 +4941,7 @@ def main():
         use_cache = not args.no_cache
 
         # Build filters from command line arguments
-        filters = {}
-        if args.min_size:
-            filters['min_size'] = args.min_size
-        if args.max_size:
-            filters['max_size'] = args.max_size
-        if args.date_from:
-            filters['date_from'] = args.date_from
-        if args.date_to:
-            filters['date_to'] = args.date_to
-        if args.file_types:
-            filters['file_types'] = [ext.strip() for ext in args.file_types.split(',')]
-        if args.media_types:
-            filters['media_types'] = [mtype.strip() for mtype in args.media_types.split(',')]
-
-        filters = filters if filters else None
+        filters = build_filters(args)
 
         if not source_folders:
             print("❌ No valid source folders found!")
@@ -885,10 +4976,25 @@ def main():
             print(f"  📅 From date: {filters['date_from']}")
         if 'date_to' in filters:
             print(f"  📅 To date: {filters['date_to']}")
+        if filters.get('date_source') == 'exif':
+            print("  📅 Dates from: EXIF capture time")
         if 'file_types' in filters:
             print(f"  📄 File types: {', '.join(filters['file_types'])}")
         if 'media_types' in filters:
             print(f"  🎬 Media types: {', '.join(filters['media_types'])}")
+        if 'min_width' in filters or 'min_height' in filters:
+            print(f"  🖼️  Min dimensions: {filters.get('min_width', 0)}x{filters.get('min_height', 0)}")
+        if 'orientation' in filters:
+            print(f"  🖼️  Orientation: {filters['orientation']}")
+        if 'min_duration' in filters or 'max_duration' in filters:
+            print(f"  ⏱️  Duration: {selector.format_age(filters.get('min_duration', 0))} - "
+                  f"{selector.format_age(filters['max_duration']) if 'max_duration' in filters else 'any'}")
+        if 'include' in filters:
+            print(f"  ✅ Include: {', '.join(filters['include'])}")
+        if 'exclude' in filters:
+            print(f"  🚫 Exclude: {', '.join(filters['exclude'])}")
+        if 'max_depth' in filters:
+            print(f"  📂 Max depth: {filters['max_depth']}")
     
     print(f"⚡ Performance: {max_workers} parallel workers, caching {'enabled' if use_cache else 'disabled'}")
     print("-" * 50)
@@ -913,7 +5019,13 @@ def main():
             filters=filters,
             resume_file=args.resume_file,
             max_workers=max_workers,
-            use_cache=use_cache
+            use_cache=use_cache,
+            scan_method=args.scan_method,
+            scan_workers=args.scan_workers,
+            scan_concurrency=args.scan_concurrency,
+            pipeline=args.pipeline,
+            reservoir=args.reservoir,
+            index=MediaIndex(index_db_path(args)) if args.use_index else None
         )
         
         if not dry_run and copied > 0:
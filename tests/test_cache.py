@@ -0,0 +1,171 @@
+import fcntl
+import time
+from datetime import datetime
+from pathlib import Path
+
+from Smart_Media_Sampler import ColumnarTreeCache, LiveIndexWatcher, MediaFileSelector, ScanCacheStore, ScanFilter
+
+
+def test_columnar_cache_round_trip(tmp_path):
+    root, sub = str(tmp_path / 'src'), str(tmp_path / 'src' / 'été')
+    files = {
+        root: [{'path': Path(root, 'a.jpg'), 'size': 12345, 'created': datetime(2021, 7, 4, 18, 30),
+                'modified': datetime(2021, 7, 4, 18, 30, 5, 123456), 'extension': '.jpg', 'device': 2049,
+                'inode': 7, 'type': 'image', 'width': 4000, 'height': 3000, 'gps': [48.8566667, -2.35]},
+               {'path': Path(root, 'b.mp4'), 'size': 3 << 40, 'created': datetime(2001, 9, 9, 3, 46, 40),
+                'modified': datetime(2000, 1, 1, 0, 0, 0, 1), 'extension': '.mp4', 'device': 2049, 'inode': 8,
+                'type': 'video'}],
+        sub: [{'path': Path(sub, 'ça.png'), 'size': 0, 'created': datetime(2023, 11, 14, 22, 13, 20),
+               'modified': datetime(2023, 11, 14, 22, 13, 20), 'extension': '.png', 'device': 2050,
+               'inode': 1 << 40, 'type': 'image'}],
+    }
+    dirs = {root: (1625423405123456789, [sub], files[root]), sub: (None, [], files[sub])}
+    cache_file = tmp_path / 'tree.col'
+    ColumnarTreeCache.write(cache_file, dirs, scope=['scope'], live_until=42)
+    
+    cache = ColumnarTreeCache(cache_file)
+    assert (cache.scope, cache.live_until) == (['scope'], 42)
+    assert sorted(cache) == sorted(dirs)
+    for path, (mtime_ns, subdirs, records) in dirs.items():
+        cached_mtime_ns, cached_subdirs, cached_records = cache[path]
+        assert (cached_mtime_ns, cached_subdirs) == (mtime_ns, subdirs)
+        assert len(cached_records) == len(records)
+        for cached, fields in zip(cached_records, records):
+            assert {key: cached[key] for key in fields} == fields
+
+
+def test_removed_caches_leave_no_sidecar_files(tmp_path):
+    store = ScanCacheStore(tmp_path / 'scans', budget=0)
+    kept = tmp_path / 'kept'
+    kept.mkdir()
+    for name in ('gone', 'evicted'):
+        folder = tmp_path / name
+        folder.mkdir()
+        with store.refreshing(folder) as claimed:
+            assert claimed
+        store.save(folder, {})
+    (tmp_path / 'gone').rmdir()
+    store.save(kept, {})  # Collects the vanished folder's cache and evicts the other
+    
+    kept_file = store.cache_file(kept)
+    left = {path.name for path in (tmp_path / 'scans').iterdir() if path.suffix in ('.col', '.lock', '.refresh')}
+    assert left == {kept_file.name, kept_file.with_suffix('.lock').name, 'manifest.lock'}
+
+
+def test_lock_on_a_removed_lock_file_is_taken_again(tmp_path):
+    store = ScanCacheStore(tmp_path / 'scans')
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    store.save(folder, {})
+    cache_file = store.cache_file(folder)
+    lock_path = cache_file.with_suffix('.lock')
+    stale = open(lock_path, 'a')
+    store.remove(cache_file)
+    assert not lock_path.exists()
+    with store.cache_lock(cache_file, exclusive=True):
+        # The new lock file is locked, the unlinked one a waiter had open is not
+        fcntl.flock(stale, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with open(lock_path, 'a') as current:
+            try:
+                fcntl.flock(current, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = False
+            except BlockingIOError:
+                locked = True
+        assert locked
+    stale.close()
+
+
+def test_watcher_heartbeat_does_not_rewrite_clean_trees(tmp_path, monkeypatch):
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    (folder / 'a.jpg').write_bytes(b'\xff\xd8\xff')
+    selector = MediaFileSelector()
+    selector.cache_store = ScanCacheStore(tmp_path / 'scans')
+    watcher = LiveIndexWatcher(selector, [str(folder)], interval=30)
+    root = watcher.source_folders[0]
+    watcher.scan_filters[root] = ScanFilter(selector, None, content=False).bind(root)
+    watcher.rescan(root)
+    watcher.flush()
+    writes = []
+    write = ColumnarTreeCache.write
+    
+    def recording_write(*args, **kwargs):
+        writes.append(args[0])
+        return write(*args, **kwargs)
+    monkeypatch.setattr(ColumnarTreeCache, 'write', recording_write)
+    
+    mapped = selector.load_scan_tree(root, watcher.scope)['dirs']
+    watcher.flush(live=False)
+    assert writes == []
+    assert mapped.live_until == 0
+    assert selector.load_scan_tree(root, watcher.scope)['live_until'] == 0
+    watcher.flush()
+    assert writes == [] and mapped.live_until > time.time()
+    
+    watcher.dirty.add(root)
+    watcher.flush()
+    assert len(writes) == 1
+
+
+def test_scopes_keep_separate_caches(tmp_path):
+    store = ScanCacheStore(tmp_path / 'scans')
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    jpegs, pngs = ScanFilter.scope_key({'include': ['*.jpg']}), ScanFilter.scope_key({'include': ['*.png']})
+    store.save(folder, {str(folder): (None, [], [])}, jpegs)
+    store.save(folder, {}, pngs)
+    assert store.cache_file(folder, jpegs) != store.cache_file(folder, pngs)
+    assert len(store.load(folder, jpegs)) == 1 and len(store.load(folder, pngs)) == 0
+    assert store.load(folder) is None
+    assert sorted(entry['scope'] for entry in store.entries()) == [[['*.jpg'], [], None], [['*.png'], [], None]]
+
+
+def test_caches_named_without_their_scope_are_collected(tmp_path):
+    store = ScanCacheStore(tmp_path / 'scans')
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    store.save(folder, {})
+    current = store.cache_file(folder)
+    legacy = current.with_name(current.name.rsplit('-', 1)[0] + '.col')
+    current.rename(legacy)
+    store.save(folder, {})
+    assert not legacy.exists() and current.exists()
+
+
+def test_legacy_in_folder_caches_are_only_removed_by_gc(tmp_path):
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    legacy = folder / '.media_cache.pkl'
+    legacy.write_bytes(b'old')
+    selector = MediaFileSelector()
+    store = selector.cache_store = ScanCacheStore(tmp_path / 'scans')
+    selector.collect_media_files_optimized(str(folder))
+    assert legacy.exists()
+    assert store.remove_legacy_caches() == [(legacy, 3)]
+    assert not legacy.exists()
+
+
+def test_cache_reads_batch_usage_into_one_manifest_write(tmp_path, monkeypatch):
+    store = ScanCacheStore(tmp_path / 'scans')
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    store.save(folder, {})
+    store.flush()
+    writes = []
+    manifest = store.manifest
+    
+    def recording_manifest():
+        writes.append(1)
+        return manifest()
+    monkeypatch.setattr(store, 'manifest', recording_manifest)
+    
+    for _ in range(5):
+        assert store.load(folder) is not None
+    store.load(folder, ScanFilter.scope_key({'include': ['*.jpg']}))
+    assert [entry.get('hits') for entry in store.entries()] == [5]
+    assert writes == []
+    store.flush()
+    store.flush()
+    assert len(writes) == 1
+    entry = store.read_manifest()[store.cache_file(folder).name]
+    assert (entry['hits'], entry.get('misses', 0)) == (5, 0)
@@ -0,0 +1,111 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+from Smart_Media_Sampler import MediaFileSelector, MediaIndex, MetadataCache
+
+
+def make_tree(root):
+    (root / 'a' / 'sub').mkdir(parents=True)
+    (root / 'a' / 'x.jpg').write_bytes(b'\xff\xd8\xff' + bytes(100))
+    (root / 'a' / 'sub' / 'y.png').write_bytes(b'\x89PNG\r\n\x1a\n' + bytes(200))
+    (root / 'a' / 'notes.txt').write_text('not media')
+
+
+def test_index_resolves_symlinked_sources(tmp_path):
+    make_tree(tmp_path / 'tree')
+    link = tmp_path / 'link_a'
+    os.symlink(tmp_path / 'tree' / 'a', link)
+    selector = MediaFileSelector()
+    index = MediaIndex(tmp_path / 'index.db')
+    try:
+        index.update(selector, str(link))
+        assert list(index.roots()) == [os.path.realpath(link)]
+        assert index.find_root(str(link / 'sub')) == os.path.realpath(link)
+        selected = selector.select_from_index(index, [os.path.realpath(link)], num_files=5)
+        assert sorted(f['path'].name for f in selected) == ['x.jpg', 'y.png']
+    finally:
+        index.close()
+
+
+def test_index_round_trip(tmp_path):
+    make_tree(tmp_path / 'tree')
+    root = str(tmp_path / 'tree')
+    os.utime(tmp_path / 'tree' / 'a' / 'x.jpg', ns=(1, 1625423405123456000))
+    selector = MediaFileSelector()
+    index = MediaIndex(tmp_path / 'index.db')
+    try:
+        index.update(selector, root)
+        records = [index.row_to_record(row) for row in index.query(selector, [root])]
+        assert [record['path'] for record in records] == [tmp_path / 'tree' / 'a' / 'sub' / 'y.png',
+                                                            tmp_path / 'tree' / 'a' / 'x.jpg']
+        for record in records:
+            stat = record['path'].stat()
+            assert record['size'] == stat.st_size
+            assert record['modified'] == datetime.fromtimestamp(stat.st_mtime)
+            assert record['extension'] == record['path'].suffix
+            assert record['type'] == 'image'
+        
+        fields = {'path': Path(root, 'c.mp4'), 'size': 5, 'created': datetime(2021, 7, 4, 18, 30),
+                  'modified': datetime(2021, 7, 4, 18, 30, 5, 250000), 'extension': '.mp4', 'type': 'video',
+                  'duration': 12.5, 'codec': 'avc1', 'gps': [48.8566667, -2.35]}
+        row = index.file_row(root, fields)
+        assert row[1] == root
+        assert index.row_to_record(row[:1] + row[2:]) == fields
+    finally:
+        index.close()
+
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\rIHDR' + width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes(8)
+
+
+def test_index_metadata_filters_parse_in_one_batch(tmp_path, monkeypatch):
+    for i in range(3):
+        folder = tmp_path / 'src' / f'd{i}'
+        folder.mkdir(parents=True)
+        (folder / 'wide.png').write_bytes(png(1920, 1080))
+        (folder / 'tall.png').write_bytes(png(1080, 1920))
+        (folder / 'small.png').write_bytes(png(100, 100))
+    selector = MediaFileSelector()
+    selector.metadata_cache = MetadataCache(tmp_path / 'metadata.db')
+    batches = []
+    load_media_metadata = selector.load_media_metadata
+    
+    def counting_load(files_data, fields):
+        batches.append(len(files_data))
+        load_media_metadata(files_data, fields)
+    monkeypatch.setattr(selector, 'load_media_metadata', counting_load)
+    index = MediaIndex(tmp_path / 'index.db')
+    try:
+        index.update(selector, str(tmp_path / 'src'))
+        folders = [str(tmp_path / 'src' / f'd{i}') for i in range(3)]
+        filters = {'min_width': 1000, 'orientation': 'landscape'}
+        selected = selector.select_from_index(index, folders, num_files=10, filters=filters, balanced=True)
+        assert sorted(f['path'].name for f in selected) == ['wide.png'] * 3
+        assert batches == [9]
+    finally:
+        index.close()
+
+
+def test_index_migrates_old_rows_once(tmp_path):
+    db_path = tmp_path / 'index.db'
+    index = MediaIndex(db_path)
+    heic = ('/src/a.heic', '/src', 1, 0.0, 0.0, '.heic', 'video', None)
+    with index.conn:
+        index.conn.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', heic)
+        index.conn.execute('PRAGMA user_version = 0')  # As written before versioning
+    index.close()
+    
+    index = MediaIndex(db_path)
+    assert index.conn.execute('SELECT media_type FROM files').fetchone() == ('image',)
+    assert index.conn.execute('PRAGMA user_version').fetchone() == (MediaIndex.SCHEMA_VERSION,)
+    with index.conn:
+        index.conn.execute("UPDATE files SET media_type = 'video'")
+    index.close()
+    
+    index = MediaIndex(db_path)
+    try:
+        assert index.conn.execute('SELECT media_type FROM files').fetchone() == ('video',)
+    finally:
+        index.close()
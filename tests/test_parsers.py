@@ -0,0 +1,313 @@
+import struct
+
+import pytest
+
+from Smart_Media_Sampler import (ContentSniffer, EbmlReader, ImageHeader, LocalFilesystem, MediaFileSelector,
+                                 MetadataCache)
+
+
+def tiff(ifds, endian='<'):
+    """TIFF data with the given IFDs laid out one after another.
+    
+    Each IFD is a list of (tag, type, count, value bytes); a value of None is
+    replaced by the offset of the next IFD in the list (for Exif/GPS pointers).
+    """
+    def layout(offsets):
+        blocks = []
+        pointers = iter(offsets[1:])
+        for ifd, offset in zip(ifds, offsets):
+            data_offset = offset + 2 + 12 * len(ifd) + 4
+            entries = struct.pack(endian + 'H', len(ifd))
+            overflow = b''
+            for tag, value_type, count, value in ifd:
+                if value is None:
+                    value = struct.pack(endian + 'I', next(pointers))
+                if len(value) > 4:
+                    raw = struct.pack(endian + 'I', data_offset + len(overflow))
+                    overflow += value
+                else:
+                    raw = value.ljust(4, b'\x00')
+                entries += struct.pack(endian + 'HHI', tag, value_type, count) + raw
+            blocks.append(entries + bytes(4) + overflow)
+        return blocks
+    
+    offsets = [8] * len(ifds)
+    for _ in range(2):  # Block sizes don't depend on the offsets
+        blocks = layout(offsets)
+        offsets = [8 + sum(map(len, blocks[:i])) for i in range(len(blocks))]
+    magic = b'II*\x00' if endian == '<' else b'MM\x00*'
+    return magic + struct.pack(endian + 'I', 8) + b''.join(layout(offsets))
+
+
+def ascii_value(text):
+    data = text.encode('ascii') + b'\x00'
+    return (2, len(data), data)
+
+
+def rationals(*pairs):
+    return (5, len(pairs), b''.join(struct.pack('<II', *pair) for pair in pairs))
+
+
+def exif_tiff(orientation=1):
+    ifd0 = [(0x010F, *ascii_value('Canon')), (0x0110, *ascii_value('EOS R5')),
+            (0x0112, 3, 1, struct.pack('<H', orientation)), (0x8769, 4, 1, None), (0x8825, 4, 1, None)]
+    exif = [(0x9003, *ascii_value('2021:07:04 18:30:05'))]
+    gps = [(1, *ascii_value('N')), (2, *rationals((48, 1), (51, 1), (2400, 100))),
+           (3, *ascii_value('W')), (4, *rationals((2, 1), (21, 1), (0, 1)))]
+    return tiff([ifd0, exif, gps])
+
+
+def jpeg(width, height, app1=b''):
+    segments = b''
+    if app1:
+        segments += b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+    segments += b'\xff\xdb' + struct.pack('>H', 67) + bytes(65)  # Quantisation table before the frame
+    frame = struct.pack('>BHHB', 8, height, width, 3) + bytes(9)
+    segments += b'\xff\xc0' + struct.pack('>H', len(frame) + 2) + frame
+    return b'\xff\xd8' + segments + b'\xff\xda\x00\x02' + bytes(100) + b'\xff\xd9'
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload, version=0):
+    return box(box_type, bytes([version, 0, 0, 0]) + payload)
+
+
+def mp4(width, height, timescale=600, duration=6000, codec=b'avc1', rotated=False, moov_last=False):
+    mvhd = full_box(b'mvhd', struct.pack('>IIII', 0, 0, timescale, duration) + bytes(80))
+    matrix = (0, 0x10000, 0, -0x10000, 0, 0, 0, 0, 0x40000000) if rotated else \
+        (0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    tkhd = full_box(b'tkhd', bytes(36) + struct.pack('>9i', *matrix) + struct.pack('>II', width << 16, height << 16))
+    sound = box(b'trak', full_box(b'tkhd', bytes(80)) + box(b'mdia', full_box(b'hdlr', bytes(4) + b'soun' + bytes(12))))
+    stsd = full_box(b'stsd', struct.pack('>II', 1, 86) + codec + bytes(78))
+    mdia = box(b'mdia', full_box(b'hdlr', bytes(4) + b'vide' + bytes(12))
+               + box(b'minf', box(b'stbl', stsd)))
+    moov = box(b'moov', mvhd + sound + box(b'trak', tkhd + mdia))
+    mdat = box(b'mdat', bytes(5000))
+    ftyp = box(b'ftyp', b'isom' + bytes(4) + b'isomavc1')
+    return ftyp + (mdat + moov if moov_last else moov + mdat)
+
+
+def heif(width, height, rotation=0, exif=None):
+    def meta(exif_offset):
+        infe = [full_box(b'infe', struct.pack('>HH4s', 1, 0, b'hvc1') + b'\x00', version=2)]
+        if exif is not None:
+            infe.append(full_box(b'infe', struct.pack('>HH4s', 2, 0, b'Exif') + b'\x00', version=2))
+        ipco = box(b'ipco', full_box(b'ispe', struct.pack('>II', width, height)) + box(b'irot', bytes([rotation])))
+        ipma = full_box(b'ipma', struct.pack('>IHB', 1, 1, 2) + bytes([0x81, 0x02]))
+        iloc = full_box(b'iloc', bytes([0x44, 0x00]) + struct.pack('>H', 1)
+                        + struct.pack('>HHHII', 2, 0, 1, exif_offset, len(exif or b'') + 4))
+        return full_box(b'meta', full_box(b'hdlr', bytes(4) + b'pict' + bytes(13))
+                        + full_box(b'pitm', struct.pack('>H', 1))
+                        + full_box(b'iinf', struct.pack('>H', len(infe)) + b''.join(infe))
+                        + box(b'iprp', ipco + ipma) + iloc)
+    
+    ftyp = box(b'ftyp', b'heic' + bytes(4) + b'mif1heic')
+    start = len(ftyp) + len(meta(0)) + 8  # Exif item data at the start of mdat
+    item = b'\x00\x00\x00\x00' + exif if exif is not None else b''
+    return ftyp + meta(start) + box(b'mdat', item + bytes(100))
+
+
+def ebml(element_id, payload):
+    return (element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+            + ((1 << 56) | len(payload)).to_bytes(8, 'big') + payload)
+
+
+def matroska(width, height, duration_ms, codec='V_VP9', doc_type='webm', info_after_clusters=False):
+    header = ebml(EbmlReader.EBML, ebml(0x4282, doc_type.encode('ascii')))
+    info = ebml(EbmlReader.INFO, ebml(EbmlReader.TIMECODE_SCALE, (1000000).to_bytes(3, 'big'))
+                + ebml(EbmlReader.DURATION, struct.pack('>d', duration_ms)))
+    audio = ebml(EbmlReader.TRACK_ENTRY, ebml(EbmlReader.TRACK_TYPE, b'\x02') + ebml(EbmlReader.CODEC_ID, b'A_OPUS'))
+    video = ebml(EbmlReader.TRACK_ENTRY, ebml(EbmlReader.TRACK_TYPE, b'\x01')
+                 + ebml(EbmlReader.CODEC_ID, codec.encode('ascii'))
+                 + ebml(EbmlReader.VIDEO, ebml(EbmlReader.PIXEL_WIDTH, width.to_bytes(2, 'big'))
+                        + ebml(EbmlReader.PIXEL_HEIGHT, height.to_bytes(2, 'big'))))
+    tracks = ebml(EbmlReader.TRACKS, audio + video)
+    cluster = ebml(EbmlReader.CLUSTER, bytes(4000))
+    if not info_after_clusters:
+        return header + ebml(EbmlReader.SEGMENT, info + tracks + cluster)
+    
+    def seek_head(info_position, tracks_position):
+        seeks = b''
+        for element_id, position in ((EbmlReader.INFO, info_position), (EbmlReader.TRACKS, tracks_position)):
+            seeks += ebml(EbmlReader.SEEK, ebml(EbmlReader.SEEK_ID, element_id.to_bytes(4, 'big'))
+                          + ebml(EbmlReader.SEEK_POSITION, position.to_bytes(4, 'big')))
+        return ebml(EbmlReader.SEEK_HEAD, seeks)
+    info_position = len(seek_head(0, 0)) + len(cluster)
+    body = seek_head(info_position, info_position + len(info)) + cluster + info + tracks
+    return header + ebml(EbmlReader.SEGMENT, body)
+
+
+def read(tmp_path, name, data, reader):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return getattr(MediaFileSelector(), reader)(path)
+
+
+def test_jpeg_dimensions_follow_the_frame_header(tmp_path):
+    assert read(tmp_path, 'a.jpg', jpeg(4000, 3000), 'read_image_metadata') == {'width': 4000, 'height': 3000}
+    progressive = jpeg(640, 480).replace(b'\xff\xc0', b'\xff\xc2')
+    assert read(tmp_path, 'b.jpg', progressive, 'read_image_metadata') == {'width': 640, 'height': 480}
+    padded = jpeg(320, 200).replace(b'\xff\xdb', b'\xff\xff\xff\xdb')  # Fill bytes before a marker
+    assert read(tmp_path, 'c.jpg', padded, 'read_image_metadata') == {'width': 320, 'height': 200}
+    assert read(tmp_path, 'd.jpg', jpeg(100, 100)[:30], 'read_image_metadata') == {}
+    gap = jpeg(32, 16).replace(b'\xff\xc0', bytes(1000) + b'\xff\xc0')  # Stray bytes before a marker
+    assert read(tmp_path, 'e.jpg', gap, 'read_image_metadata') == {'width': 32, 'height': 16}
+
+
+def test_jpeg_resync_gives_up_on_long_runs_of_stray_bytes(tmp_path):
+    data = jpeg(32, 16).replace(b'\xff\xdb', bytes(1 << 20) + b'\xff\xdb')
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(data)
+    with open(path, 'rb') as f:
+        assert ImageHeader.dimensions(f) is None
+        assert f.tell() < 2 * ImageHeader.JPEG_RESYNC_LIMIT
+
+
+def test_jpeg_exif_fields(tmp_path):
+    fields = read(tmp_path, 'a.jpg', jpeg(4000, 3000, b'Exif\x00\x00' + exif_tiff()), 'read_image_metadata')
+    assert fields == {
+        'date_taken': '2021-07-04 18:30:05', 'camera_make': 'Canon', 'camera_model': 'EOS R5',
+        'exif_orientation': 1, 'gps': [48.8566667, -2.35], 'width': 4000, 'height': 3000,
+    }
+    rotated = read(tmp_path, 'b.jpg', jpeg(4000, 3000, b'Exif\x00\x00' + exif_tiff(orientation=6)),
+                   'read_image_metadata')
+    assert (rotated['exif_orientation'], rotated['width'], rotated['height']) == (6, 3000, 4000)
+    xmp = read(tmp_path, 'c.jpg', jpeg(10, 20, b'http://ns.adobe.com/xap/1.0/\x00<x/>'), 'read_image_metadata')
+    assert xmp == {'width': 10, 'height': 20}
+
+
+@pytest.mark.parametrize('data, size', [
+    (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + struct.pack('>II', 1920, 1080) + bytes(20), (1920, 1080)),
+    (b'GIF89a' + struct.pack('<HH', 320, 240) + bytes(30), (320, 240)),
+    (b'GIF87a' + struct.pack('<HH', 1, 2) + bytes(30), (1, 2)),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 \x00\x00\x00\x00\x00\x00\x00\x9d\x01\x2a' + struct.pack('<HH', 800, 600)
+     + bytes(10), (800, 600)),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8L\x00\x00\x00\x00\x2f' + struct.pack('<I', 1023 | (767 << 14)) + bytes(10),
+     (1024, 768)),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8X\x0a\x00\x00\x00\x10\x00\x00\x00' + (4095).to_bytes(3, 'little')
+     + (2159).to_bytes(3, 'little') + bytes(10), (4096, 2160)),
+    (b'BM' + bytes(12) + struct.pack('<Iii', 40, 640, -480) + bytes(30), (640, 480)),
+    (b'BM' + bytes(12) + struct.pack('<IHH', 12, 64, 32) + bytes(30), (64, 32)),
+    (tiff([[(256, 3, 1, struct.pack('<H', 1200)), (257, 4, 1, struct.pack('<I', 900))]]), (1200, 900)),
+    (tiff([[(256, 4, 1, struct.pack('>I', 70000)), (257, 3, 1, struct.pack('>H', 50))]], endian='>'), (70000, 50)),
+])
+def test_image_dimensions(tmp_path, data, size):
+    fields = read(tmp_path, 'image', data, 'read_image_metadata')
+    assert (fields['width'], fields['height']) == size
+
+
+def test_unrecognised_images_have_no_fields(tmp_path):
+    assert read(tmp_path, 'a.png', b'not an image at all, just text', 'read_image_metadata') == {}
+    assert read(tmp_path, 'c.bmp', b'BMW notes and such, plain text here', 'read_image_metadata') == {}
+    assert read(tmp_path, 'b.png', b'', 'read_image_metadata') == {}
+
+
+def test_tiff_exif_fields(tmp_path):
+    data = exif_tiff()
+    fields = read(tmp_path, 'a.tiff', data, 'read_image_metadata')
+    assert fields['camera_make'] == 'Canon'
+    assert fields['date_taken'] == '2021-07-04 18:30:05'
+
+
+def test_mp4_movie_info(tmp_path):
+    expected = {'duration': 10.0, 'width': 1920, 'height': 1080, 'codec': 'avc1'}
+    assert read(tmp_path, 'a.mp4', mp4(1920, 1080), 'read_mp4_metadata') == expected
+    assert read(tmp_path, 'b.mp4', mp4(1920, 1080, moov_last=True), 'read_mp4_metadata') == expected
+    portrait = read(tmp_path, 'c.mov', mp4(1920, 1080, rotated=True, codec=b'hvc1'), 'read_mp4_metadata')
+    assert portrait == {'duration': 10.0, 'width': 1080, 'height': 1920, 'codec': 'hvc1'}
+    assert read(tmp_path, 'd.mp4', box(b'ftyp', b'isom' + bytes(4)) + box(b'mdat', bytes(64)),
+                'read_mp4_metadata') == {}
+
+
+def test_mp4_large_box_sizes(tmp_path):
+    mdat = struct.pack('>I4sQ', 1, b'mdat', 16 + 3000) + bytes(3000)
+    data = box(b'ftyp', b'isom' + bytes(4)) + mdat + mp4(640, 360)[len(box(b'ftyp', b'isom' + bytes(4) + b'isomavc1')):]
+    assert read(tmp_path, 'a.mp4', data, 'read_mp4_metadata')['width'] == 640
+
+
+def test_heif_size_rotation_and_exif(tmp_path):
+    assert read(tmp_path, 'a.heic', heif(4032, 3024), 'read_heif_metadata') == {'width': 4032, 'height': 3024}
+    assert read(tmp_path, 'b.heic', heif(4032, 3024, rotation=1), 'read_heif_metadata') == {
+        'width': 3024, 'height': 4032}
+    fields = read(tmp_path, 'c.heic', heif(4032, 3024, exif=exif_tiff(orientation=6)), 'read_heif_metadata')
+    assert fields['camera_model'] == 'EOS R5'
+    assert fields['date_taken'] == '2021-07-04 18:30:05'
+    assert (fields['width'], fields['height']) == (4032, 3024)  # irot, not the EXIF orientation, rotates HEIF
+    assert read(tmp_path, 'd.heic', box(b'ftyp', b'heic' + bytes(4)), 'read_heif_metadata') == {}
+
+
+def test_matroska_movie_info(tmp_path):
+    expected = {'duration': 12.5, 'width': 1280, 'height': 720, 'codec': 'V_VP9'}
+    assert read(tmp_path, 'a.webm', matroska(1280, 720, 12500.0), 'read_matroska_metadata') == expected
+    late = matroska(1280, 720, 12500.0, info_after_clusters=True)
+    assert read(tmp_path, 'b.webm', late, 'read_matroska_metadata') == expected
+    mkv = matroska(3840, 2160, 1000.0, codec='V_MPEGH/ISO/HEVC', doc_type='matroska')
+    assert read(tmp_path, 'c.mkv', mkv, 'read_matroska_metadata') == {
+        'duration': 1.0, 'width': 3840, 'height': 2160, 'codec': 'V_MPEGH/ISO/HEVC'}
+
+
+@pytest.mark.parametrize('name, data', [
+    ('a.mkv', b'\x1a\x45\xdf\xa3\x80'),
+    ('b.webm', matroska(16, 16, 1.0)[:60]),
+    ('c.mp4', mp4(16, 16)[:100]),
+    ('d.heic', heif(16, 16)[:90]),
+    ('e.jpg', b'\xff\xd8\xff\xe1\x00\x10Exif\x00\x00II*\x00\xff\xff'),
+])
+def test_malformed_files_parse_to_no_fields(tmp_path, name, data):
+    (tmp_path / name).write_bytes(data)
+    selector = MediaFileSelector()
+    selector.metadata_cache = MetadataCache(tmp_path / 'metadata.db')
+    metadata = selector.get_media_metadata(tmp_path / name, parse=True)
+    assert set(metadata) <= {'type', 'width', 'height', 'duration'}
+    assert metadata['type'] in ('image', 'video')
+
+
+@pytest.mark.parametrize('data, names', [
+    (jpeg(1, 1), ('.jpg', '.jpeg')),
+    (b'\x89PNG\r\n\x1a\n' + bytes(24), ('.png',)),
+    (b'GIF89a' + bytes(26), ('.gif',)),
+    (b'RIFF\x00\x00\x00\x00WEBPVP8 ' + bytes(16), ('.webp',)),
+    (b'RIFF\x00\x00\x00\x00AVI LIST' + bytes(16), ('.avi',)),
+    (b'BM' + bytes(12) + struct.pack('<I', 124) + bytes(14), ('.bmp',)),
+    (b'BMW notes and such, plain text here', ()),
+    (tiff([[(256, 3, 1, b'\x01\x00')]]), ('.tiff',)),
+    (mp4(16, 16), ('.mp4', '.m4v', '.mov')),
+    (box(b'ftyp', b'qt  ' + bytes(8)), ('.mov', '.mp4', '.m4v')),
+    (box(b'ftyp', b'M4A ' + bytes(8)), ()),
+    (box(b'ftyp', b'mp42' + bytes(4) + b'mp42isom'), ('.mp4', '.m4v', '.mov')),
+    (box(b'ftyp', b'avif' + bytes(4) + b'avifmif1miafMA1A'), ()),
+    (box(b'ftyp', b'mif1' + bytes(4) + b'mif1avifmiaf'), ()),
+    (box(b'ftyp', b'avis' + bytes(4) + b'avismsf1'), ()),
+    (box(b'ftyp', b'crx ' + bytes(4) + b'crx isom'), ()),
+    (box(b'mdat', bytes(24)), ('.mov', '.mp4', '.m4v')),
+    (heif(16, 16), ('.heic', '.heif')),
+    (box(b'ftyp', b'mif1' + bytes(8)), ('.heif', '.heic')),
+    (matroska(16, 16, 1.0), ('.webm', '.mkv')),
+    (matroska(16, 16, 1.0, doc_type='matroska'), ('.mkv', '.webm')),
+    (b'FLV\x01\x05' + bytes(27), ('.flv',)),
+    (b'', ()),
+])
+def test_content_detection(data, names):
+    assert ContentSniffer.detect(data[:ContentSniffer.HEAD_BYTES]) == names
+
+
+def test_content_classification(tmp_path):
+    files = {
+        'renamed.jpg': b'\x89PNG\r\n\x1a\n' + bytes(24),
+        'photo.jpeg': jpeg(1, 1),
+        'clip': mp4(16, 16),
+        'readme': b'plain text',
+        'broken.png': b'plain text',
+    }
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+    paths = [tmp_path / name for name in files] + [tmp_path / 'missing.gif']
+    extensions = ['.jpg', '.jpeg', '', '', '.png', '.gif']
+    sniffer = ContentSniffer(LocalFilesystem(), trusted={'.gif'}, extensionless=True)
+    assert sniffer.classify(paths, extensions) == ['.png', '.jpeg', '.mp4', None, '.png', '.gif']
+    
+    many = [tmp_path / 'renamed.jpg'] * (ContentSniffer.BATCH * 2 + 1)  # Read on the pool in batches
+    assert sniffer.classify(many, ['.jpg'] * len(many)) == ['.png'] * len(many)
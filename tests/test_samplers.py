@@ -0,0 +1,211 @@
+import os
+import random
+
+import pytest
+
+import Smart_Media_Sampler
+from Smart_Media_Sampler import (BudgetSampler, MediaFileSelector, MetadataCache, ReservoirSampler, ScanCacheStore,
+                                 StreamingSelector)
+
+
+CHI_SQUARE_999 = 43.82  # 99.9th percentile of chi-square with 19 degrees of freedom
+
+
+def selection_counts(sample, population=20, trials=20000):
+    """How often each of population items was selected over trials runs of sample(items)"""
+    counts = [0] * population
+    for _ in range(trials):
+        for item in sample([{'id': i, 'size': 10} for i in range(population)]):
+            counts[item['id']] += 1
+    return counts
+
+
+def chi_square(counts):
+    expected = sum(counts) / len(counts)
+    return sum((count - expected) ** 2 / expected for count in counts)
+
+
+def reservoir_sample(items):
+    sampler = ReservoirSampler(5)
+    for item in items:
+        sampler.add(item)
+    return sampler.items
+
+
+def streaming_sample(expected_count, items):
+    selector = StreamingSelector(expected_count, None, num_files=5)
+    selected = [item for item in items if selector.offer(item)]
+    return selected + selector.finish()
+
+
+def budget_sample(items):
+    sampler = BudgetSampler(50)
+    for item in items:
+        sampler.add(item)
+    return sampler.select()
+
+
+@pytest.mark.parametrize('sample', [
+    pytest.param(reservoir_sample, id='reservoir'),
+    pytest.param(lambda items: streaming_sample(20, items), id='streaming'),
+    # Population overestimated, finish() tops up
+    pytest.param(lambda items: streaming_sample(30, items), id='streaming-overestimate'),
+    pytest.param(budget_sample, id='budget'),
+])
+def test_samplers_select_uniformly(sample):
+    random.seed(11)
+    counts = selection_counts(sample)
+    assert sum(counts) == 5 * 20000
+    assert chi_square(counts) < CHI_SQUARE_999
+
+
+def test_streaming_size_mode_stays_within_budget():
+    random.seed(12)
+    for _ in range(200):
+        sizes = [random.randint(1, 100) for _ in range(100)]
+        selector = StreamingSelector(len(sizes), sum(sizes), target_bytes=1000)
+        selected = [size for size in sizes if selector.offer({'size': size})]
+        selected += [f['size'] for f in selector.finish()]
+        assert 900 <= sum(selected) <= 1000
+
+
+def budget_fill(select, size, budget, trials, count=2000):
+    """Mean bytes selected and mean number of files of at most 50 bytes selected"""
+    filled = small = 0
+    for _ in range(trials):
+        files = [{'size': size()} for _ in range(count)]
+        selected = select(files, budget)
+        filled += sum(f['size'] for f in selected)
+        small += sum(f['size'] <= 50 for f in selected)
+    return filled / trials, small / trials
+
+
+def reservoir_budget(files, budget):
+    sampler = BudgetSampler(budget)
+    for file_data in files:
+        sampler.add(file_data)
+    return sampler.select()
+
+
+def shuffled_budget(files, budget):
+    return MediaFileSelector().select_by_total_size(files, f'{budget}B')
+
+
+@pytest.mark.parametrize('size, budget', [
+    (lambda: random.randint(1, 10), 100),
+    (lambda: random.choice([random.randint(400, 700), random.randint(1, 50)]), 1000),
+])
+def test_budget_sampler_fills_like_shuffled_greedy(size, budget):
+    random.seed(6)
+    sampled = budget_fill(reservoir_budget, size, budget, trials=200)
+    shuffled = budget_fill(shuffled_budget, size, budget, trials=200)
+    assert sampled[0] == pytest.approx(shuffled[0], rel=0.01)
+    assert sampled[1] == pytest.approx(shuffled[1], rel=0.1)
+
+
+def test_budget_sampler_matches_greedy_fill_over_its_keys():
+    random.seed(7)
+    files = [{'size': random.randint(1, 10 ** 6)} for _ in range(50000)]
+    budget = 10 ** 7
+    random.seed(8)
+    keys = [random.random() for f in files if f['size'] <= budget]
+    random.seed(8)
+    sampler = BudgetSampler(budget)
+    for file_data in files:
+        sampler.add(file_data)
+    
+    expected = []
+    total = 0
+    for _, file_data in sorted(zip(keys, files), key=lambda pair: pair[0]):
+        if total + file_data['size'] <= budget:
+            expected.append(file_data)
+            total += file_data['size']
+    assert [id(f) for f in sampler.select()] == [id(f) for f in expected]
+    assert len(sampler.entries) < len(files) // 10
+
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\rIHDR' + width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes(8)
+
+
+def test_reservoir_metadata_filters_share_one_worker_pool(tmp_path, monkeypatch):
+    for d in range(5):
+        folder = tmp_path / 'src' / f'd{d}'
+        folder.mkdir(parents=True)
+        for i in range(10):
+            (folder / f'{i}.png').write_bytes(png(2000 if i % 2 else 50, 1000))
+    started = []
+    
+    class CountingPool(Smart_Media_Sampler.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            started.append(self)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(Smart_Media_Sampler, 'ProcessPoolExecutor', CountingPool)
+    selector = MediaFileSelector()
+    selector.metadata_cache = MetadataCache(tmp_path / 'metadata.db')
+    selector.metadata_workers = 2
+    selector.METADATA_BATCH = 4
+    selected = selector.select_by_reservoir([str(tmp_path / 'src')], num_files=100, filters={'min_width': 1000})
+    assert len(selected) == 25
+    assert all(f['width'] == 2000 for f in selected)
+    assert len(started) == 1
+
+
+def test_reservoir_offers_hard_linked_files_once(tmp_path, capsys):
+    source = tmp_path / 'src'
+    for d in ('a', 'b'):
+        (source / d).mkdir(parents=True)
+    for i in range(20):
+        (source / 'a' / f'{i}.jpg').write_bytes(b'\xff\xd8\xff' + bytes(i + 1))
+        os.link(source / 'a' / f'{i}.jpg', source / 'b' / f'{i}.jpg')
+    selector = MediaFileSelector()
+    selected = selector.select_by_reservoir([str(source)], num_files=20, filters={'min_size': '1B'})
+    assert sorted(f['size'] for f in selected) == [i + 4 for i in range(20)]
+    assert 'Skipped' not in capsys.readouterr().out
+
+
+def test_pipeline_offers_each_file_once_and_uses_the_scan_method(tmp_path, monkeypatch):
+    source = tmp_path / 'src'
+    for d in ('a', 'b'):
+        (source / d).mkdir(parents=True)
+    for i in range(20):
+        (source / 'a' / f'{i}.jpg').write_bytes(b'\xff\xd8\xff' + bytes(i))
+        os.link(source / 'a' / f'{i}.jpg', source / 'b' / f'{i}.jpg')
+    selector = MediaFileSelector()
+    selector.cache_store = ScanCacheStore(tmp_path / 'scans')
+    selector.metadata_cache = MetadataCache(tmp_path / 'metadata.db')
+    selector.collect_media_files_optimized(str(source))  # The pipeline sizes the population from the cache
+    walks = []
+    scan_folder_async = selector.scan_folder_async
+    
+    def recording_walk(*args, **kwargs):
+        walks.append(args[0])
+        return scan_folder_async(*args, **kwargs)
+    monkeypatch.setattr(selector, 'scan_folder_async', recording_walk)
+    
+    for _ in range(5):
+        selected = selector.run_streaming_pipeline([str(source)], str(tmp_path / 'dest'), num_files=20,
+                                                   dry_run=True, scan_method='async')
+        assert selected == 20
+    assert len(walks) == 5
+
+
+def test_pipeline_copies_same_named_files_from_different_folders(tmp_path, capsys):
+    folders = []
+    for d in range(3):
+        folder = tmp_path / f'src{d}'
+        folder.mkdir()
+        for i in range(3):
+            (folder / f'IMG_{i}.jpg').write_bytes(b'\xff\xd8\xff' + bytes([d, i]))
+        folders.append(str(folder))
+    selector = MediaFileSelector()
+    selector.cache_store = ScanCacheStore(tmp_path / 'scans')
+    for folder in folders:
+        selector.collect_media_files_optimized(folder)
+    dest = tmp_path / 'dest'
+    
+    copied = selector.run_streaming_pipeline(folders, str(dest), num_files=9, max_workers=4)
+    assert copied == 9
+    assert sorted(f.read_bytes() for f in dest.glob('*.jpg')) == sorted(
+        b'\xff\xd8\xff' + bytes([d, i]) for d in range(3) for i in range(3))
+    assert 'Skipped' not in capsys.readouterr().out
@@ -0,0 +1,24 @@
+import asyncio
+
+from Smart_Media_Sampler import MediaFileSelector
+
+
+def test_async_walk_keeps_pending_coroutines_bounded(tmp_path):
+    for d in range(200):
+        folder = tmp_path / f'd{d}'
+        folder.mkdir()
+        (folder / 'a.jpg').write_bytes(b'\xff\xd8\xff')
+    (tmp_path / 'd0' / 'sub').mkdir()
+    (tmp_path / 'd0' / 'sub' / 'b.png').write_bytes(b'\x89PNG')
+    found = []
+    tasks = []
+    
+    def on_batch(files):
+        found.extend(files)
+        tasks.append(len(asyncio.all_tasks()))
+    selector = MediaFileSelector()
+    selector.scan_folder_async(tmp_path, concurrency=4, on_batch=on_batch)
+    assert sorted(str(f['path']) for f in found) == sorted(str(f['path']) for f in
+                                                           selector.scan_folder_scandir(tmp_path))
+    assert len(found) == 201
+    assert max(tasks) <= 1 + 2 * 4  # The walk, its workers and one stat batch each